@@ -0,0 +1,109 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Micro-benchmark of identifier normalization (identifiers.parseIdentifier)'
+
+# Compares, per call:
+# - inline: the normalization getxcite.py used to do for every query, with regex strings passed to re.search/re.sub
+# - parse: identifiers.parseIdentifier with its memo cleared before every call (precompiled patterns only)
+# - memoized: identifiers.parseIdentifier for identifiers already parsed
+#
+# Usage: python benchmarks/bench_identifiers.py [-n NUMBER]
+
+import os
+import sys
+import argparse
+import timeit
+import re
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from loadusc.constants import (  # noqa: E402
+    IDENTIFIER_TYPE_REGEX,
+    USC_REGEX,
+    NAMED_LAW_REGEX,
+)
+from loadusc.identifiers import parseIdentifier  # noqa: E402
+
+IDENTIFIERS = [
+    '/us/usc/t26/s1',
+    '/uslm/us/usc/t26/stA/ch1/schA/pt1/s1/a/',
+    '/us/usc/t42/s1395w-4/b',
+    '/us/usc/t10/st1/ch1',
+    '/us/pl/116/140/dA/tI/s101',
+    '/us/named/xyz/s2',
+]
+
+
+def parseInline(identifier):
+    queryTerms = None
+    identifier = identifier.replace('-', '–')
+    identifier = re.sub(r'\/$', '', identifier)
+    identifier = re.sub(r'^\/uslm', '', identifier)
+    identifierSearch = re.search(IDENTIFIER_TYPE_REGEX, identifier)
+    identifierType = identifierSearch.group(1)
+    if identifierType == 'pl':
+        identifier = re.sub(
+            r'(\/us\/pl\/[0-9]+\/[0-9]+)\/(?:.*)(\/s[0-9].*$)', r'\1\2', identifier
+        )
+    if identifierType == 'named':
+        namedSearch = re.search(NAMED_LAW_REGEX, identifier)
+        if namedSearch.group(2):
+            queryTerms = [
+                '-match-start',
+                namedSearch.group(1),
+                '-match-end',
+                namedSearch.group(2),
+            ]
+    if identifierType == 'usc':
+        if not re.search(r'\/s[0-9]', identifier):
+            uscSearch = re.search(USC_REGEX, identifier)
+            if uscSearch.group(2):
+                queryTerms = [
+                    '-match-start',
+                    uscSearch.group(1),
+                    '-match-end',
+                    uscSearch.group(2),
+                ]
+        else:
+            identifier = re.sub(
+                r'(\/us\/usc\/t[0-9][^\/]*)\/(?:.*)(\/s[0-9].*$)', r'\1\2', identifier
+            )
+    if queryTerms is None:
+        queryTerms = ['-match', identifier]
+    return queryTerms
+
+
+def parseCold(identifier):
+    parseIdentifier.cache_clear()
+    return parseIdentifier(identifier)
+
+
+def run(number: int):
+    for identifier in IDENTIFIERS:
+        assert list(parseIdentifier(identifier).queryTerms) == parseInline(
+            identifier
+        ), identifier
+    print('{:<10} {:>12}'.format('', 'us/call'))
+    for name, function in [
+        ('inline', parseInline),
+        ('parse', parseCold),
+        ('memoized', parseIdentifier),
+    ]:
+        seconds = timeit.timeit(
+            lambda: [function(identifier) for identifier in IDENTIFIERS],
+            number=number,
+        )
+        print(
+            '{:<10} {:>12.2f}'.format(name, seconds * 1e6 / (number * len(IDENTIFIERS)))
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark identifier normalization.', epilog=''
+    )
+    parser.add_argument(
+        '-n', '--number', type=int, default=20000, help='rounds over the identifiers'
+    )
+    args = parser.parse_args()
+    run(args.number)
@@ -0,0 +1,105 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Benchmark of the release point index parsers (downloadusc.py and releasepointindex.py)'
+
+# Compares, on saved copies of download.shtml and priorreleasepoints.htm (or synthetic pages like them):
+# - soup: the BeautifulSoup parsers of downloadusc.py (getUSCReleasePoints with useCache=False)
+# - lxml: the targeted parsers of releasepointindex.py, for a page that changed
+# - unchanged: releasepointindex.refreshReleasePoints when both pages answer 304 Not Modified
+#
+# Usage: python benchmarks/bench_releasepoints.py [--current download.shtml --prior priorreleasepoints.htm] [-n N]
+
+import os
+import sys
+import argparse
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from loadusc import settings  # noqa: E402
+from fixtures import getSyntheticPages  # noqa: E402
+
+
+class NotModified:
+    status_code = 304
+    headers = {}
+    content = b''
+
+
+def run(current: bytes, prior: bytes, number: int):
+    from loadusc import downloadusc, releasepointindex
+
+    soup = [downloadusc.parseCurrentReleasePointSoup(current)] + (
+        downloadusc.parsePriorReleasePointsSoup(prior)
+    )
+    targeted = [releasepointindex.parseCurrentReleasePoint(current)] + (
+        releasepointindex.parsePriorReleasePoints(prior)
+    )
+    assert soup == targeted, 'The parsers do not agree'
+    print('{} release points, {:.0f} KB'.format(len(soup), len(prior) / 1024))
+
+    def parseSoup():
+        downloadusc.parseCurrentReleasePointSoup(current)
+        downloadusc.parsePriorReleasePointsSoup(prior)
+
+    def parseTargeted():
+        releasepointindex.parseCurrentReleasePoint(current)
+        releasepointindex.parsePriorReleasePoints(prior)
+
+    # Fill the page cache, then time refreshes where the server answers 304
+    pages = {
+        releasepointindex.USC_HTML_PAGE_BASE
+        + releasepointindex.CURRENT_USC_HTML_PAGE: current,
+        releasepointindex.USC_HTML_PAGE_BASE + releasepointindex.USC_HTML_PAGE: prior,
+    }
+
+    class Page:
+        status_code = 200
+
+        def __init__(self, content):
+            self.content = content
+            self.headers = {'ETag': '"1"'}
+
+    releasepointindex.refreshReleasePoints(lambda url, **kwargs: Page(pages[url]))
+
+    def refreshUnchanged():
+        releasepointindex.refreshReleasePoints(lambda url, **kwargs: NotModified())
+
+    print('{:<10} {:>12}'.format('', 'ms/run'))
+    for name, function in [
+        ('soup', parseSoup),
+        ('lxml', parseTargeted),
+        ('unchanged', refreshUnchanged),
+    ]:
+        seconds = timeit.timeit(function, number=number)
+        print('{:<10} {:>12.2f}'.format(name, seconds * 1000 / number))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the release point index parsers.', epilog=''
+    )
+    parser.add_argument('--current', help='a saved copy of download.shtml')
+    parser.add_argument('--prior', help='a saved copy of priorreleasepoints.htm')
+    parser.add_argument(
+        '-r',
+        '--releasepoints',
+        type=int,
+        default=600,
+        help='release points in the synthetic pages, without --current and --prior',
+    )
+    parser.add_argument('-n', '--number', type=int, default=20, help='runs of each')
+    args = parser.parse_args()
+    if args.current and args.prior:
+        with open(args.current, 'rb') as f:
+            current = f.read()
+        with open(args.prior, 'rb') as f:
+            prior = f.read()
+    else:
+        current, prior = getSyntheticPages(args.releasepoints)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'loadusc', 'data'))
+        os.chdir(tmp)
+        settings.configure(MAIN_ROOT_PATH=tmp)
+        run(current, prior, args.number)
@@ -0,0 +1,620 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Benchmark suite of the download, extract, load and query paths, against a stand-in XCiteDB'
+
+# Runs offline, in a temporary directory:
+# - fixtures.py writes synthetic release point directories, their title zips and index pages, which a local HTTP
+#   server (with Last-Modified and If-Modified-Since, like uscode.house.gov) serves
+# - fakexcitedb.py stands in for XCITEDBPATH, with the latency and output sizes of the --fake-* options
+#
+# and reports, for each path, the operations, their throughput and the p50/p95/p99 latency of one operation:
+#
+#   index           releasepointindex.refreshReleasePoints, first run and with the pages unchanged
+#   download        downloadusc.downloadToFile of each title zip
+#   extract         downloadusc.extractZip of each title zip, writing every file (all) or through the blob store (link)
+#   sync            downloadusc.getAndUnzipTitle of each title zip, --workers at a time
+#   load            loaduscxcite.loadXML of each release point (load-xml -r) and title file, and loadDate of each
+#                   date of the plan, with the ledger (again, when everything is loaded)
+#   query           getxcite.getIdentifier with a new XCiteDB process per query (exec) and from the query cache
+#                   (cached); getIdentifiers batches; getChangeDates, also with only one end of the date range
+#
+# --json writes the results; --baseline compares the p50 and p95 of each operation with those of an earlier --json,
+# and exits with 1 if any is slower by more than --tolerance.
+#
+# Usage: python benchmarks/bench_suite.py [--only load query] [--json results.json] [--baseline results.json]
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import contextlib
+import tempfile
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_PATH, '..'))
+
+from loadusc import settings  # noqa: E402
+import fixtures  # noqa: E402
+
+FAKE_XCITEDB_PATH = os.path.join(BENCHMARKS_PATH, 'fakexcitedb.py')
+PATHS = ('index', 'download', 'extract', 'sync', 'load', 'query')
+
+
+def getPercentile(samples, percent: float):
+    """
+    Get the nearest-rank percentile of sorted `samples`
+    """
+    if not samples:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(samples)))
+    return samples[min(rank, len(samples)) - 1]
+
+
+class Measurement:
+    """Latencies of the operations of one benchmark, with the bytes and items they handled."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.items = 0
+        self.bytes = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.start = None
+        self.end = None
+
+    def run(self, function, *args, items: int = 1, nbytes: int = 0, **kwargs):
+        """
+        Run and time one operation; a falsy result or an exception counts as a failure
+        """
+        start = time.perf_counter()
+        if self.start is None:
+            self.start = start
+        try:
+            result = function(*args, **kwargs)
+            ok = result is not False and result is not None
+        except Exception:
+            result = None
+            ok = False
+        end = time.perf_counter()
+        with self.lock:
+            self.latencies.append(end - start)
+            self.items += items
+            self.bytes += nbytes
+            self.failures += 0 if ok else 1
+            self.end = max(self.end or end, end)
+        return result
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        wall = (self.end - self.start) if latencies else 0
+        return {
+            'name': self.name,
+            'operations': len(latencies),
+            'items': self.items,
+            'failures': self.failures,
+            'seconds': wall,
+            'itemsPerSecond': self.items / wall if wall else None,
+            'MBps': self.bytes / 1e6 / wall if wall and self.bytes else None,
+            'p50': getPercentile(latencies, 50),
+            'p95': getPercentile(latencies, 95),
+            'p99': getPercentile(latencies, 99),
+        }
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    latency = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().send_head()
+
+
+def startServer(path: str, latency: float = 0):
+    """
+    Serve the files of `path` on localhost, in a thread
+
+    Returns:
+        tuple: (the server, its base url)
+    """
+    handler = type('Handler', (QuietHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), functools.partial(handler, directory=path)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+
+def setUp(root: str, args):
+    """
+    Write the fixtures under `root`, and point the settings at them and at the stand-in XCiteDB
+
+    Returns:
+        dict: the paths, release points and zips of the fixtures
+    """
+    os.environ.update(
+        {
+            'FAKE_XCITEDB_STARTUP': str(args.fake_startup),
+            'FAKE_XCITEDB_QUERY_LATENCY': str(args.fake_query_latency),
+            'FAKE_XCITEDB_XML_BYTES': str(args.fake_xml_bytes),
+            'FAKE_XCITEDB_LOAD_MBPS': str(args.fake_load_mbps),
+            'FAKE_XCITEDB_LOG_ENTRIES': str(args.fake_log_entries),
+        }
+    )
+    dataPath = os.path.join(root, 'loadusc', 'data')
+    releasepointsPath = os.path.join(root, 'USC_RELEASEPOINTS')
+    servedPath = os.path.join(root, 'served')
+    os.makedirs(dataPath)
+    settings.configure(
+        MAIN_ROOT_PATH=root,
+        XCITEDBPATH=FAKE_XCITEDB_PATH,
+        XMLDBPATH=os.path.join(root, 'xmldb', 'db'),
+        DOCCONFIGPATH=os.path.join(dataPath, 'document.conf'),
+        XCITEDB_QUERY_CACHE_SIZE=0,
+        XCITEDB_QUERY_CACHE_PATH='',
+        LOAD_WORKERS=args.workers,
+    )
+    releasepoints = fixtures.makeReleasePoints(
+        releasepointsPath,
+        args.releasepoints,
+        titles=args.titles,
+        sections=args.sections,
+        sectionBytes=args.section_bytes,
+    )
+    with open(os.path.join(dataPath, 'publawsDict.json'), 'w') as f:
+        json.dump(fixtures.getPublawsDict(releasepoints), f)
+    zips = fixtures.makeTitleZips(
+        releasepointsPath, os.path.join(servedPath, 'zips'), releasepoints
+    )
+    fixtures.writeIndexPages(
+        os.path.join(servedPath, 'pages'), args.index_releasepoints
+    )
+    return {
+        'root': root,
+        'releasepointsPath': releasepointsPath,
+        'servedPath': servedPath,
+        'releasepoints': releasepoints,
+        'zips': zips,
+    }
+
+
+def benchIndex(context: dict, args):
+    from loadusc import releasepointindex
+    import requests
+
+    pagesURL = context['url'] + 'pages/'
+
+    def getter(url, **kwargs):
+        kwargs.pop('verify', None)
+        return requests.get(pagesURL + url.rsplit('/', 1)[-1], **kwargs)
+
+    cold = Measurement('index (first run)')
+    unchanged = Measurement('index (unchanged)')
+    jsonPath = os.path.join(context['root'], 'indexreleasepoints.json')
+    pageCachePath = os.path.join(context['root'], 'pagecache')
+    cold.run(
+        releasepointindex.refreshReleasePoints,
+        getter,
+        jsonPath=jsonPath,
+        pageCachePath=pageCachePath,
+    )
+    for _ in range(args.repeat):
+        unchanged.run(
+            releasepointindex.refreshReleasePoints,
+            getter,
+            jsonPath=jsonPath,
+            pageCachePath=pageCachePath,
+        )
+    return [cold, unchanged]
+
+
+def benchDownload(context: dict, args):
+    from loadusc import downloadusc
+
+    downloadusc.configureDownloads(args.workers, args.workers)
+    measurement = Measurement('download')
+    path = os.path.join(context['root'], 'download.zip')
+    for _, _, relpath in context['zips']:
+        result = measurement.run(
+            downloadusc.downloadToFile, context['url'] + 'zips/' + relpath, path
+        )
+        if result:
+            measurement.bytes += result['bytes']
+    os.remove(path)
+    return [measurement]
+
+
+def benchExtract(context: dict, args):
+    import zipfile
+    from loadusc import downloadusc
+
+    measurements = []
+    zipsPath = os.path.join(context['servedPath'], 'zips')
+    for mode in ('all', 'link'):
+        measurement = Measurement('extract ({})'.format(mode))
+        extractIndex = (
+            downloadusc.ExtractIndex(os.path.join(context['root'], 'extractindex.json'))
+            if mode == 'link'
+            else None
+        )
+        for name, filename, relpath in context['zips']:
+            with zipfile.ZipFile(os.path.join(zipsPath, relpath)) as z:
+                dir_name = os.path.join(context['root'], 'extract-' + mode, name)
+                os.makedirs(dir_name, exist_ok=True)
+                measurement.run(
+                    downloadusc.extractZip,
+                    z,
+                    dir_name,
+                    extractIndex=extractIndex,
+                    nbytes=z.getinfo(filename).file_size,
+                )
+        if extractIndex:
+            extractIndex.save()
+        measurements.append(measurement)
+    return measurements
+
+
+def benchSync(context: dict, args):
+    from loadusc import downloadusc
+
+    workers = downloadusc.configureDownloads(args.workers, args.workers)
+    measurement = Measurement('sync ({} workers)'.format(workers))
+    zipsPath = os.path.join(context['servedPath'], 'zips')
+
+    def sync(name, filename, relpath):
+        measurement.run(
+            downloadusc.getAndUnzipTitle,
+            context['url'] + 'zips/' + relpath,
+            os.path.join(context['root'], 'sync', name),
+            nbytes=os.path.getsize(os.path.join(zipsPath, relpath)),
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in context['zips']:
+            executor.submit(sync, *item)
+    return [measurement]
+
+
+def benchLoad(context: dict, args):
+    from loadusc import loaduscxcite
+    from loadusc.loadledger import LoadLedger
+    from loadusc.loadplan import getPublaws, planLoad, getScheduleFromPlan
+
+    releasepointsPath = context['releasepointsPath']
+    first = context['releasepoints'][-1]['name']
+    releasepointLoad = Measurement('load-xml -r (release point)')
+    for releasepoint in reversed(context['releasepoints']):
+        path = os.path.join(releasepointsPath, releasepoint['name'])
+        releasepointLoad.run(
+            lambda: loaduscxcite.loadXML(path, '01/01/2013')['returncode'] == 0,
+            items=len(os.listdir(path)),
+            nbytes=sum(
+                os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+            ),
+        )
+    titleLoad = Measurement('load-xml (title)')
+    for filename in sorted(os.listdir(os.path.join(releasepointsPath, first))):
+        path = os.path.join(releasepointsPath, first, filename)
+        titleLoad.run(
+            lambda: loaduscxcite.loadXML(path, '01/01/2013', recursive=False)[
+                'returncode'
+            ]
+            == 0,
+            nbytes=os.path.getsize(path),
+        )
+
+    publaws = getPublaws()
+    ledger = LoadLedger()
+    try:
+        plan = planLoad(
+            context['releasepoints'],
+            publaws,
+            ledger=ledger,
+            mode='title',
+            workers=args.workers,
+        )
+        schedule = getScheduleFromPlan(plan)
+        measurements = [releasepointLoad, titleLoad]
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for name in ('loadDate (title mode)', 'loadDate (already loaded)'):
+                measurement = Measurement(name)
+                for date in plan['dates']:
+                    release_date, rpnames = date['date'], [
+                        entry['name'] for entry in date['releasePoints']
+                    ]
+                    measurement.run(
+                        loaduscxcite.loadDate,
+                        release_date,
+                        rpnames,
+                        ledger=ledger,
+                        executor=executor,
+                        items=len(rpnames),
+                    )
+                measurements.append(measurement)
+        # Skipped dates return None: they are not failures
+        measurements[-1].failures = 0
+    finally:
+        ledger.close()
+        publaws.close()
+    context['dates'] = [release_date for release_date, _ in schedule]
+    return measurements
+
+
+def benchQuery(context: dict, args):
+    from loadusc import getxcite
+    from loadusc.querycache import QueryCache
+
+    random.seed(1)
+    dates = context.get('dates') or ['01/01/2014']
+    requests = [
+        (
+            '/us/usc/t{}/s{}'.format(
+                random.randint(1, args.titles), random.randint(1, args.sections)
+            ),
+            datetime.strptime(random.choice(dates), '%m/%d/%Y'),
+        )
+        for _ in range(args.queries)
+    ]
+    measurements = []
+
+    def isSuccess(response):
+        return response.get('success')
+
+    exec_ = Measurement('getIdentifier (exec)')
+    for identifier, date in requests[: max(1, args.queries // 10)]:
+        exec_.run(lambda: isSuccess(getxcite.getIdentifier(identifier, date)))
+    measurements.append(exec_)
+
+    batch = Measurement('getIdentifiers (batch of {})'.format(args.batch))
+    for index in range(0, len(requests), args.batch):
+        chunk = requests[index : index + args.batch]
+        batch.run(
+            lambda: all(isSuccess(item) for item in getxcite.getIdentifiers(chunk)),
+            items=len(chunk),
+        )
+    measurements.append(batch)
+
+    changeDates = Measurement('getChangeDates')
+    for identifier, _ in requests[: max(1, args.queries // 10)]:
+        changeDates.run(
+            lambda: isinstance(getxcite.getChangeDates(identifier), (list, dict))
+        )
+    measurements.append(changeDates)
+
+    def isRangeQueried(identifier, **dates):
+        # One end of the range given: the other is an effective date, not a fallback to the full log
+        _, queryLists, _ = getxcite.getChangeDatesQuery(identifier, **dates)
+        return queryLists[0][:1] == ['-from-date'] and isinstance(
+            getxcite.getChangeDates(identifier, **dates), list
+        )
+
+    openRange = Measurement('getChangeDates (open range)')
+    for identifier, date in requests[: max(1, args.queries // 10)]:
+        openRange.run(
+            lambda: isRangeQueried(identifier, fromDate=date)
+            and isRangeQueried(identifier, toDate=date)
+        )
+    measurements.append(openRange)
+
+    getxcite.sharedObjects['queryCache'] = QueryCache(maxEntries=len(requests) * 2)
+    for identifier, date in requests:
+        getxcite.getIdentifier(identifier, date)
+    cached = Measurement('getIdentifier (cached)')
+    for identifier, date in requests:
+        cached.run(lambda: isSuccess(getxcite.getIdentifier(identifier, date)))
+    measurements.append(cached)
+    return measurements
+
+
+BENCHMARKS = {
+    'index': benchIndex,
+    'download': benchDownload,
+    'extract': benchExtract,
+    'sync': benchSync,
+    'load': benchLoad,
+    'query': benchQuery,
+}
+
+
+def formatMilliseconds(seconds):
+    return (
+        '{:>9.2f}'.format(seconds * 1000)
+        if seconds is not None
+        else '{:>9}'.format('-')
+    )
+
+
+def printResults(results):
+    print(
+        '{:<34} {:>6} {:>5} {:>10} {:>8} {:>9} {:>9} {:>9}'.format(
+            '', 'ops', 'fail', 'items/s', 'MB/s', 'p50 ms', 'p95 ms', 'p99 ms'
+        )
+    )
+    for result in results:
+        print(
+            '{:<34} {:>6} {:>5} {:>10} {:>8} {} {} {}'.format(
+                result['name'],
+                result['operations'],
+                result['failures'],
+                '{:.1f}'.format(result['itemsPerSecond'])
+                if result['itemsPerSecond']
+                else '-',
+                '{:.1f}'.format(result['MBps']) if result['MBps'] else '-',
+                formatMilliseconds(result['p50']),
+                formatMilliseconds(result['p95']),
+                formatMilliseconds(result['p99']),
+            )
+        )
+
+
+def compareResults(results, baseline, tolerance: float):
+    """
+    Compare the p50 and p95 of each operation with those of `baseline`
+
+    Returns:
+        list: a message for each latency slower than the baseline by more than `tolerance` (e.g. 0.2 for 20%)
+    """
+    previous = {result['name']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result['name'])
+        if not before:
+            continue
+        for key in ('p50', 'p95'):
+            if (
+                before.get(key)
+                and result.get(key)
+                and result[key] > before[key] * (1 + tolerance)
+                # Below a tenth of a millisecond, the difference is noise
+                and result[key] - before[key] > 1e-4
+            ):
+                regressions.append(
+                    '{} {}: {:.2f} ms, was {:.2f} ms'.format(
+                        result['name'], key, result[key] * 1000, before[key] * 1000
+                    )
+                )
+    return regressions
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as root:
+        cwd = os.getcwd()
+        # The loaders log to loadusc.log in the working directory
+        os.chdir(root)
+        try:
+            context = setUp(root, args)
+            server, context['url'] = startServer(
+                context['servedPath'], args.server_latency
+            )
+            results = []
+            # The loaders print their commands and log every load: keep the table readable
+            logging.disable(logging.INFO)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for name in PATHS:
+                        if args.only and name not in args.only:
+                            continue
+                        if name == 'query' and 'dates' not in context:
+                            # Query the dates of the release points, loaded or not
+                            context['dates'] = sorted(
+                                {item['date'] for item in context['releasepoints']}
+                            )
+                        for measurement in BENCHMARKS[name](context, args):
+                            results.append(measurement.summary())
+            finally:
+                server.shutdown()
+                logging.disable(logging.NOTSET)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the download, extract, load and query paths offline.',
+        epilog='',
+    )
+    parser.add_argument('--only', nargs='+', choices=PATHS, help='paths to benchmark')
+    parser.add_argument(
+        '-r', '--releasepoints', type=int, default=8, help='synthetic release points'
+    )
+    parser.add_argument(
+        '--titles', type=int, default=10, help='titles of each release point'
+    )
+    parser.add_argument(
+        '--sections', type=int, default=50, help='sections of each title'
+    )
+    parser.add_argument(
+        '--section-bytes', type=int, default=2000, help='bytes of each section'
+    )
+    parser.add_argument(
+        '--index-releasepoints',
+        type=int,
+        default=600,
+        help='release points in the index pages',
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=4, help='download, load and query workers'
+    )
+    parser.add_argument(
+        '-q', '--queries', type=int, default=500, help='identifier queries'
+    )
+    parser.add_argument(
+        '--batch', type=int, default=50, help='queries of each getIdentifiers batch'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=20, help='runs of the index refresh'
+    )
+    parser.add_argument(
+        '--server-latency',
+        type=float,
+        default=0,
+        help='seconds of latency of the HTTP server',
+    )
+    parser.add_argument(
+        '--fake-startup', type=float, default=0.05, help='seconds for XCiteDB to start'
+    )
+    parser.add_argument(
+        '--fake-query-latency',
+        type=float,
+        default=0.002,
+        help='seconds per XCiteDB query',
+    )
+    parser.add_argument(
+        '--fake-xml-bytes', type=int, default=2000, help='bytes of each XML answered'
+    )
+    parser.add_argument(
+        '--fake-load-mbps', type=float, default=50, help='MB/s of XCiteDB load-xml'
+    )
+    parser.add_argument(
+        '--fake-log-entries',
+        type=int,
+        default=5,
+        help='entries of each change log answer',
+    )
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument(
+        '--baseline', help='results of an earlier --json, to compare with'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.25,
+        help='slowdown over the baseline that fails (default: %(default)s)',
+    )
+    args = parser.parse_args()
+    results = run(args)
+    printResults(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(
+                {
+                    'createdAt': datetime.utcnow().isoformat(),
+                    'options': vars(args),
+                    'results': results,
+                },
+                f,
+                indent=2,
+            )
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compareResults(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('slower: ' + regression)
+        if regressions:
+            sys.exit(1)
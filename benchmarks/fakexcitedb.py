@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'Stand-in for the XCiteDB executable, with tunable latency and output sizes, for the benchmarks'
+
+# Takes the command lines loadusc runs, after `XCiteDB -db XMLDBPATH`:
+#
+#   [-dc DOCCONFIG] -date mm/dd/yyyy load-xml [-r] PATH
+#   -date mm/dd/yyyy query -match IDENTIFIER
+#   -date mm/dd/yyyy query -match-start IDENTIFIER -match-end IDENTIFIER
+#   [-from-date mm/dd/yyyy -to-date mm/dd/yyyy] query -match[-start] IDENTIFIER [...] -log
+#   inspect -t log -match-start yyyymmdd
+#
+# load-xml sleeps for the size of the files at FAKE_XCITEDB_LOAD_MBPS and appends them to a log in the -db
+# directory; inspect answers from that log. Queries sleep for FAKE_XCITEDB_QUERY_LATENCY and answer with
+# synthetic XML of FAKE_XCITEDB_XML_BYTES. The settings are environment variables:
+#
+#   FAKE_XCITEDB_STARTUP          seconds to start (and open the database), once per process (default 0.05)
+#   FAKE_XCITEDB_QUERY_LATENCY    seconds per query (default 0.002)
+#   FAKE_XCITEDB_JITTER           random +/- fraction of every latency (default 0.2)
+#   FAKE_XCITEDB_XML_BYTES        bytes of each XML element answered (default 2000)
+#   FAKE_XCITEDB_RANGE_COUNT      elements answered for a -match-start/-match-end query (default 10)
+#   FAKE_XCITEDB_LOG_ENTRIES      change log entries answered for a -log query (default 5)
+#   FAKE_XCITEDB_LOAD_MBPS        MB/s of load-xml (default 50)
+#   FAKE_XCITEDB_FAIL_RATE        fraction of commands that fail with exit code 1 (default 0)
+
+import os
+import sys
+import json
+import time
+import random
+
+LOAD_LOG = 'fakexcitedb-loads.jsonl'
+
+
+def getConfig():
+    def get(name, default, convert=float):
+        return convert(os.environ.get('FAKE_XCITEDB_' + name, default))
+
+    return {
+        'startup': get('STARTUP', 0.05),
+        'queryLatency': get('QUERY_LATENCY', 0.002),
+        'jitter': get('JITTER', 0.2),
+        'xmlBytes': get('XML_BYTES', 2000, int),
+        'rangeCount': get('RANGE_COUNT', 10, int),
+        'logEntries': get('LOG_ENTRIES', 5, int),
+        'loadMBps': get('LOAD_MBPS', 50),
+        'failRate': get('FAIL_RATE', 0),
+    }
+
+
+def sleep(seconds: float, config: dict):
+    if seconds > 0:
+        time.sleep(seconds * (1 + random.uniform(-1, 1) * config['jitter']))
+
+
+def getOption(args, name: str, default=None):
+    if name in args and args.index(name) + 1 < len(args):
+        return args[args.index(name) + 1]
+    return default
+
+
+def getXML(identifier: str, date: str, size: int):
+    head = '<section xmlns="http://xml.house.gov/schemas/uslm/1.0" identifier="{}"><num>{}</num>'.format(
+        identifier, date
+    )
+    tail = '</section>'
+    body = '<content><p>{}</p></content>'.format(
+        'x' * max(0, size - len(head) - len(tail) - 25)
+    )
+    return head + body + tail
+
+
+def loadXML(db: str, args, config: dict):
+    path = args[-1]
+    date = getOption(args, '-date')
+    if not os.path.exists(path):
+        return 1, '', 'No such file or directory: ' + path
+    files = []
+    if os.path.isdir(path):
+        for root, _, filenames in os.walk(path):
+            files.extend(
+                os.path.join(root, filename)
+                for filename in filenames
+                if filename.lower().endswith('.xml')
+            )
+    else:
+        files.append(path)
+    size = sum(os.path.getsize(file) for file in files)
+    if config['loadMBps'] > 0:
+        sleep(size / (config['loadMBps'] * 1e6), config)
+    os.makedirs(db, exist_ok=True)
+    with open(os.path.join(db, LOAD_LOG), 'a') as f:
+        f.write(
+            json.dumps({'date': date, 'path': path, 'files': len(files), 'bytes': size})
+            + '\n'
+        )
+    return 0, 'Loaded {} files ({} bytes)\n'.format(len(files), size), ''
+
+
+def inspectLog(db: str, args):
+    prefix = getOption(args, '-match-start', '')
+    try:
+        with open(os.path.join(db, LOAD_LOG), 'r') as f:
+            loads = [json.loads(line) for line in f if line.strip()]
+    except OSError:
+        loads = []
+    lines = []
+    for load in loads:
+        month, day, year = (load['date'] or '00/00/0000').split('/')
+        if (year + month + day).startswith(prefix):
+            lines.append('{} {}'.format(year + month + day, load['path']))
+    if not lines:
+        return 1, '', 'No log entries'
+    return 0, '\n'.join(lines) + '\n', ''
+
+
+def query(args, config: dict):
+    sleep(config['queryLatency'], config)
+    date = getOption(args, '-date') or getOption(args, '-from-date') or '01/01/2020'
+    identifier = (
+        getOption(args, '-match') or getOption(args, '-match-start') or '/us/usc/t1/s1'
+    ).rstrip('/')
+    if '-log' in args:
+        fromDate = getOption(args, '-from-date', '01/01/2013')
+        entries = [
+            {
+                'identifier': identifier if index % 2 == 0 else identifier + '/a',
+                'date': fromDate,
+                'action': 'modified' if index else 'added',
+            }
+            for index in range(config['logEntries'])
+        ]
+        return 0, json.dumps(entries), ''
+    if '-match-start' in args:
+        xmls = [
+            getXML('{}/s{}'.format(identifier, index + 1), date, config['xmlBytes'])
+            for index in range(config['rangeCount'])
+        ]
+    else:
+        xmls = [getXML(identifier, date, config['xmlBytes'])]
+    return 0, json.dumps(xmls), ''
+
+
+def answer(db: str, args, config: dict):
+    """
+    Run one command line (the arguments after `-db XMLDBPATH`)
+
+    Returns:
+        tuple: (returncode, stdout, stderr)
+    """
+    if not args:
+        return 0, '', ''
+    if config['failRate'] and random.random() < config['failRate']:
+        return 1, '', 'Simulated failure'
+    if 'load-xml' in args:
+        return loadXML(db, args, config)
+    if args[0] == 'inspect':
+        return inspectLog(db, args)
+    if 'query' in args:
+        return query(args, config)
+    return 2, '', 'Unknown command: ' + ' '.join(args)
+
+
+def main(argv):
+    config = getConfig()
+    if argv[:1] != ['-db'] or len(argv) < 2:
+        sys.stderr.write('Usage: fakexcitedb.py -db XMLDBPATH ...\n')
+        return 2
+    db = argv[1]
+    args = argv[2:]
+    sleep(config['startup'], config)
+    returncode, stdout, stderr = answer(db, args, config)
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
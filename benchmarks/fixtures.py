@@ -0,0 +1,201 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Synthetic release points, title zips and release point index pages for the benchmarks'
+
+# The files are in the form of those of uscode.house.gov: a release point directory has one USLM file per title
+# (usc01.xml, usc02.xml...), each title zip (xml_usc01@113-21.zip) has the file of one title, and the index pages
+# link the release points as download.shtml and priorreleasepoints.htm do. From one release point to the next,
+# only the titles affected change, as with the real release points.
+
+import os
+import json
+import zipfile
+
+USLM_NAMESPACE = 'http://xml.house.gov/schemas/uslm/1.0'
+
+PAGE_HEAD = '<html><head><title>Prior Release Points</title>{}</head><body>'.format(
+    '<script>var x = 1;</script>' * 20
+)
+NAV = '<div class="nav">' + '<a href="/x{0}.htm">Link {0}</a>' * 40 + '</div>'
+
+
+def getSyntheticPages(count: int):
+    """
+    Get a download.shtml and a priorreleasepoints.htm with `count` release points, in the form of the real pages
+    """
+    current = (
+        PAGE_HEAD
+        + NAV.format(0)
+        + '<h3 class="releasepointinformation">Public Law 118-200 (01/02/2025)</h3>'
+        + '<div class="uscitem" id="alltitles"><div class="itemcurrency">All titles</div></div>'
+        + '<div class="uscitem"><div class="itemcurrency">118-200</div>'
+        + '<div class="itemdownloadlinks"><a href="releasepoints/us/pl/118/200/xml_uscAll@118-200.zip">'
+        + 'XML</a></div></div>'
+        + ''.join(
+            '<div class="uscitem usctitlechanged" id="us/usc/t{}">Title {}</div>'.format(
+                title, title
+            )
+            for title in (5, 10, 26, 42)
+        )
+        + '</body></html>'
+    )
+    links = []
+    for index in range(count):
+        congress = 113 + index // 150
+        law = index % 150 + 1
+        links.append(
+            '<li><a class="releasepoint" href="releasepoints/us/pl/{0}/{1}/usc-rp@{0}-{1}.htm">'
+            'Public Law {0}-{1} ({2:02d}/{3:02d}/{4}), affecting titles {5}, {6} and {7}.</a>'
+            ' <span class="note">Note {1}</span></li>'.format(
+                congress,
+                law,
+                index % 12 + 1,
+                index % 28 + 1,
+                2013 + index // 150,
+                index % 50 + 1,
+                (index + 7) % 50 + 1,
+                (index + 13) % 50 + 1,
+            )
+        )
+    prior = PAGE_HEAD + NAV.format(1) + '<ul>' + ''.join(links) + '</ul></body></html>'
+    return current.encode('utf-8'), prior.encode('utf-8')
+
+
+def writeIndexPages(path: str, count: int):
+    """
+    Save synthetic index pages (see getSyntheticPages) as download.shtml and priorreleasepoints.htm in `path`
+
+    Returns:
+        dict: {page name: saved path}
+    """
+    os.makedirs(path, exist_ok=True)
+    paths = {}
+    for name, content in zip(
+        ('download.shtml', 'priorreleasepoints.htm'), getSyntheticPages(count)
+    ):
+        paths[name] = os.path.join(path, name)
+        with open(paths[name], 'wb') as f:
+            f.write(content)
+    return paths
+
+
+def getTitleXML(title: int, sections: int, sectionBytes: int, version: str):
+    """
+    Get a USLM title file with `sections` sections of about `sectionBytes` each
+    """
+    identifier = '/us/usc/t{}'.format(title)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        '<uscDoc xmlns="{}" identifier="{}"><meta><docNumber>{}</docNumber><version>{}</version></meta>'.format(
+            USLM_NAMESPACE, identifier, title, version
+        ),
+        '<main><title identifier="{}"><num value="{}">Title {}</num>'.format(
+            identifier, title, title
+        ),
+    ]
+    text = ('Text of the section, as amended by {}. '.format(version) * 40)[
+        : max(0, sectionBytes - 200)
+    ]
+    for section in range(1, sections + 1):
+        sectionIdentifier = '{}/s{}'.format(identifier, section)
+        parts.append(
+            '<section identifier="{0}"><num value="{1}">§ {1}.</num><content><p>{2}</p></content>'
+            '<notes identifier="{0}/nt"><note><p>Note.</p></note></notes></section>'.format(
+                sectionIdentifier, section, text
+            )
+        )
+    parts.append('</title></main></uscDoc>\n')
+    return ''.join(parts)
+
+
+def getReleasePointNames(count: int):
+    return ['113-{}'.format(index + 1) for index in range(count)]
+
+
+def makeReleasePoints(
+    path: str,
+    count: int,
+    titles: int = 10,
+    sections: int = 50,
+    sectionBytes: int = 2000,
+    titlesAffected: int = 2,
+):
+    """
+    Write `count` release point directories to `path`, and their uscreleasepoints.json
+
+    The first release point has every title; each of the others changes `titlesAffected` of them.
+
+    Returns:
+        list: the release points, newest first, as in uscreleasepoints.json
+    """
+    releasepoints = []
+    files = {}
+    for index, name in enumerate(getReleasePointNames(count)):
+        if index == 0:
+            affected = list(range(1, titles + 1))
+        else:
+            affected = [
+                (index * titlesAffected + offset) % titles + 1
+                for offset in range(titlesAffected)
+            ]
+        for title in affected:
+            files[title] = getTitleXML(title, sections, sectionBytes, name)
+        dir_name = os.path.join(path, name)
+        os.makedirs(dir_name, exist_ok=True)
+        for title, content in files.items():
+            with open(os.path.join(dir_name, 'usc{:02d}.xml'.format(title)), 'w') as f:
+                f.write(content)
+        releasepoints.append(
+            {
+                'name': name,
+                'date': '01/{:02d}/2013'.format(index % 28 + 1),
+                'titlesAffected': [str(title) for title in affected],
+                'url': 'releasepoints/us/pl/113/{0}/xml_uscAll@113-{0}.zip'.format(
+                    index + 1
+                ),
+            }
+        )
+    releasepoints.reverse()
+    with open(os.path.join(path, 'uscreleasepoints.json'), 'w') as f:
+        json.dump(releasepoints, f)
+    return releasepoints
+
+
+def makeTitleZips(releasepointsPath: str, zipsPath: str, releasepoints):
+    """
+    Zip the files of the titles affected by each release point, as uscode.house.gov has them
+
+    Returns:
+        list: (release point name, title file, zip path relative to `zipsPath`) for each zip
+    """
+    zips = []
+    for releasepoint in releasepoints:
+        name = releasepoint['name']
+        for title in releasepoint['titlesAffected']:
+            filename = 'usc{:02d}.xml'.format(int(title))
+            relpath = 'xml_usc{:02d}@{}.zip'.format(int(title), name)
+            os.makedirs(zipsPath, exist_ok=True)
+            with zipfile.ZipFile(
+                os.path.join(zipsPath, relpath), 'w', zipfile.ZIP_DEFLATED
+            ) as z:
+                z.write(os.path.join(releasepointsPath, name, filename), filename)
+            zips.append((name, filename, relpath))
+    return zips
+
+
+def getPublawsDict(releasepoints):
+    """
+    Get a publawsDict.json for the release points, in MongoDB extended JSON, with one day per public law
+    """
+    publaws = {}
+    for index, releasepoint in enumerate(reversed(releasepoints)):
+        publaws[releasepoint['name']] = {
+            'publaw': releasepoint['name'],
+            'publawDate': {
+                '$date': '2013-{:02d}-{:02d}T00:00:00Z'.format(
+                    index // 28 % 12 + 1, index % 28 + 1
+                )
+            },
+            'billCongressTypeNumber': '113hr{}'.format(index + 1),
+        }
+    return publaws
@@ -0,0 +1,424 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Content-addressed store for the XML files of USC release points'
+
+# Layout, under USC_BLOBSTORE_DIRPATH:
+#   objects/ab/abcdef...      the contents of a file, named by its sha256 (abcdef....gz if compressed)
+#   manifests/116-140.json    for each release point, {filename: {"sha256": ..., "size": ...}}
+#
+# A release point directory (USC_RELEASEPOINTS/116-140) is a view over the store:
+# each of its files is a hard link to a blob (or, for compressed blobs, a decompressed copy).
+# Disk use therefore grows with the number of distinct title versions, not with release points x titles.
+
+import os
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+
+try:
+    from settings import getSettings
+except ImportError:
+    from loadusc.settings import getSettings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+OBJECTS_DIRNAME = 'objects'
+MANIFESTS_DIRNAME = 'manifests'
+
+manifestLock = threading.Lock()
+
+
+def isBlobId(sha: str):
+    return (
+        isinstance(sha, str)
+        and len(sha) == 64
+        and all(c in '0123456789abcdef' for c in sha)
+    )
+
+
+def getBlobPath(sha: str, storePath: str = None):
+    """
+    Get the path of the blob with this sha256, or None if it is not in the store
+
+    Args:
+        sha (str): the sha256 of the (uncompressed) content
+        storePath (str, optional): root of the store. Defaults to USC_BLOBSTORE_DIRPATH.
+
+    Returns:
+        str: the path to the blob, which ends in .gz if it is compressed
+    """
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    path = os.path.join(storePath, OBJECTS_DIRNAME, sha[:2], sha)
+    if os.path.isfile(path):
+        return path
+    if os.path.isfile(path + '.gz'):
+        return path + '.gz'
+    return None
+
+
+def putStream(fileobj, storePath: str = None, compress: bool = None):
+    """
+    Add the content read from `fileobj` to the store, unless a blob with the same content is already there
+
+    Args:
+        fileobj (file): a binary file object, e.g. from zipfile.ZipFile.open()
+        storePath (str, optional): root of the store. Defaults to USC_BLOBSTORE_DIRPATH.
+        compress (bool, optional): gzip the blob, if it is new. Defaults to BLOBSTORE_COMPRESS.
+
+    Returns:
+        tuple: the sha256 of the content, its (uncompressed) size and whether a new blob was written
+    """
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    if compress is None:
+        compress = getSettings().BLOBSTORE_COMPRESS
+    tmp_dir = os.path.join(storePath, OBJECTS_DIRNAME)
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=tmp_dir)
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            out = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+            if compress:
+                out.close()
+        digest = sha.hexdigest()
+        if getBlobPath(digest, storePath):
+            return digest, size, False
+        path = os.path.join(storePath, OBJECTS_DIRNAME, digest[:2], digest)
+        if compress:
+            path += '.gz'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        # Blobs are shared by many release points: they must never be modified in place
+        os.chmod(path, 0o444)
+        return digest, size, True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def putFile(
+    path: str,
+    storePath: str = None,
+    compress: bool = None,
+):
+    """
+    Add the file at `path` to the store (see putStream)
+    """
+    with open(path, 'rb') as f:
+        return putStream(f, storePath=storePath, compress=compress)
+
+
+def materializeBlob(sha: str, target: str, storePath: str = None):
+    """
+    Make `target` a hard link to the blob, or a decompressed copy of it if it is compressed.
+    An existing `target` is replaced, never written to, since it may be a link to another blob.
+
+    Args:
+        sha (str): the sha256 of the content
+        target (str): the path of the file to create
+        storePath (str, optional): root of the store. Defaults to USC_BLOBSTORE_DIRPATH.
+
+    Returns:
+        bool: True if `target` was created or replaced, False if it already was a link to the blob
+
+    Raises:
+        FileNotFoundError: if the blob is not in the store
+    """
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    blob_path = getBlobPath(sha, storePath)
+    if not blob_path:
+        raise FileNotFoundError('No blob ' + sha + ' in ' + storePath)
+    if os.path.exists(target) and os.path.samefile(blob_path, target):
+        return False
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    tmp_target = target + '.tmp'
+    if os.path.lexists(tmp_target):
+        os.remove(tmp_target)
+    if blob_path.endswith('.gz'):
+        with gzip.open(blob_path, 'rb') as src, open(tmp_target, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    else:
+        try:
+            os.link(blob_path, tmp_target)
+        except OSError as err:
+            # e.g. the store is on another file system
+            logger.debug('Could not link ' + blob_path + ': ' + str(err))
+            shutil.copyfile(blob_path, tmp_target)
+    os.replace(tmp_target, target)
+    return True
+
+
+def getManifestPath(name: str, storePath: str = None):
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    return os.path.join(storePath, MANIFESTS_DIRNAME, name + '.json')
+
+
+def loadReleasePointManifest(name: str, storePath: str = None):
+    """
+    Get the manifest of a release point, of the form {filename: {"sha256": ..., "size": ...}}
+    """
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    path = getManifestPath(name, storePath)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def updateReleasePointManifest(name: str, files: dict, storePath: str = None):
+    """
+    Add or replace entries in the manifest of a release point
+
+    Args:
+        name (str): the release point name, e.g. '116-140'
+        files (dict): {filename: {"sha256": ..., "size": ...}}
+        storePath (str, optional): root of the store. Defaults to USC_BLOBSTORE_DIRPATH.
+    """
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    path = getManifestPath(name, storePath)
+    with manifestLock:
+        manifest = loadReleasePointManifest(name, storePath)
+        manifest.update(files)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+
+def importReleasePoint(
+    name: str,
+    releasepointsPath: str = None,
+    storePath: str = None,
+    compress: bool = None,
+):
+    """
+    Move the files of an existing release point directory into the store, and replace them with links to the blobs
+
+    Args:
+        name (str): the release point name, e.g. '116-140'
+        releasepointsPath (str, optional): directory of the release points. Defaults to USC_RELEASEPOINT_DIRPATH.
+        storePath (str, optional): root of the store. Defaults to USC_BLOBSTORE_DIRPATH.
+        compress (bool, optional): gzip new blobs. Defaults to BLOBSTORE_COMPRESS.
+
+    Returns:
+        dict: the number of 'files' imported, of 'new' blobs and of bytes 'deduplicated'
+    """
+    releasepointsPath = releasepointsPath or getSettings().USC_RELEASEPOINT_DIRPATH
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    if compress is None:
+        compress = getSettings().BLOBSTORE_COMPRESS
+    dir_name = os.path.join(releasepointsPath, name)
+    counts = {'files': 0, 'new': 0, 'deduplicated': 0}
+    files = {}
+    for root, _, filenames in os.walk(dir_name):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            sha, size, new = putFile(path, storePath=storePath, compress=compress)
+            materializeBlob(sha, path, storePath=storePath)
+            files[os.path.relpath(path, dir_name)] = {'sha256': sha, 'size': size}
+            counts['files'] += 1
+            if new:
+                counts['new'] += 1
+            else:
+                counts['deduplicated'] += size
+    updateReleasePointManifest(name, files, storePath=storePath)
+    return counts
+
+
+def materializeReleasePoint(
+    name: str,
+    dir_name: str = None,
+    releasepointsPath: str = None,
+    storePath: str = None,
+):
+    """
+    (Re)create the directory of a release point from its manifest
+
+    Args:
+        name (str): the release point name, e.g. '116-140'
+        dir_name (str, optional): where to create it. Defaults to the release point directory.
+        releasepointsPath (str, optional): directory of the release points. Defaults to USC_RELEASEPOINT_DIRPATH.
+        storePath (str, optional): root of the store. Defaults to USC_BLOBSTORE_DIRPATH.
+
+    Returns:
+        str: the directory
+    """
+    releasepointsPath = releasepointsPath or getSettings().USC_RELEASEPOINT_DIRPATH
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    if dir_name is None:
+        dir_name = os.path.join(releasepointsPath, name)
+    for filename, item in loadReleasePointManifest(name, storePath).items():
+        materializeBlob(item['sha256'], os.path.join(dir_name, filename), storePath)
+    return dir_name
+
+
+def pruneReleasePoint(
+    name: str,
+    releasepointsPath: str = None,
+    storePath: str = None,
+):
+    """
+    Remove the directory of a release point whose files are all in the store; it can be recreated with
+    materializeReleasePoint. This is how a compressed store saves disk space after a release point is loaded.
+
+    Returns:
+        bool: True if the directory was removed
+    """
+    releasepointsPath = releasepointsPath or getSettings().USC_RELEASEPOINT_DIRPATH
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    dir_name = os.path.join(releasepointsPath, name)
+    manifest = loadReleasePointManifest(name, storePath)
+    if not manifest or not os.path.isdir(dir_name):
+        return False
+    for filename, item in manifest.items():
+        if not getBlobPath(item['sha256'], storePath):
+            logger.error('Not pruning ' + name + ': missing blob for ' + filename)
+            return False
+    shutil.rmtree(dir_name)
+    return True
+
+
+def collectGarbage(storePath: str = None, dryRun: bool = False):
+    """
+    Remove the blobs that no release point manifest refers to
+
+    Returns:
+        list: the sha256 of the blobs removed (or that would be removed, for a dry run)
+    """
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    referenced = set()
+    manifests_dir = os.path.join(storePath, MANIFESTS_DIRNAME)
+    if os.path.isdir(manifests_dir):
+        for filename in os.listdir(manifests_dir):
+            if filename.endswith('.json'):
+                manifest = loadReleasePointManifest(
+                    filename[: -len('.json')], storePath
+                )
+                referenced.update(item['sha256'] for item in manifest.values())
+    removed = []
+    objects_dir = os.path.join(storePath, OBJECTS_DIRNAME)
+    for root, _, filenames in os.walk(objects_dir):
+        for filename in filenames:
+            sha = filename.split('.')[0]
+            if isBlobId(sha) and sha not in referenced:
+                removed.append(sha)
+                if not dryRun:
+                    os.remove(os.path.join(root, filename))
+    return removed
+
+
+def getStoreStats(storePath: str = None):
+    """
+    Get the number of blobs and release points in the store, the bytes on disk and the bytes they stand for
+
+    Returns:
+        dict: 'blobs', 'blobBytes' (on disk), 'releasepoints', 'files' and 'logicalBytes' (sum of the file sizes
+        over all release point manifests)
+    """
+    storePath = storePath or getSettings().USC_BLOBSTORE_DIRPATH
+    stats = {
+        'blobs': 0,
+        'blobBytes': 0,
+        'releasepoints': 0,
+        'files': 0,
+        'logicalBytes': 0,
+    }
+    for root, _, filenames in os.walk(os.path.join(storePath, OBJECTS_DIRNAME)):
+        for filename in filenames:
+            if isBlobId(filename.split('.')[0]):
+                stats['blobs'] += 1
+                stats['blobBytes'] += os.path.getsize(os.path.join(root, filename))
+    manifests_dir = os.path.join(storePath, MANIFESTS_DIRNAME)
+    if os.path.isdir(manifests_dir):
+        for filename in os.listdir(manifests_dir):
+            if filename.endswith('.json'):
+                stats['releasepoints'] += 1
+                manifest = loadReleasePointManifest(
+                    filename[: -len('.json')], storePath
+                )
+                stats['files'] += len(manifest)
+                stats['logicalBytes'] += sum(item['size'] for item in manifest.values())
+    return stats
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='loadusc.log', filemode='a', level='INFO')
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    parser = argparse.ArgumentParser(
+        description='Manage the content-addressed store of USC release point files.',
+        epilog='',
+    )
+    parser.add_argument(
+        'command',
+        choices=['import', 'materialize', 'prune', 'gc', 'stats'],
+        help='import: move release point directories into the store; '
+        'materialize: recreate release point directories from the store; '
+        'prune: remove release point directories that are in the store; '
+        'gc: remove blobs no release point refers to; '
+        'stats: print the size of the store',
+    )
+    parser.add_argument(
+        'names',
+        nargs='*',
+        help='Release point names (default: all release point directories, or all manifests)',
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        dest='dryRun',
+        help='For gc, list the blobs without removing them',
+    )
+    args = parser.parse_args()
+    settings = getSettings()
+
+    names = args.names
+    if not names and args.command == 'import':
+        names = sorted(
+            name
+            for name in os.listdir(settings.USC_RELEASEPOINT_DIRPATH)
+            if not name.startswith('.')
+            and os.path.isdir(os.path.join(settings.USC_RELEASEPOINT_DIRPATH, name))
+        )
+    elif not names:
+        manifests_dir = os.path.join(settings.USC_BLOBSTORE_DIRPATH, MANIFESTS_DIRNAME)
+        if os.path.isdir(manifests_dir):
+            names = sorted(
+                filename[: -len('.json')]
+                for filename in os.listdir(manifests_dir)
+                if filename.endswith('.json')
+            )
+
+    if args.command == 'import':
+        for name in names:
+            logger.info(name + ': ' + json.dumps(importReleasePoint(name)))
+    elif args.command == 'materialize':
+        for name in names:
+            logger.info('Materialized ' + materializeReleasePoint(name))
+    elif args.command == 'prune':
+        for name in names:
+            if pruneReleasePoint(name):
+                logger.info('Pruned ' + name)
+    elif args.command == 'gc':
+        removed = collectGarbage(dryRun=args.dryRun)
+        logger.info(
+            ('Would remove ' if args.dryRun else 'Removed ')
+            + str(len(removed))
+            + ' blobs'
+        )
+    elif args.command == 'stats':
+        logger.info(json.dumps(getStoreStats()))
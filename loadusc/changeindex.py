@@ -0,0 +1,438 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Local index of the XCiteDB change log, for getChangeDates'
+
+# The change log of the USC in XCiteDB only grows when loaduscxcite.py loads a release point. After each date
+# is loaded, its log entries (`XCiteDB query -from-date <date> -to-date <date> -match-start /us/ -log`) are
+# copied into a SQLite file at CHANGE_INDEX_PATH, with the dates that have been indexed. The log of a date can
+# cover every section of the Code, so it is read from XCiteDB and written to the index as a stream, a few entries
+# at a time, never as a whole.
+#
+# getxcite.getChangeDates answers from the index when it has every date in the load ledger and at least one
+# entry for the section; otherwise it queries the XCiteDB log.
+#
+# Usage: python changeindex.py update   (index the loaded dates that are not in the index yet)
+#        python changeindex.py stats
+
+import os
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+try:
+    from settings import getSettings
+    from loadledger import LoadLedger, getDateOrd
+    from effectivedates import getLedgerDates
+except ImportError:
+    from loadusc.settings import getSettings
+    from loadusc.loadledger import LoadLedger, getDateOrd
+    from loadusc.effectivedates import getLedgerDates
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the identifiers indexed
+INDEX_PREFIX = '/us/'
+# Characters of XCiteDB output read at a time
+READ_SIZE = 64 * 1024
+NUMBER_CHARACTERS = frozenset('0123456789.eE+-')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS changes (
+    identifier TEXT NOT NULL,
+    date_ord INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    action TEXT NOT NULL,
+    PRIMARY KEY (identifier, date_ord, action)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS dates (
+    date_ord INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    entries INTEGER NOT NULL,
+    indexed_at TEXT NOT NULL
+);
+'''
+
+
+class ChangeLogError(Exception):
+    """The XCiteDB change log of a date could not be read."""
+
+
+class ChangeIndex:
+    """Change log entries by identifier and date, safe to use from several threads."""
+
+    def __init__(self, path: str = None, readonly: bool = False):
+        path = path or getSettings().CHANGE_INDEX_PATH
+        self.path = path
+        self.lock = threading.Lock()
+        if readonly:
+            self.connection = sqlite3.connect(
+                'file:' + path + '?mode=ro', uri=True, check_same_thread=False
+            )
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def addDate(self, date: str, entries):
+        """
+        Replace the entries indexed for `date` (mm/dd/yyyy) with `entries`, the XCiteDB log entries for that date.
+        `entries` can be an iterator, consumed as the rows are inserted; if it raises, the date is left as it was.
+
+        Returns:
+            int: the number of entries indexed
+        """
+        dateOrd = getDateOrd(date)
+        count = 0
+
+        def getRows():
+            nonlocal count
+            for entry in entries:
+                try:
+                    row = (
+                        entry['identifier'],
+                        getDateOrd(entry['date']),
+                        entry['date'],
+                        entry.get('action') or '',
+                    )
+                except (KeyError, TypeError, ValueError):
+                    logger.warning('Not indexing change log entry: {}'.format(entry))
+                    continue
+                count += 1
+                yield row
+
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'DELETE FROM changes WHERE date_ord = ?', (dateOrd,)
+                )
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO changes (identifier, date_ord, date, action) VALUES (?, ?, ?, ?)',
+                    getRows(),
+                )
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO dates (date_ord, date, entries, indexed_at) VALUES (?, ?, ?, ?)',
+                    (dateOrd, date, count, datetime.utcnow().isoformat()),
+                )
+        return count
+
+    def getIndexedDates(self):
+        """
+        Get the dates (mm/dd/yyyy) that have been indexed, in chronological order
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT date FROM dates ORDER BY date_ord'
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def getChanges(self, identifier: str, fromDate: str = None, toDate: str = None):
+        """
+        Get the change log entries of a section and its descendants, as getChangeDates returns them
+
+        Args:
+            identifier (str): the section, e.g. '/us/usc/t26/s1'
+            fromDate (str, optional): the first date, mm/dd/yyyy. Defaults to None, for no limit.
+            toDate (str, optional): the last date, mm/dd/yyyy. Defaults to None, for no limit.
+
+        Returns:
+            list: the entries, sorted by date, identifier and action, or None if the index has no entries
+            for the section at any date
+        """
+        identifier = identifier.rstrip('/')
+        # Descendants: identifiers from '<section>/' up to, not including, '<section>0' ('0' follows '/')
+        descendants = (identifier + '/', identifier + '0')
+        fromOrd = getDateOrd(fromDate) if fromDate else 0
+        toOrd = getDateOrd(toDate) if toDate else 99999999
+        condition = '(identifier = ? OR (identifier >= ? AND identifier < ?))'
+        with self.lock:
+            if not self.connection.execute(
+                'SELECT 1 FROM changes WHERE ' + condition + ' LIMIT 1',
+                (identifier,) + descendants,
+            ).fetchone():
+                return None
+            rows = self.connection.execute(
+                'SELECT identifier, date, action FROM changes WHERE '
+                + condition
+                + ' AND date_ord BETWEEN ? AND ? ORDER BY date_ord, identifier, action',
+                (identifier,) + descendants + (fromOrd, toOrd),
+            ).fetchall()
+        return [
+            {'identifier': row[0], 'date': row[1], 'action': row[2]} for row in rows
+        ]
+
+    def getStats(self):
+        with self.lock:
+            entries = self.connection.execute('SELECT COUNT(*) FROM changes').fetchone()
+            dates = self.connection.execute('SELECT COUNT(*) FROM dates').fetchone()
+        return {'entries': entries[0], 'dates': dates[0]}
+
+
+def iterJSONArray(stream, readSize: int = READ_SIZE):
+    """
+    Yield the items of a JSON array read from a text stream, holding only a read and one item in memory
+
+    Raises:
+        ValueError: if the stream is not a JSON array, or ends before the array does. An empty stream is an empty
+            array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    ended = False
+    # What comes next: '[' (start), an item or ']' (first), ',' or ']' (separator), an item (item)
+    expected = 'start'
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if ended:
+                break
+            buffer = stream.read(readSize)
+            position = 0
+            ended = not buffer
+            continue
+        char = buffer[position]
+        if expected == 'start':
+            if char != '[':
+                raise ValueError(
+                    'Not a JSON array: ' + buffer[position : position + 80]
+                )
+            position += 1
+            expected = 'first'
+        elif expected in ('first', 'separator') and char == ']':
+            return
+        elif expected == 'separator':
+            if char != ',':
+                raise ValueError('Expected , or ]: ' + buffer[position : position + 80])
+            position += 1
+            expected = 'item'
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                item, end = None, None
+            # An item cut by the end of the read, or a number that may go on: read more and decode it again
+            if end is None or (
+                not ended
+                and (
+                    end == len(buffer)
+                    or (
+                        isinstance(item, (int, float))
+                        and buffer[end] in NUMBER_CHARACTERS
+                    )
+                )
+            ):
+                if ended:
+                    raise ValueError(
+                        'Invalid JSON: ' + buffer[position : position + 80]
+                    )
+                more = stream.read(readSize)
+                ended = not more
+                buffer = buffer[position:] + more
+                position = 0
+                continue
+            yield item
+            position = end
+            expected = 'separator'
+    if expected != 'start':
+        raise ValueError('The JSON array is not closed')
+
+
+def iterDateChanges(date: str, timeout: int = None):
+    """
+    Yield the XCiteDB change log entries for one date, as XCiteDB writes them
+
+    Args:
+        date (str): the date, in mm/dd/yyyy form
+        timeout (int, optional): seconds to wait for XCiteDB. Defaults to LOAD_TIMEOUT.
+
+    Raises:
+        ChangeLogError: if XCiteDB fails, times out or writes something else than a JSON array
+
+    Yields:
+        dict: the entries ({'identifier', 'date', 'action'})
+    """
+    settings = getSettings()
+    timeout = timeout or settings.LOAD_TIMEOUT
+    # A file, not a pipe, for stderr, so that XCiteDB cannot block on it while stdout is read
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            process = subprocess.Popen(
+                [
+                    settings.XCITEDBPATH,
+                    '-db',
+                    settings.XMLDBPATH,
+                    '-from-date',
+                    date,
+                    '-to-date',
+                    date,
+                    'query',
+                    '-match-start',
+                    INDEX_PREFIX,
+                    '-log',
+                ],
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                encoding='utf-8',
+                errors='replace',
+            )
+        except OSError as err:
+            raise ChangeLogError(
+                'Could not get the XCiteDB change log for {}: {}'.format(date, err)
+            )
+        timedOut = threading.Event()
+
+        def kill():
+            timedOut.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        try:
+            try:
+                yield from iterJSONArray(process.stdout)
+                invalid = None
+            except ValueError as err:
+                invalid = err
+            # Read what is left, so that XCiteDB can exit
+            while process.stdout.read(READ_SIZE):
+                pass
+            returncode = process.wait()
+        finally:
+            timer.cancel()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+        if timedOut.is_set():
+            raise ChangeLogError(
+                'XCiteDB change log for {} timed out after {}s'.format(date, timeout)
+            )
+        if returncode != 0:
+            stderr.seek(0)
+            raise ChangeLogError(
+                'Could not get the XCiteDB change log for {} (exit code {}): {}'.format(
+                    date, returncode, stderr.read(2000).decode('utf-8', 'replace')
+                )
+            )
+        if invalid is not None:
+            raise ChangeLogError(
+                'Invalid XCiteDB change log for {}: {}'.format(date, invalid)
+            )
+
+
+def indexDate(changeIndex: ChangeIndex, date: str):
+    """
+    Copy the XCiteDB change log entries for `date` into the index, as they are read
+
+    Returns:
+        bool: True if the date was indexed
+    """
+    try:
+        count = changeIndex.addDate(date, iterDateChanges(date))
+    except ChangeLogError as err:
+        logger.error(err)
+        return False
+    logger.info('Indexed {} changes for {}'.format(count, date))
+    return True
+
+
+def updateChangeIndex(changeIndex: ChangeIndex, ledger: LoadLedger):
+    """
+    Index the dates loaded according to the ledger that are not in the index yet
+
+    Returns:
+        int: the number of dates indexed
+    """
+    indexed = set(changeIndex.getIndexedDates())
+    count = 0
+    for date in ledger.getLoadedDates():
+        if date not in indexed and indexDate(changeIndex, date):
+            count += 1
+    return count
+
+
+class ChangeIndexReader:
+    """
+    Read-only access to the index for getxcite.py, which only uses it when it has every loaded date
+    """
+
+    def __init__(self, path: str = None, ledgerPath: str = None):
+        # None: the paths of the settings, when the index is first read
+        self.path = path
+        self.ledgerPath = ledgerPath
+        self.lock = threading.Lock()
+        self.index = None
+        self.version = None
+        self.complete = False
+
+    def getIndex(self, version=None):
+        """
+        Get the index if it has all the dates in the load ledger, checking again when `version` changes
+        """
+        with self.lock:
+            if self.version == version and self.index is not None:
+                return self.index if self.complete else None
+            self.version = version
+            self.complete = False
+            if self.path is None:
+                self.path = getSettings().CHANGE_INDEX_PATH
+            if not self.path or not os.path.isfile(self.path):
+                return None
+            try:
+                if self.index is None:
+                    self.index = ChangeIndex(self.path, readonly=True)
+                indexed = set(self.index.getIndexedDates())
+            except sqlite3.Error as err:
+                logger.warning('Could not read the change index: {}'.format(err))
+                self.index = None
+                return None
+            loaded = set(
+                date.strftime('%m/%d/%Y') for date in getLedgerDates(self.ledgerPath)
+            )
+            self.complete = bool(loaded) and loaded <= indexed
+            return self.index if self.complete else None
+
+    def getChanges(self, identifier: str, fromDate=None, toDate=None, version=None):
+        """
+        Get the change log entries from the index, or None if getChangeDates should query XCiteDB
+        """
+        index = self.getIndex(version)
+        if index is None:
+            return None
+        try:
+            return index.getChanges(identifier, fromDate, toDate)
+        except sqlite3.Error as err:
+            logger.warning('Could not read the change index: {}'.format(err))
+            return None
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='loadusc.log', filemode='a', level='INFO')
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    parser = argparse.ArgumentParser(
+        description='Index the XCiteDB change log.', epilog=''
+    )
+    parser.add_argument(
+        'command',
+        choices=['update', 'stats'],
+        help='update: index the loaded dates that are not in the index; stats: count the entries and dates',
+    )
+    args = parser.parse_args()
+    changeIndex = ChangeIndex()
+    if args.command == 'update':
+        ledger = LoadLedger()
+        logger.info('Indexed {} dates'.format(updateChangeIndex(changeIndex, ledger)))
+        ledger.close()
+    logger.info(json.dumps(changeIndex.getStats()))
+    changeIndex.close()
@@ -6,11 +6,19 @@
 
 import zipfile
 import re
-import io
 import sys
 import os
+import time
+import random
+import tempfile
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 import json
 import argparse
@@ -20,58 +28,737 @@ from urllib3.exceptions import InsecureRequestWarning
 
 try:
     from constants import (
-        USC_RELEASEPOINT_DIRPATH,
-        USC_RELEASEPOINT_JSON_PATH,
         USC_HTML_PAGE_BASE,
         USC_HTML_PAGE,
         CURRENT_USC_HTML_PAGE,
         USC_RP_TEXT,
         USC_XML_TEXT,
     )
+    from settings import getSettings
+    from releasepointindex import refreshReleasePoints
+    from metrics import span, increment
+    from blobstore import (
+        isBlobId,
+        getBlobPath,
+        putStream,
+        materializeBlob,
+        updateReleasePointManifest,
+    )
 except ImportError:
     from loadusc.constants import (
-        USC_RELEASEPOINT_DIRPATH,
-        USC_RELEASEPOINT_JSON_PATH,
         USC_HTML_PAGE_BASE,
         USC_HTML_PAGE,
         CURRENT_USC_HTML_PAGE,
         USC_RP_TEXT,
         USC_XML_TEXT,
     )
+    from loadusc.settings import getSettings
+    from loadusc.releasepointindex import refreshReleasePoints
+    from loadusc.metrics import span, increment
+    from loadusc.blobstore import (
+        isBlobId,
+        getBlobPath,
+        putStream,
+        materializeBlob,
+        updateReleasePointManifest,
+    )
+
+
+def getSession(poolSize: int = 10):
+    """
+    Create a pooled HTTP session, so that connections to uscode.house.gov are reused across downloads
+
+    Args:
+        poolSize (int, optional): maximum number of connections kept open per host. Defaults to 10.
+
+    Returns:
+        requests.Session: the session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 
 class SSLWarningSuppressor:
-    def __init__(self, target_domains=None):
+    def __init__(self, target_domains=None, session=None):
         if target_domains is None:
             target_domains = []
         self.target_domains = set(target_domains)
+        self.session = session if session is not None else getSession()
+        # A message filter is installed once, instead of warnings.catch_warnings() per request,
+        # since catch_warnings is not safe to use from several download threads
+        for domain in self.target_domains:
+            warnings.filterwarnings(
+                'ignore',
+                message='.*' + re.escape(domain),
+                category=InsecureRequestWarning,
+            )
 
     def should_suppress(self, url):
         for domain in self.target_domains:
             if domain in url:
                 return True
         return False
-    
+
+    def setPoolSize(self, poolSize: int):
+        self.session = getSession(poolSize)
+
     def get(self, url, **kwargs):
-        if self.should_suppress(url):
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore", InsecureRequestWarning)
-                if 'verify' not in kwargs:
-                    kwargs['verify'] = False
-                return requests.get(url, **kwargs)
-        else:
-            return requests.get(url, **kwargs)
-        
+        if self.should_suppress(url) and 'verify' not in kwargs:
+            kwargs['verify'] = getSettings().DOWNLOAD_TLS_VERIFY
+        return self.session.get(url, **kwargs)
+
+
+class HostLimiter:
+    """Limits the number of simultaneous requests made to any one host, by default to DOWNLOAD_PER_HOST_MAX."""
+
+    def __init__(self, perHostMax: int = None):
+        self.perHostMax = max(1, perHostMax) if perHostMax else None
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def slot(self, url: str):
+        host = urlparse(url).netloc
+        with self.lock:
+            if self.perHostMax is None:
+                self.perHostMax = max(1, getSettings().DOWNLOAD_PER_HOST_MAX)
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.perHostMax)
+            return self.semaphores[host]
+
+
+class DownloadStats:
+    """Thread-safe counters for a download run, used to print a throughput summary."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.bytes = 0
+        self.zips = 0
+        self.failed = 0
+        self.unchanged = 0
+        self.failures = dict.fromkeys(FAILURE_KINDS, 0)
+        self.written = 0
+        self.linked = 0
+        self.linkedBytes = 0
+
+    def add(self, nbytes: int = 0, ok: bool = True):
+        with self.lock:
+            self.bytes += nbytes
+            if ok:
+                self.zips += 1
+            else:
+                self.failed += 1
+
+    def addFailure(self, kind: str):
+        with self.lock:
+            self.failures[kind] += 1
+
+    def addExtracted(self, written: int = 0, linked: int = 0, linkedBytes: int = 0):
+        with self.lock:
+            self.written += written
+            self.linked += linked
+            self.linkedBytes += linkedBytes
+
+    def addUnchanged(self):
+        with self.lock:
+            self.unchanged += 1
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        return (
+            'Downloaded {zips} zips ({mb:.1f} MB, {failed} failed, {unchanged} unchanged) in {elapsed:.1f}s: '
+            '{mbps:.2f} MB/s, {zps:.2f} zips/s; failed attempts: {failures}; '
+            'files written: {written}, unchanged files linked: {linked} ({linkedmb:.1f} MB)'
+        ).format(
+            zips=self.zips,
+            mb=self.bytes / 1e6,
+            failed=self.failed,
+            unchanged=self.unchanged,
+            elapsed=elapsed,
+            mbps=self.bytes / 1e6 / elapsed,
+            zps=self.zips / elapsed,
+            failures=', '.join(k + '=' + str(v) for k, v in self.failures.items()),
+            written=self.written,
+            linked=self.linked,
+            linkedmb=self.linkedBytes / 1e6,
+        )
+
+
+class SyncManifest:
+    """
+    Persistent record of what has been downloaded and extracted for each releasepoint and title,
+    stored as JSON next to uscreleasepoints.json, in the form::
+
+        {
+            "116-140": {
+                "url": "https://uscode.house.gov/.../xml_uscAll@116-140.zip",
+                "date": "04/28/2020",
+                "titles": {
+                    "10": {
+                        "url": "https://uscode.house.gov/.../xml_usc10@116-140.zip",
+                        "etag": "...",
+                        "lastModified": "...",
+                        "size": 1234,
+                        "sha256": "...",
+                        "status": "extracted",
+                        "files": {"usc10.xml": 5678}
+                    }
+                },
+                "load": "loaded"
+            }
+        }
+
+    "load" is set by sync.py: 'loaded' once the date of the release point was loaded from these files, or
+    'unscheduled' if the release point is not in the load schedule. A new download of one of its titles removes it.
+    """
+
+    def __init__(self, path: str = None):
+        path = path or getSettings().USC_SYNC_MANIFEST_PATH
+        self.path = path
+        self.lock = threading.Lock()
+        self.releasepoints = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.releasepoints = json.load(f)
+            except Exception as err:
+                logger.error('Could not read sync manifest ' + path + ': ' + str(err))
+
+    def setReleasepoint(self, releasepoint: dict):
+        with self.lock:
+            item = self.releasepoints.setdefault(
+                releasepoint.get('name'), {'titles': {}}
+            )
+            item['url'] = releasepoint.get('url')
+            item['date'] = releasepoint.get('date')
+
+    def getTitle(self, name: str, title: str):
+        with self.lock:
+            return self.releasepoints.get(name, {}).get('titles', {}).get(title)
+
+    def setTitle(self, name: str, title: str, entry: dict):
+        """
+        Record a title download; it is written with the next save() (see ReleasepointSaver)
+        """
+        with self.lock:
+            item = self.releasepoints.setdefault(name, {'titles': {}})
+            item.setdefault('titles', {})[title] = entry
+            item.pop('load', None)
+
+    def getLoadStatus(self, name: str):
+        with self.lock:
+            return self.releasepoints.get(name, {}).get('load')
+
+    def setLoadStatus(self, names, status: str):
+        """
+        Record that the release points were loaded ('loaded') or are not in the load schedule ('unscheduled')
+        """
+        with self.lock:
+            for name in names:
+                item = self.releasepoints.setdefault(name, {'titles': {}})
+                item['load'] = status
+
+    def isExtracted(self, name: str, title: str, dir_name: str, url: str = None):
+        """
+        Check that the title was fully extracted from `url`: every file of the zip is in `dir_name` with its size
+        """
+        entry = self.getTitle(name, title)
+        if not entry or entry.get('status') != 'extracted' or not entry.get('files'):
+            return False
+        if url and entry.get('url') not in (url, url.replace('u1.zip', '.zip')):
+            return False
+        for filename, size in entry['files'].items():
+            path = os.path.join(dir_name, filename)
+            if not os.path.isfile(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.releasepoints, f)
+        os.replace(tmp_path, self.path)
+
+
+class ExtractIndex:
+    """
+    Index of the zip members already added to the blob store (see blobstore.py), keyed on their CRC32 and size
+    from the zip central directory, stored as JSON in the form::
+
+        {"1a2b3c4d-5678": "<sha256 of the blob>", ...}
+
+    A zip member that matches an entry has the same content as that blob, so it can be linked into
+    the release point directory without being decompressed.
+    """
+
+    def __init__(self, path: str = None):
+        path = path or getSettings().USC_EXTRACT_INDEX_PATH
+        self.path = path
+        self.lock = threading.Lock()
+        self.files = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.files = json.load(f)
+            except Exception as err:
+                logger.error('Could not read extract index ' + path + ': ' + str(err))
+
+    @staticmethod
+    def getKey(info: zipfile.ZipInfo):
+        return '{:08x}-{}'.format(info.CRC, info.file_size)
+
+    def getBlob(self, info: zipfile.ZipInfo):
+        """
+        Get the sha256 of a blob with the same CRC32 and size as the zip member, if it is still in the store
+        """
+        key = self.getKey(info)
+        with self.lock:
+            sha = self.files.get(key)
+        if not isBlobId(sha) or not getBlobPath(sha):
+            with self.lock:
+                self.files.pop(key, None)
+            return None
+        return sha
+
+    def add(self, info: zipfile.ZipInfo, sha: str):
+        with self.lock:
+            self.files[self.getKey(info)] = sha
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.files, f)
+            os.replace(tmp_path, self.path)
+
+
+class ReleasepointSaver:
+    """
+    Saves the sync manifest, and the extract index, once every title job of a release point is done, rather
+    than after each title: both files are rewritten whole, so saving after each title made the writes of a run
+    grow with the square of its number of titles.
+    """
+
+    def __init__(self, manifest: SyncManifest, extractIndex: ExtractIndex = None):
+        self.manifest = manifest
+        self.extractIndex = extractIndex
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def expect(self, jobs: List):
+        """
+        Count the title jobs of each release point, before they are started
+        """
+        with self.lock:
+            for job in jobs:
+                self.pending[job['name']] = self.pending.get(job['name'], 0) + 1
+
+    def done(self, name: str):
+        """
+        Record that a title job of the release point `name` is done (or cancelled), and save with the last one
+        """
+        with self.lock:
+            self.pending[name] -= 1
+            if self.pending[name] > 0:
+                return
+            del self.pending[name]
+        self.save()
+
+    def save(self):
+        self.manifest.save()
+        if self.extractIndex:
+            self.extractIndex.save()
+
+
 suppressor = SSLWarningSuppressor(target_domains=['uscode.house.gov'])
+hostLimiter = HostLimiter()
 
 URL_ATTEMPTS_MAX = 20
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# (connect, read) timeouts, so that a stalled transfer is retried instead of hanging
+DOWNLOAD_TIMEOUT = (30, 120)
+# Retries wait a random time up to min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** retry) seconds
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 60.0
+# Kinds of failed attempts, as counted in DownloadStats
+FAILURE_KINDS = ('http', 'truncated', 'notzip')
 
-logging.basicConfig(filename='loadusc.log', filemode='w', level='INFO')
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
 
+def getTitleURL(url: str, title: str):
+    """
+    Rewrite a release point url to point to the .zip for a single title
+
+    Args:
+        url (str): url location for the .zip of any title (e.g. xml_uscAll@116-65.zip)
+        title (str): the title number (e.g. '5A') or 'All'
+
+    Returns:
+        tuple: the normalized title (e.g. '05a') and its url
+    """
+    if title != 'All':
+        title = title.lower()
+    if len(title.replace('a', '')) == 1:
+        title = '0' + title
+    return title, re.sub(r"_usc.*@", "_usc" + title + "@", url)
+
+
+def getBackoff(retry: int):
+    """
+    Jittered exponential backoff ("full jitter"): a random delay up to RETRY_BACKOFF_BASE * 2 ** retry seconds
+
+    Args:
+        retry (int): the number of the retry, starting at 1
+
+    Returns:
+        float: the number of seconds to wait
+    """
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2**retry))
+
+
+def sha256File(path: str, nbytes: int = None):
+    """
+    Get a sha256 object updated with the first `nbytes` of the file at `path` (the whole file, if None)
+    """
+    sha = hashlib.sha256()
+    remaining = nbytes
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            size = (
+                DOWNLOAD_CHUNK_SIZE
+                if remaining is None
+                else min(DOWNLOAD_CHUNK_SIZE, remaining)
+            )
+            chunk = f.read(size)
+            if not chunk:
+                break
+            sha.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return sha
+
+
+def downloadToFile(url: str, path: str, headers: dict = None, resume: dict = None):
+    """
+    Stream the response body for `url` to `path`, so that memory use does not depend on the size of the archive.
+    If `resume` is given and `path` holds part of the file, only the rest of the file is requested (HTTP Range).
+
+    Args:
+        url (str): url to download
+        path (str): the file to write to
+        headers (dict, optional): extra request headers, e.g. for a conditional GET. Defaults to None.
+        resume (dict, optional): the result of the previous, truncated, attempt; its validators are sent
+            with If-Range so that the server sends the whole file again if it changed. Defaults to None.
+
+    Returns:
+        dict: the status code, url, validators (etag, lastModified), number of bytes in `path`, their sha256,
+        and whether the file is complete (not truncated)
+
+    Raises:
+        requests.RequestException: if the request fails before a response is received
+    """
+    headers = dict(headers or {})
+    offset = os.path.getsize(path) if resume and os.path.exists(path) else 0
+    validator = resume and (resume.get('etag') or resume.get('lastModified'))
+    if offset and validator:
+        headers['Range'] = 'bytes=' + str(offset) + '-'
+        headers['If-Range'] = validator
+    else:
+        offset = 0
+    result = {
+        'url': url,
+        'status': None,
+        'bytes': offset,
+        'etag': None,
+        'lastModified': None,
+        'complete': False,
+    }
+    with span('http_fetch', kind='zip') as timing, suppressor.get(
+        url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT
+    ) as r:
+        result['status'] = r.status_code
+        timing.set(status=r.status_code)
+        result['etag'] = r.headers.get('ETag')
+        result['lastModified'] = r.headers.get('Last-Modified')
+        if r.status_code == 206 and r.headers.get('Content-Range', '').startswith(
+            'bytes ' + str(offset) + '-'
+        ):
+            sha = sha256File(path, offset)
+            mode = 'ab'
+            expected = r.headers['Content-Range'].rsplit('/', 1)[-1]
+        elif r.status_code == 200:
+            sha = hashlib.sha256()
+            mode = 'wb'
+            result['bytes'] = 0
+            expected = r.headers.get('Content-Length')
+        else:
+            if r.status_code == 206:
+                # Not the range that was asked for: start the next attempt from the beginning
+                open(path, 'wb').close()
+                result['bytes'] = 0
+            return result
+        with open(path, mode) as f:
+            try:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    sha.update(chunk)
+                    result['bytes'] += len(chunk)
+            except requests.RequestException as err:
+                # The connection dropped: keep what was received, so that the next attempt can resume
+                result['error'] = str(err)
+                timing.set(outcome='truncated')
+                return result
+            finally:
+                increment('download_bytes', result['bytes'] - offset)
+    result['sha256'] = sha.hexdigest()
+    result['complete'] = not (expected and expected.isdigit()) or result[
+        'bytes'
+    ] >= int(expected)
+    return result
+
+
+def getMemberPath(dir_name: str, filename: str):
+    """
+    Get the normalized name of a zip member and the path it is extracted to, unless the name is absolute
+    or leads out of `dir_name`
+
+    Returns:
+        tuple: the name, relative to `dir_name`, and the path; (None, None) if the member is rejected
+    """
+    name = os.path.normpath(filename.replace('\\', '/'))
+    if os.path.isabs(name) or os.path.splitdrive(name)[0]:
+        return None, None
+    root = os.path.abspath(dir_name)
+    target = os.path.abspath(os.path.join(root, name))
+    if target == root or os.path.commonpath([root, target]) != root:
+        return None, None
+    return name, target
+
+
+def extractZip(z: zipfile.ZipFile, dir_name: str, extractIndex: ExtractIndex = None):
+    """
+    Extract the files of a zip into `dir_name`.
+
+    An existing file is removed before it is written, never overwritten in place, since it may be
+    a hard link to a blob. With an ExtractIndex, each member is added to the blob store (unless the index
+    shows a blob with the same CRC32 and size is already there), linked into `dir_name`, and recorded
+    in the release point manifest of the store. Members whose name is absolute or leads out of `dir_name`
+    are not extracted.
+
+    Args:
+        z (zipfile.ZipFile): the open zip file
+        dir_name (str): name of the directory to unzip into
+        extractIndex (ExtractIndex, optional): index of zip members already in the blob store. Defaults to None.
+
+    Returns:
+        dict: counts of the files 'written' and 'linked' (already in the store), the bytes not written
+        ('linkedBytes'), and the extracted 'files' with their sizes
+    """
+    counts = {'written': 0, 'linked': 0, 'linkedBytes': 0, 'files': {}}
+    blobs = {}
+    for info in z.infolist():
+        if info.is_dir():
+            continue
+        name, target = getMemberPath(dir_name, info.filename)
+        if name is None:
+            logger.error(
+                'Not extracting {}: outside {}'.format(info.filename, dir_name)
+            )
+            continue
+        counts['files'][name] = info.file_size
+        if extractIndex is None:
+            if os.path.lexists(target):
+                os.remove(target)
+            # Not z.extract, which would make its own path of the member name
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with z.open(info) as member, open(target, 'wb') as f:
+                shutil.copyfileobj(member, f)
+            counts['written'] += 1
+            continue
+        sha = extractIndex.getBlob(info)
+        new = False
+        if sha is None:
+            with z.open(info) as member:
+                sha, _, new = putStream(member)
+            extractIndex.add(info, sha)
+        if new:
+            counts['written'] += 1
+        else:
+            counts['linked'] += 1
+            counts['linkedBytes'] += info.file_size
+        materializeBlob(sha, target)
+        blobs[name] = {'sha256': sha, 'size': info.file_size}
+    if blobs:
+        updateReleasePointManifest(os.path.basename(os.path.normpath(dir_name)), blobs)
+    return counts
+
+
+def getAndUnzipTitle(
+    url: str,
+    dir_name: str,
+    stats: DownloadStats = None,
+    manifest: SyncManifest = None,
+    name: str = None,
+    title: str = None,
+    conditional: bool = False,
+    extractIndex: ExtractIndex = None,
+):
+    """
+    Download the zip file for a single title to a temporary file and unzip it into `dir_name`.
+
+    Failed attempts are retried up to URL_ATTEMPTS_MAX times, with jittered exponential backoff.
+    A truncated transfer is resumed from the last byte received. If a `u1.zip` url cannot be downloaded,
+    the `.zip` url is tried instead (once).
+
+    Args:
+        url (str): url location for the .zip
+        dir_name (str): name of the directory to unzip into
+        stats (DownloadStats, optional): counters to update for the throughput summary. Defaults to None.
+        manifest (SyncManifest, optional): sync manifest to record the download in. Defaults to None.
+        name (str, optional): releasepoint name, the key in the manifest. Defaults to None.
+        title (str, optional): normalized title (e.g. '05a'), the key in the manifest. Defaults to None.
+        conditional (bool, optional): send the validators from the manifest, and skip the title
+            if the server answers 304 Not Modified. Defaults to False.
+        extractIndex (ExtractIndex, optional): index of zip members already in the blob store; if given, files
+            are stored as blobs and hard-linked into `dir_name`. Defaults to None (write every file).
+
+    Returns:
+        bool: True if the zip was extracted, or is unchanged since it was last extracted
+    """
+    headers = {}
+    entry = manifest.getTitle(name, title) if manifest else None
+    if conditional and entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('lastModified'):
+            headers['If-Modified-Since'] = entry['lastModified']
+    releasepointsPath = getSettings().USC_RELEASEPOINT_DIRPATH
+    os.makedirs(releasepointsPath, exist_ok=True)
+    fd, zip_path = tempfile.mkstemp(suffix='.zip.part', dir=releasepointsPath)
+    os.close(fd)
+    try:
+        failures = dict.fromkeys(FAILURE_KINDS, 0)
+        fallback = url.find('u1.zip') > 0
+        result = None
+        resume = None
+        check = False
+        for attempt in range(URL_ATTEMPTS_MAX):
+            if attempt:
+                increment('download_retries')
+                time.sleep(getBackoff(attempt))
+                print('Trying to get url ' + url + '...')
+            kind = None
+            try:
+                with hostLimiter.slot(url):
+                    result = downloadToFile(
+                        url,
+                        zip_path,
+                        headers=None if resume else headers,
+                        resume=resume,
+                    )
+            except requests.RequestException as err:
+                # No response: a partial file from an earlier attempt is kept for the next one
+                logger.debug(url + ': ' + str(err))
+                kind = 'http'
+            else:
+                if result['status'] == 304:
+                    increment('download_not_modified')
+                    print(url + ' not modified')
+                    if stats:
+                        stats.addUnchanged()
+                    return True
+                if result['status'] not in (200, 206):
+                    kind = 'http'
+                    resume = None
+                elif not result['complete']:
+                    kind = 'truncated'
+                    resume = result
+                else:
+                    with span('zip_validate') as timing:
+                        check = zipfile.is_zipfile(zip_path)
+                        timing.set(outcome='ok' if check else 'notzip')
+                    if check:
+                        break
+                    kind = 'notzip'
+                    resume = None
+            failures[kind] += 1
+            increment('download_failures', kind=kind)
+            if stats:
+                stats.addFailure(kind)
+            if fallback and kind in ('http', 'notzip'):
+                fallback = False
+                url = url.replace('u1.zip', '.zip')
+        if not check:
+            logger.error(
+                'Could not download '
+                + url
+                + ': '
+                + ', '.join(k + '=' + str(v) for k, v in failures.items())
+            )
+            if manifest:
+                manifest.setTitle(name, title, {'url': url, 'status': 'failed'})
+            if stats:
+                stats.add(ok=False)
+            return False
+        try:
+            with zipfile.ZipFile(zip_path) as z, span(
+                'extract', mode='link' if extractIndex else 'all'
+            ):
+                # Several titles of the same release point may be extracted at the same time
+                os.makedirs(dir_name, exist_ok=True)
+                counts = extractZip(z, dir_name, extractIndex=extractIndex)
+            increment('extract_files', counts['written'], result='written')
+            increment('extract_files', counts['linked'], result='linked')
+            increment('extract_linked_bytes', counts['linkedBytes'])
+        except Exception as err:
+            print('Could not unzip: ' + str(err))
+            if manifest:
+                manifest.setTitle(name, title, {'url': url, 'status': 'failed'})
+            if stats:
+                stats.add(ok=False)
+            return False
+        if manifest:
+            manifest.setTitle(
+                name,
+                title,
+                {
+                    'url': url,
+                    'etag': result['etag'],
+                    'lastModified': result['lastModified'],
+                    'size': result['bytes'],
+                    'sha256': result.get('sha256'),
+                    'status': 'extracted',
+                    'files': counts['files'],
+                },
+            )
+        if stats:
+            stats.add(result['bytes'])
+            stats.addExtracted(
+                counts['written'], counts['linked'], counts['linkedBytes']
+            )
+        return True
+    finally:
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+
+
 def getAndUnzipURL(
-    url: str, dir_name: str, titlesAffected: List = ['All'], redownload: bool = False
+    url: str,
+    dir_name: str,
+    titlesAffected: List = ['All'],
+    redownload: bool = False,
+    stats: DownloadStats = None,
 ):
     """
     Given a url download zip file for a U.S. Code title
@@ -81,38 +768,14 @@ def getAndUnzipURL(
         dir_name (str): name of the directory to download
         titlesAffected (list, optional): list of titles of the USC affected by the releasepoint. Defaults to ['All'].
         redownload (bool, optional): replace existind releasepoint, if it exists in local directory. Defaults to False.
+        stats (DownloadStats, optional): counters to update for the throughput summary. Defaults to None.
     """
     print('Getting USC updates for: ' + url)
     if not os.path.exists(dir_name) or redownload:
         for title in titlesAffected:
-            if title != 'All':
-                title = title.lower()
-            if len(title.replace('a', '')) == 1:
-                title = '0' + title
+            title, url = getTitleURL(url, title)
             print('Getting title: ' + title)
-            url = re.sub(r"_usc.*@", "_usc" + title + "@", url)
-            r = suppressor.get(url, stream=True, verify=False)
-            check = zipfile.is_zipfile(io.BytesIO(r.content))
-            attempts = 0
-            while not check:
-                print('Trying to get url...')
-                if url.find('u1.zip') > 0:
-                    url2 = url.replace('u1.zip', '.zip')
-                    r = suppressor.get(url2, stream=True, verify=False)
-                    check = zipfile.is_zipfile(io.BytesIO(r.content))
-                if not check:
-                    r = suppressor.get(url, stream=True, verify=False)
-                    check = zipfile.is_zipfile(io.BytesIO(r.content))
-                attempts += 1
-                if attempts == URL_ATTEMPTS_MAX:
-                    break
-            else:
-                try:
-                    z = zipfile.ZipFile(io.BytesIO(r.content))
-                except Exception as err:
-                    print('Could not unzip: ' + str(err))
-                    continue
-                z.extractall(dir_name)
+            getAndUnzipTitle(url, dir_name, stats=stats)
     else:
         print(dir_name + ' already exists')
 
@@ -152,28 +815,15 @@ def getTitlesAffected(urlText: str):
     return [item for item in titlesAffected if item]
 
 
-def getUSCReleasePoints(writeToFile: bool = True):
+def parseCurrentReleasePointSoup(content: bytes):
     """
-    Get current release point, linked from https://uscode.house.gov/download/download.shtml,
-    e.g. https://uscode.house.gov/download/releasepoints/us/pl/116/65/xml_uscAll@116-65.zip
-
-    Args:
-        writeToFile (bool, optional): [description]. Defaults to True.
+    Parse the current release point from download.shtml with BeautifulSoup (see also
+    releasepointindex.parseCurrentReleasePoint)
 
     Returns:
-        list: a list of dicts with the url, date and other information for each releasepoint
+        dict: the name, date, titlesAffected and url of the release point
     """
-
-    # Turn off certificate verification since uscode.house.gov uses self-signed certificates
-    current_usc_html_resp = suppressor.get(
-        USC_HTML_PAGE_BASE + CURRENT_USC_HTML_PAGE, verify=False
-    )
-    if current_usc_html_resp.status_code == 200:
-        current_soup = BeautifulSoup(current_usc_html_resp.content, features="lxml")
-    else:
-        print('Could not get page from: ' + USC_HTML_PAGE_BASE + USC_HTML_PAGE)
-        return
-
+    current_soup = BeautifulSoup(content, features="lxml")
     title_h3 = current_soup.find('h3', attrs={'class': 'releasepointinformation'})
     release_date = None
     if title_h3:
@@ -203,21 +853,25 @@ def getUSCReleasePoints(writeToFile: bool = True):
     else:
         downloadlink = ''
 
-    current_releasepoint = {
+    return {
         'name': current_name,
         'date': release_date,
         'titlesAffected': titlesAffected,
         'url': USC_HTML_PAGE_BASE + downloadlink,
     }
 
-    usc_html_resp = suppressor.get(USC_HTML_PAGE_BASE + USC_HTML_PAGE, verify=False)
-    if usc_html_resp.status_code == 200:
-        soup = BeautifulSoup(usc_html_resp.content, features="lxml")
-    else:
-        print('Could not get page from: ' + USC_HTML_PAGE_BASE + USC_HTML_PAGE)
-        return
+
+def parsePriorReleasePointsSoup(content: bytes):
+    """
+    Parse the release points linked from priorreleasepoints.htm with BeautifulSoup (see also
+    releasepointindex.parsePriorReleasePoints)
+
+    Returns:
+        list: a dict with the name, date, titlesAffected and url of each release point
+    """
+    soup = BeautifulSoup(content, features="lxml")
     downloadLinks = soup.findAll('a', attrs={'class': 'releasepoint'})
-    releasepoints = [
+    return [
         {
             'name': getDirName(link.attrs.get('href')),
             'date': getReleaseDate(link.getText()),
@@ -230,10 +884,44 @@ def getUSCReleasePoints(writeToFile: bool = True):
         for link in downloadLinks
         if re.search(r'([0-9]{2}\/[0-9]{2}\/[0-9]{2})', link.getText())
     ]
+
+
+def getUSCReleasePoints(writeToFile: bool = True, useCache: bool = True):
+    """
+    Get current release point, linked from https://uscode.house.gov/download/download.shtml,
+    e.g. https://uscode.house.gov/download/releasepoints/us/pl/116/65/xml_uscAll@116-65.zip
+
+    Args:
+        writeToFile (bool, optional): [description]. Defaults to True.
+        useCache (bool, optional): keep copies of the index pages, parse them only when they change and merge
+            the release points into uscreleasepoints.json (see releasepointindex.py); otherwise, download and
+            parse both pages and replace uscreleasepoints.json. Defaults to True.
+
+    Returns:
+        list: a list of dicts with the url, date and other information for each releasepoint
+    """
+    if useCache:
+        return refreshReleasePoints(suppressor.get, writeToFile=writeToFile)
+
+    current_usc_html_resp = suppressor.get(USC_HTML_PAGE_BASE + CURRENT_USC_HTML_PAGE)
+    if current_usc_html_resp.status_code == 200:
+        current_releasepoint = parseCurrentReleasePointSoup(
+            current_usc_html_resp.content
+        )
+    else:
+        print('Could not get page from: ' + USC_HTML_PAGE_BASE + USC_HTML_PAGE)
+        return
+
+    usc_html_resp = suppressor.get(USC_HTML_PAGE_BASE + USC_HTML_PAGE)
+    if usc_html_resp.status_code == 200:
+        releasepoints = parsePriorReleasePointsSoup(usc_html_resp.content)
+    else:
+        print('Could not get page from: ' + USC_HTML_PAGE_BASE + USC_HTML_PAGE)
+        return
     releasepoints.insert(0, current_releasepoint)
     try:
         if writeToFile:
-            with open(USC_RELEASEPOINT_JSON_PATH, 'w') as f:
+            with open(getSettings().USC_RELEASEPOINT_JSON_PATH, 'w') as f:
                 json.dump(releasepoints, f)
     except Exception as err:
         logger.error(str(err))
@@ -244,30 +932,164 @@ def getUSCReleasePoints(writeToFile: bool = True):
     #           continue
 
 
-def downloadUSCReleasepointZips(redownload: bool = False):
+def getDownloadJobs(
+    releasepoints: List, redownload: bool = False, manifest: SyncManifest = None
+):
     """
-    Gets the list of releasepoints, downloads .zip files and unzips them
+    List the title zips to download for the releasepoints.
+    Only the titles affected are downloaded for each releasepoint, except for the oldest one, which gets all titles.
+
+    Without a manifest, a releasepoint is skipped if its directory exists. With a manifest, a title is skipped
+    if the manifest shows it was fully extracted, except for the current releasepoint (the first one),
+    which can change under the same name: it gets a conditional GET instead.
 
     Args:
-        redownload (bool, optional): replace existing directory for releasepoint, if it exists. Defaults to False.
+        releasepoints (list): releasepoints, as returned by getUSCReleasePoints
+        redownload (bool, optional): download every title, whatever is already on disk. Defaults to False.
+        manifest (SyncManifest, optional): the sync manifest of previous downloads. Defaults to None.
+
+    Returns:
+        list: a list of dicts with the url, dir_name, releasepoint name, title and whether to use a conditional GET
     """
-    releasepoints = getUSCReleasePoints()
+    releasepointsPath = getSettings().USC_RELEASEPOINT_DIRPATH
+    jobs = []
     for index, releasepoint in enumerate(releasepoints, start=1):
         url = releasepoint.get('url')
-        if url and index != len(releasepoints):
-            dir_name = os.path.join(USC_RELEASEPOINT_DIRPATH, releasepoint.get('name'))
-            getAndUnzipURL(
-                url,
-                dir_name,
-                titlesAffected=releasepoint.get('titlesAffected'),
-                redownload=redownload,
+        if not url:
+            continue
+        name = releasepoint.get('name')
+        dir_name = os.path.join(releasepointsPath, name)
+        if manifest is None and os.path.exists(dir_name) and not redownload:
+            print(dir_name + ' already exists')
+            continue
+        if manifest is not None:
+            manifest.setReleasepoint(releasepoint)
+        if index != len(releasepoints):
+            titlesAffected = releasepoint.get('titlesAffected')
+        else:
+            # Download all titles for the oldest releasepoint
+            titlesAffected = ['All']
+        for title in titlesAffected:
+            title, url = getTitleURL(url, title)
+            conditional = False
+            if (
+                manifest is not None
+                and not redownload
+                and manifest.isExtracted(name, title, dir_name, url)
+            ):
+                if index != 1:
+                    continue
+                conditional = True
+            jobs.append(
+                {
+                    'url': url,
+                    'dir_name': dir_name,
+                    'name': name,
+                    'title': title,
+                    'conditional': conditional,
+                }
             )
-    # Download all titles for the oldest releasepoint
-    getAndUnzipURL(url, dir_name, titlesAffected=['All'], redownload=redownload)
+    return jobs
+
+
+def configureDownloads(workers: int, perHostMax: int):
+    """
+    Size the HTTP connection pool and the per-host limit for `workers` simultaneous downloads
+
+    Returns:
+        int: the number of workers (at least 1)
+    """
+    workers = max(1, int(workers))
+    hostLimiter.perHostMax = max(1, int(perHostMax))
+    hostLimiter.semaphores = {}
+    suppressor.setPoolSize(max(workers, hostLimiter.perHostMax))
+    return workers
+
+
+def downloadUSCReleasepointZips(
+    redownload: bool = False,
+    workers: int = None,
+    perHostMax: int = None,
+    extractMode: str = None,
+    usePageCache: bool = True,
+):
+    """
+    Gets the list of releasepoints, downloads .zip files and unzips them.
+    Titles already extracted, according to the sync manifest, are not downloaded again.
+
+    Args:
+        redownload (bool, optional): replace existing directory for releasepoint, if it exists. Defaults to False.
+        workers (int, optional): number of zips to download at the same time. Defaults to None, for DOWNLOAD_WORKERS.
+        perHostMax (int, optional): maximum simultaneous downloads from one host. Defaults to None, for
+            DOWNLOAD_PER_HOST_MAX.
+        extractMode (str, optional): 'link' to make releasepoint directories hard-link farms over the blob store,
+            'all' to write every file. Defaults to None, for EXTRACT_MODE.
+        usePageCache (bool, optional): parse the release point index pages only if they changed
+            (see releasepointindex.py). Defaults to True.
+    """
+    settings = getSettings()
+    workers = workers or settings.DOWNLOAD_WORKERS
+    perHostMax = perHostMax or settings.DOWNLOAD_PER_HOST_MAX
+    extractMode = extractMode or settings.EXTRACT_MODE
+    releasepoints = getUSCReleasePoints(useCache=usePageCache)
+    if not releasepoints:
+        return
+    manifest = SyncManifest()
+    jobs = getDownloadJobs(releasepoints, redownload=redownload, manifest=manifest)
+    manifest.save()
+    extractIndex = ExtractIndex() if extractMode == 'link' else None
+    saver = ReleasepointSaver(manifest, extractIndex)
+    saver.expect(jobs)
+    stats = DownloadStats()
+    workers = configureDownloads(workers, perHostMax)
+    try:
+        if workers == 1:
+            for job in jobs:
+                print('Getting USC updates for: ' + job['url'])
+                try:
+                    getAndUnzipTitle(
+                        stats=stats, manifest=manifest, extractIndex=extractIndex, **job
+                    )
+                finally:
+                    saver.done(job['name'])
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for job in jobs:
+                    future = executor.submit(
+                        getAndUnzipTitle,
+                        stats=stats,
+                        manifest=manifest,
+                        extractIndex=extractIndex,
+                        **job
+                    )
+                    future.add_done_callback(
+                        lambda future, name=job['name']: saver.done(name)
+                    )
+                    futures[future] = job['url']
+                for future in as_completed(futures):
+                    try:
+                        if not future.result():
+                            logger.error('Could not download ' + futures[future])
+                    except Exception as err:
+                        stats.add(ok=False)
+                        logger.error(
+                            'Could not download ' + futures[future] + ': ' + str(err)
+                        )
+    finally:
+        # What was recorded for a release point interrupted part way
+        saver.save()
+    logger.info(stats.summary())
 
 
 def processUSCReleasePoints(
-    download: bool = True, redownload: bool = False, loglevel: str = 'DEBUG'
+    download: bool = True,
+    redownload: bool = False,
+    loglevel: str = 'DEBUG',
+    workers: int = None,
+    perHostMax: int = None,
+    extractMode: str = None,
+    usePageCache: bool = True,
 ):
     '''
     Process USC Release Points from uscode.house.gov
@@ -288,7 +1110,7 @@ def processUSCReleasePoints(
     if loglevel == 'ERROR':
         levelvar = logging.ERROR
 
-    logging.basicConfig(filename='import.log', filemode='w', level=levelvar)
+    logging.basicConfig(filename='import.log', filemode='a', level=levelvar)
     logging.getLogger().addHandler(logging.StreamHandler())
 
     logger.info('Processing USC release points...')
@@ -296,10 +1118,18 @@ def processUSCReleasePoints(
     logger.info('===================')
 
     if download:
-        downloadUSCReleasepointZips(redownload=redownload)
+        downloadUSCReleasepointZips(
+            redownload=redownload,
+            workers=workers,
+            perHostMax=perHostMax,
+            extractMode=extractMode,
+            usePageCache=usePageCache,
+        )
 
 
 if __name__ == '__main__':
+    logging.basicConfig(filename='loadusc.log', filemode='a', level='INFO')
+    settings = getSettings()
     parser = argparse.ArgumentParser(description='Download USC versions.', epilog='')
     parser.add_argument(
         '-d',
@@ -317,8 +1147,42 @@ if __name__ == '__main__':
         default=False,
         help='Replace any existing files with new download (default: %(default)s)',
     )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        action='store',
+        dest='workers',
+        type=int,
+        default=settings.DOWNLOAD_WORKERS,
+        help='Number of zips to download at the same time (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--per-host',
+        action='store',
+        dest='perHostMax',
+        type=int,
+        default=settings.DOWNLOAD_PER_HOST_MAX,
+        help='Maximum simultaneous downloads from one host (default: %(default)s)',
+    )
+    parser.add_argument(
+        '-x',
+        '--extract',
+        action='store',
+        dest='extractMode',
+        choices=['link', 'all'],
+        default=settings.EXTRACT_MODE,
+        help='Store files in the content-addressed blob store and hard-link them into the releasepoint '
+        'directories, or write all files (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--no-page-cache',
+        action='store_false',
+        dest='usePageCache',
+        help='Download and parse the release point index pages even if they have not changed',
+    )
 
     args = parser.parse_args()
+    settings.validate()
 
     logger.info(json.dumps(args.__dict__))
     logger.info('===============================')
@@ -0,0 +1,173 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Map query dates to the release point dates on which the USC in XCiteDB changes'
+
+# The database only changes on the dates release points are loaded for. A query for any date between two of
+# them gives the same result as a query for the earlier one, its effective date. getxcite.py queries and
+# caches by effective date, so that queries for all the days of a release point share one result.
+#
+# The effective dates are the successful load dates in the load ledger, together with the dates of the
+# release points in uscreleasepoints.json (from the public law store, see publawstore.py), in case some loads
+# are missing from the ledger. They are read again when the database version (querycache.getLedgerVersion) changes.
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+try:
+    from settings import getSettings, SettingsError
+except ImportError:
+    from loadusc.settings import getSettings, SettingsError
+
+logger = logging.getLogger(__name__)
+
+# Ends of an open date range when there are no effective dates to bound it with
+EARLIEST_DATE = datetime(1900, 1, 1)
+LATEST_DATE = datetime(9999, 12, 31)
+
+
+def getLedgerDates(ledgerPath: str = None):
+    """
+    Get the dates with a successful load in the load ledger, without creating the ledger if it does not exist
+
+    Returns:
+        list: the dates, as datetime objects
+    """
+    ledgerPath = ledgerPath or getSettings().LOAD_LEDGER_PATH
+    if not os.path.isfile(ledgerPath):
+        return []
+    try:
+        connection = sqlite3.connect('file:' + ledgerPath + '?mode=ro', uri=True)
+        try:
+            rows = connection.execute(
+                'SELECT DISTINCT date FROM loads WHERE exit_code = 0'
+            ).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as err:
+        logger.warning('Could not read the load ledger: {}'.format(err))
+        return []
+    return [datetime.strptime(row[0], '%m/%d/%Y') for row in rows]
+
+
+def getScheduleDates(releasepointJSONPath: str = None, publawsDict: str = None):
+    """
+    Get the dates the downloaded release points are loaded for (see loadplan.getLoadSchedule). This is on the
+    query path: the public law store is only read, as it is, and without the data directory or its settings
+    there are no dates.
+
+    Args:
+        releasepointJSONPath (str, optional): uscreleasepoints.json. Defaults to USC_RELEASEPOINT_JSON_PATH.
+        publawsDict (str, optional): a publawsDict.json to use instead of the public law store. Defaults to None.
+
+    Returns:
+        list: the dates, as datetime objects; empty if the release points or public laws are missing
+    """
+    try:
+        from loadplan import getReleasePointSchedule
+    except ImportError:
+        from loadusc.loadplan import getReleasePointSchedule
+
+    try:
+        releasepointJSONPath = (
+            releasepointJSONPath or getSettings().USC_RELEASEPOINT_JSON_PATH
+        )
+        if not os.path.isfile(releasepointJSONPath):
+            return []
+        if publawsDict:
+            if not os.path.isfile(publawsDict):
+                return []
+        elif not os.path.isfile(getSettings().PUBLAW_STORE_PATH):
+            return []
+    except (SettingsError, OSError) as err:
+        logger.debug('No release point schedule: {}'.format(err))
+        return []
+
+    try:
+        with open(releasepointJSONPath, 'r') as f:
+            releasepoints = json.load(f)
+        schedule = getReleasePointSchedule(releasepoints, publawsDict, readonly=True)
+    except (OSError, ValueError, SettingsError, sqlite3.Error) as err:
+        logger.warning('Could not read the release point schedule: {}'.format(err))
+        return []
+    return [datetime.strptime(release_date, '%m/%d/%Y') for release_date, _ in schedule]
+
+
+class EffectiveDates:
+    """Sorted effective dates of the database, reloaded when its version changes. Thread-safe."""
+
+    def __init__(
+        self,
+        ledgerPath: str = None,
+        releasepointJSONPath: str = None,
+        publawsDict: str = None,
+    ):
+        # None: the paths of the settings, when the dates are first read
+        self.ledgerPath = ledgerPath
+        self.releasepointJSONPath = releasepointJSONPath
+        self.publawsDict = publawsDict
+        self.lock = threading.Lock()
+        self.version = None
+        self.dates = None
+
+    def getDates(self, version=None):
+        """
+        Get the effective dates, in chronological order, reading them again if `version` has changed
+        """
+        with self.lock:
+            if self.dates is None or version != self.version:
+                dates = set(getLedgerDates(self.ledgerPath))
+                dates.update(
+                    getScheduleDates(self.releasepointJSONPath, self.publawsDict)
+                )
+                self.dates = sorted(dates)
+                self.version = version
+            return self.dates
+
+    def getEffectiveDate(self, date: datetime, version=None):
+        """
+        Get the effective date of the database version at `date`: the latest effective date on or before it
+
+        Args:
+            date (datetime): the date queried
+            version (str, optional): the database version (querycache.getLedgerVersion). Defaults to None.
+
+        Returns:
+            datetime: the effective date, or `date` (without the time) if there are no effective dates before it
+        """
+        day = datetime(date.year, date.month, date.day)
+        dates = self.getDates(version)
+        index = bisect_right(dates, day)
+        return dates[index - 1] if index else day
+
+    def getEffectiveRange(
+        self, fromDate: datetime = None, toDate: datetime = None, version=None
+    ):
+        """
+        Narrow a date range to the first and last effective dates in it; changes can only be on those dates
+
+        Args:
+            fromDate (datetime, optional): the start of the range. Defaults to None, for the first effective date.
+            toDate (datetime, optional): the end of the range. Defaults to None, for the last effective date.
+            version (str, optional): the database version (querycache.getLedgerVersion). Defaults to None.
+
+        Returns:
+            tuple: (fromDate, toDate), with a missing end filled in (EARLIEST_DATE or LATEST_DATE if there are no
+            effective dates), otherwise unchanged if there are no effective dates in the range
+        """
+        dates = self.getDates(version)
+        if fromDate is None:
+            fromDate = dates[0] if dates else EARLIEST_DATE
+        if toDate is None:
+            toDate = dates[-1] if dates else LATEST_DATE
+        start = bisect_left(
+            dates, datetime(fromDate.year, fromDate.month, fromDate.day)
+        )
+        end = bisect_right(dates, datetime(toDate.year, toDate.month, toDate.day))
+        if start >= end:
+            return fromDate, toDate
+        return dates[start], dates[end - 1]
@@ -6,131 +6,224 @@ import sys
 
 import logging
 import subprocess
+import copy
 import json
+import heapq
+import asyncio
+import weakref
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 try:
-    import re2 as re
+    from settings import getSettings
+    from querycache import QueryCache
+    from effectivedates import EffectiveDates
+    from changeindex import ChangeIndexReader
+    from sectionreader import SectionReader
+    from identifiers import parseIdentifier
+    from metrics import span, increment
 except ImportError:
-    import re
+    from loadusc.settings import getSettings
+    from loadusc.querycache import QueryCache
+    from loadusc.effectivedates import EffectiveDates
+    from loadusc.changeindex import ChangeIndexReader
+    from loadusc.sectionreader import SectionReader
+    from loadusc.identifiers import parseIdentifier
+    from loadusc.metrics import span, increment
 
-try:
-    from constants import (
-        XCITEDBPATH,
-        XMLDBPATH,
-        IDENTIFIER_TYPE_REGEX,
-        USC_REGEX,
-        NAMED_LAW_REGEX,
-    )
-except ImportError:
-    from loadusc.constants import (
-        XCITEDBPATH,
-        XMLDBPATH,
-        IDENTIFIER_TYPE_REGEX,
-        USC_REGEX,
-        NAMED_LAW_REGEX,
-    )
-
-logging.basicConfig(filename='loadusc.log', filemode='w', level='INFO')
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
+# The query cache, effective dates, change index and section reader, created on first use with the settings
+# of that time: importing this module reads no settings or files
+sharedObjects = {}
+sharedObjectsLock = threading.Lock()
+# One semaphore per event loop, limiting its XCiteDB queries to XCITEDB_ASYNC_CONCURRENCY
+asyncSemaphores = weakref.WeakKeyDictionary()
 
-def getIdentifier(identifier='', date=datetime.now()):
-    """Returns a Dict containing an array of the node(s) corresponding to `identifier` at `dateString`.
+
+def getShared(name: str, factory):
+    shared = sharedObjects.get(name)
+    if shared is None:
+        with sharedObjectsLock:
+            shared = sharedObjects.get(name)
+            if shared is None:
+                shared = factory()
+                sharedObjects[name] = shared
+    return shared
+
+
+def getQueryCache():
+    return getShared('queryCache', QueryCache)
+
+
+def getEffectiveDates():
+    return getShared('effectiveDates', EffectiveDates)
+
+
+def getChangeIndexReader():
+    return getShared('changeIndexReader', ChangeIndexReader)
+
+
+def getSectionReader():
+    return getShared('sectionReader', SectionReader)
+
+
+def getCacheStats():
+    """Returns the hits, misses, evictions, expirations and invalidations of the query result cache."""
+    return getQueryCache().getStats()
+
+
+def getEffectiveDate(date=datetime.now()):
+    """Returns the date of the release point version in effect at `date`: the latest date on or before it
+    for which release points were loaded (see effectivedates.py).
 
     Args:
-        identifier (:obj:`str`): a string representation of the node to query
-        date (:obj:`datetime.datetime`): A datetime object.
-        This function converts it to  `mm/DD/YYYY` format to call XCiteDB. Defaults to `datetime.now()`.
+        date (:obj:`datetime.datetime`): A datetime object. Defaults to `datetime.now()`.
 
     Returns:
-        dict:
+        datetime.datetime: the effective date
+    """
+    return getEffectiveDates().getEffectiveDate(date, getQueryCache().getVersion())
 
-        The data returned from queries to XCiteDB, in the form::
 
-            {
-                'success': True/False,
-                'message': 'Return warning, error or info',
-                'xmls': ['<xmlstring/>',...]
-            }
+def clearCache():
+    """Empties the query result cache."""
+    getQueryCache().clear()
+
+
+def runQuery(queryArgs, timeout: float = None, settings=None):
+    """Runs an XCiteDB query with a new XCiteDB process.
+
+    Args:
+        queryArgs (list): the XCiteDB arguments after `-db XMLDBPATH`, e.g. `['-date', '01/02/2020', 'query', ...]`
+        timeout (float): seconds to wait for the query. Defaults to XCITEDB_QUERY_TIMEOUT.
+        settings (:obj:`settings.Settings`): settings for this query only, e.g.
+            `getSettings().replace(XMLDBPATH='/other/xmldb')`. Defaults to None, for the process-wide settings.
+
+    Returns:
+        tuple: (stdout, stderr) of the query, as strings
+    """
+    settings = settings or getSettings()
+    timeout = timeout or settings.XCITEDB_QUERY_TIMEOUT
+    with span('xcitedb_query'):
+        dbquery = subprocess.run(
+            [settings.XCITEDBPATH, '-db', settings.XMLDBPATH] + list(queryArgs),
+            timeout=timeout,
+            capture_output=True,
+        )
+    return (
+        dbquery.stdout.decode('utf-8', 'replace'),
+        dbquery.stderr.decode('utf-8', 'replace'),
+    )
+
+
+def getIdentifierQuery(identifier='', date=datetime.now()):
+    """Normalizes `identifier` and `date` into the XCiteDB query for `getIdentifier`.
+
+    Args:
+        identifier (:obj:`str`): a string representation of the node to query
+        date (:obj:`datetime.datetime`): A datetime object. Defaults to `datetime.now()`.
+
+    Returns:
+        tuple: (respDict, queryList), where queryList is the list of XCiteDB arguments,
+        or None if the identifier or date is not valid and respDict has the error message
     """
     respDict = {}
     if not identifier:
         respDict['success'] = False
         respDict['message'] = 'Identifier not provided'
-        return respDict
+        return respDict, None
 
     if not date or not isinstance(date, datetime):
         respDict['success'] = False
         respDict['message'] = 'Date must be a string of the form mm/dd/yyyy'
-        return respDict
-    else:
-        dateString = date.strftime('%m/%d/%Y')
-
-    queryTerms = None
-    identifier = identifier.replace('-', '–')
-    identifier = re.sub(r'\/$', '', identifier)
-    identifier = re.sub(r'^\/uslm', '', identifier)
+        return respDict, None
 
-    identifierSearch = re.search(IDENTIFIER_TYPE_REGEX, identifier)
-    if not identifierSearch:
+    parsed = parseIdentifier(identifier)
+    if not parsed.isValid:
         respDict['success'] = False
-        respDict['message'] = 'Identifier not in the expected form'
-        return respDict
-    identifierType = identifierSearch.group(1)
-    if identifierType is None or (identifierType not in ['pl', 'usc', 'named']):
-        respDict['success'] = False
-        respDict['message'] = 'Identifier must be of type pl, usc, or named'
-        return respDict
+        respDict['message'] = parsed.error
+        return respDict, None
+
+    # Query the release point version in effect at the date, so that all the dates it covers share a result
+    dateString = getEffectiveDate(date).strftime('%m/%d/%Y')
+    respDict['effectiveDate'] = dateString
+
+    queryList = []
+    if dateString:
+        queryList.extend(['-date', dateString])
+
+    queryList.append('query')
+    queryList.extend(parsed.queryTerms)
+    return respDict, queryList
+
+
+def getStoredIdentifier(respDict, queryList, cacheKey):
+    """Returns the response to a query from `getIdentifierQuery` from the cache or, if XCITEDB_SECTION_FAST_PATH is
+    set and the query is for a section of the current release point, from the release point files
+    (see sectionreader.py).
 
-    # Remove biglevels if there is a section specified in PL
-    if identifierType == 'pl':
-        identifier = identifier.replace(
-            r'(\/us\/pl\/[0-9]+\/[0-9]+)\/(?:.*)(\/s[0-9].*$)', r'\1\2'
+    Args:
+        respDict (dict): the response so far, from `getIdentifierQuery`
+        queryList (list): the XCiteDB arguments, from `getIdentifierQuery`
+        cacheKey (list): the key the response is cached under
+
+    Returns:
+        dict: the response, as from `getIdentifier`, or None if XCiteDB must be queried
+    """
+    cached = getQueryCache().get(cacheKey)
+    if cached is not None:
+        increment('query_cache', result='hit', query='getIdentifier')
+        return cached
+    increment('query_cache', result='miss', query='getIdentifier')
+    if getSettings().XCITEDB_SECTION_FAST_PATH and queryList[2:4] == [
+        'query',
+        '-match',
+    ]:
+        xml = getSectionReader().getCurrentSection(
+            queryList[4], queryList[1], getQueryCache().getVersion()
         )
+        increment('section_fast_path', result='miss' if xml is None else 'hit')
+        if xml is not None:
+            respDict['xmls'] = [xml]
+            respDict['success'] = True
+            return respDict
+    return None
 
-    if identifierType == 'named':
-        namedSearch = re.search(NAMED_LAW_REGEX, identifier)
-        if namedSearch.group(2):
-            queryTerms = [
-                '-match-start',
-                namedSearch.group(1),
-                '-match-end',
-                namedSearch.group(2),
-            ]
-        else:
-            pass
-
-    # Remove biglevels if there is a section specified in USC
-    if identifierType == 'usc':
-        if not re.search(r'\/s[0-9]', identifier):
-            uscSearch = re.search(USC_REGEX, identifier)
-            if uscSearch.group(2):
-                queryTerms = [
-                    '-match-start',
-                    uscSearch.group(1),
-                    '-match-end',
-                    uscSearch.group(2),
-                ]
-        else:
-            identifier = re.sub(
-                r'(\/us\/usc\/t[0-9][^\/]*)\/(?:.*)(\/s[0-9].*$)', r'\1\2', identifier
-            )
 
-    if queryTerms is None:
-        queryTerms = ['-match', identifier]
+def runIdentifierQuery(respDict, queryList):
+    """Runs a query from `getIdentifierQuery`, or gets its result from the cache.
 
-    queryList = [XCITEDBPATH, '-db', XMLDBPATH]
-    if dateString:
-        queryList.extend(['-date', dateString])
+    Args:
+        respDict (dict): the response so far, from `getIdentifierQuery`
+        queryList (list): the XCiteDB arguments, from `getIdentifierQuery`
 
-    queryTerms.insert(0, 'query')
+    Returns:
+        dict: the response, as from `getIdentifier`
+    """
+    cacheKey = ['getIdentifier'] + queryList
+    stored = getStoredIdentifier(respDict, queryList, cacheKey)
+    if stored is not None:
+        return stored
+    response, responseErr = runQuery(queryList)
+    return parseIdentifierResponse(respDict, cacheKey, response, responseErr)
+
+
+def parseIdentifierResponse(respDict, cacheKey, response, responseErr):
+    """Adds the XCiteDB output of an identifier query to `respDict`, and caches it if the query succeeded.
 
-    queryList.extend(queryTerms)
-    dbquery = subprocess.run(queryList, timeout=60, capture_output=True)
-    response = dbquery.stdout
-    responseErr = dbquery.stderr
+    Args:
+        respDict (dict): the response so far, from `getIdentifierQuery`
+        cacheKey (list): the key to cache the response under
+        response (str): the stdout of XCiteDB
+        responseErr (str): the stderr of XCiteDB
+
+    Returns:
+        dict: the response, as from `getIdentifier`
+    """
     if responseErr and len(responseErr) > 0:
         respDict['message'] = responseErr
         logger.info(responseErr)
@@ -140,9 +233,316 @@ def getIdentifier(identifier='', date=datetime.now()):
         respDict['success'] = True
     else:
         respDict['success'] = False
+    if respDict['success'] and not respDict.get('message'):
+        getQueryCache().put(cacheKey, respDict)
+    return respDict
+
+
+def getIdentifier(identifier='', date=datetime.now()):
+    """Returns a Dict containing an array of the node(s) corresponding to `identifier` at `dateString`.
+
+    Args:
+        identifier (:obj:`str`): a string representation of the node to query
+        date (:obj:`datetime.datetime`): A datetime object.
+        This function maps it to the release point date in effect (see `getEffectiveDate`)
+        in `mm/DD/YYYY` format to call XCiteDB. Defaults to `datetime.now()`.
+
+    Returns:
+        dict:
+
+        The data returned from queries to XCiteDB, in the form::
+
+            {
+                'success': True/False,
+                'message': 'Return warning, error or info',
+                'effectiveDate': 'mm/dd/yyyy: the date of the release point version queried',
+                'xmls': ['<xmlstring/>',...]
+            }
+    """
+    with span('get_identifier') as timing:
+        respDict, queryList = getIdentifierQuery(identifier, date)
+        if queryList is not None:
+            respDict = runIdentifierQuery(respDict, queryList)
+        timing.set(outcome='ok' if respDict.get('success') else 'error')
     return respDict
 
 
+def getIdentifiers(requests, workers: int = None):
+    """Returns the responses of `getIdentifier` for many (identifier, date) pairs.
+
+    Pairs that normalize to the same query (e.g. the same section at two dates in one release point) are queried
+    once. The distinct queries are run concurrently, ordered by date.
+
+    Args:
+        requests (list): (identifier, date) pairs, with `date` a `datetime.datetime` as for `getIdentifier`
+        workers (int): number of queries run at the same time. Defaults to XCITEDB_BATCH_WORKERS.
+
+    Returns:
+        list: a response dict, as from `getIdentifier`, for each pair, in the order of `requests`
+    """
+    responses = [None] * len(requests)
+    queries = {}
+    for index, (identifier, date) in enumerate(requests):
+        respDict, queryList = getIdentifierQuery(identifier, date)
+        if queryList is None:
+            responses[index] = respDict
+            continue
+        query = queries.setdefault(tuple(queryList), (respDict, queryList, []))
+        query[2].append(index)
+    ordered = sorted(
+        queries.values(),
+        key=lambda query: datetime.strptime(query[0]['effectiveDate'], '%m/%d/%Y'),
+    )
+    with ThreadPoolExecutor(
+        max_workers=max(
+            1,
+            min(int(workers or getSettings().XCITEDB_BATCH_WORKERS), len(ordered) or 1),
+        )
+    ) as executor:
+        results = executor.map(
+            lambda query: runIdentifierQuery(query[0], query[1]), ordered
+        )
+        for (_, _, indexes), result in zip(ordered, results):
+            responses[indexes[0]] = result
+            for index in indexes[1:]:
+                responses[index] = copy.deepcopy(result)
+    return responses
+
+
+def getChangeDatesQuery(identifier='', fromDate=None, toDate=None):
+    """Normalizes `identifier` and the date range into the XCiteDB log queries for `getChangeDates`.
+
+    Without `fromDate` and `toDate`, the full log is queried. With only one of them, the range is open on the
+    other side: it starts at the first effective date, or ends at the last one (see
+    `effectivedates.EffectiveDates.getEffectiveRange`).
+
+    Args:
+        identifier (:obj:`str`): a string representation of the node to query
+        fromDate (:obj:`datetime.datetime`): A datetime object. Defaults to None.
+        toDate (:obj:`datetime.datetime`): A datetime object. Defaults to None.
+
+    Returns:
+        tuple: (respDict, queryLists, cacheKey), where queryLists are the XCiteDB arguments of the queries
+        for the section and for its descendants, or None if the identifier is not valid and respDict has the error
+    """
+    respDict = {}
+    fromDateString = None
+    toDateString = None
+    # Without a date range, the full log is queried
+    if fromDate is not None or toDate is not None:
+        try:
+            fromDate, toDate = getEffectiveDates().getEffectiveRange(
+                fromDate, toDate, getQueryCache().getVersion()
+            )
+            fromDateString = fromDate.strftime('%m/%d/%Y')
+            toDateString = toDate.strftime('%m/%d/%Y')
+        except Exception as exc:
+            logger.exception(exc)
+            fromDateString = None
+            toDateString = None
+    parsed = parseIdentifier(identifier)
+    if parsed.type is None:
+        respDict['success'] = False
+        respDict['message'] = parsed.error
+        return respDict, None, None
+    if parsed.type != 'usc':
+        respDict['success'] = False
+        respDict['message'] = 'Identifier must be of type pl or usc'
+        return respDict, None, None
+    # Return if there is no section specified in USC
+    if parsed.section is None:
+        respDict['success'] = False
+        respDict[
+            'message'
+        ] = 'US Code identifier must include a section for changeDates query'
+        return respDict, None, None
+    identifier = parsed.identifier + '/'
+
+    queryTermsMatch = ['-match', identifier.rstrip('/')]
+    queryTerms = ['-match-start', identifier]
+
+    queryList = []
+    if fromDateString and toDateString:
+        queryList.extend(['-from-date', fromDateString, '-to-date', toDateString])
+
+    queryTerms.insert(0, 'query')
+    queryTermsMatch.insert(0, 'query')
+
+    cacheKey = ['getChangeDates', identifier, fromDateString, toDateString]
+    queryListMatch = queryList + queryTermsMatch + ['-log']
+    queryList = queryList + queryTerms + ['-log']
+    return respDict, [queryList, queryListMatch], cacheKey
+
+
+def getChangeDateSortKey(entry):
+    """Sort key of a change log entry: its date, then identifier and action. Entries without a valid date go last."""
+    try:
+        month, day, year = entry.get('date').split('/')
+        dateKey = (0, int(year), int(month), int(day))
+    except (AttributeError, ValueError):
+        dateKey = (1, 0, 0, 0)
+    return dateKey + (str(entry.get('identifier', '')), str(entry.get('action', '')))
+
+
+def iterMergedChangeDates(responseLists):
+    """Merges lists of change log entries into one stream, sorted by date, without duplicates.
+
+    Args:
+        responseLists (list): lists of change log entries, as from the XCiteDB log queries
+
+    Yields:
+        dict: the change log entries, by date
+    """
+    previousKey = None
+    for entry in heapq.merge(
+        *(
+            sorted(responseList, key=getChangeDateSortKey)
+            for responseList in responseLists
+        ),
+        key=getChangeDateSortKey,
+    ):
+        key = getChangeDateSortKey(entry)
+        if key == previousKey:
+            continue
+        previousKey = key
+        yield entry
+
+
+def parseChangeDatesResponses(respDict, responses):
+    """Parses the responses to the queries from `getChangeDatesQuery`.
+
+    Args:
+        respDict (dict): the response so far, from `getChangeDatesQuery`; the XCiteDB errors are added to its 'message'
+        responses (list): (stdout, stderr) of each query
+
+    Returns:
+        list: a list of change log entries for each query
+    """
+    responseLists = []
+    for response, responseErr in responses:
+        if responseErr and len(responseErr) > 0:
+            if respDict.get('message'):
+                respDict['message'] = respDict['message'] + '; ' + responseErr
+            else:
+                respDict['message'] = responseErr
+            logger.info(responseErr)
+        if response:
+            logger.debug(response)
+            responseLists.append(json.loads(response))
+    return responseLists
+
+
+def mergeChangeDates(respDict, responses):
+    """Combines the responses to the queries from `getChangeDatesQuery`.
+
+    Args:
+        respDict (dict): the response so far, from `getChangeDatesQuery`; the XCiteDB errors are added to its 'message'
+        responses (list): (stdout, stderr) of each query
+
+    Returns:
+        list: the change log entries, sorted by date and without duplicates, as from `getChangeDates`
+    """
+    responseList = list(
+        iterMergedChangeDates(parseChangeDatesResponses(respDict, responses))
+    )
+    logger.debug(responseList)
+    return responseList
+
+
+def storeChangeDates(respDict, cacheKey, responses):
+    """Combines the responses to the queries from `getChangeDatesQuery`, and caches them if XCiteDB reported no error.
+
+    Args:
+        respDict (dict): the response so far, from `getChangeDatesQuery`; the XCiteDB errors are added to its 'message'
+        cacheKey (list): the cache key from `getChangeDatesQuery`
+        responses (list): (stdout, stderr) of each query
+
+    Returns:
+        list: the change log entries, as from `getChangeDates`
+    """
+    responseList = mergeChangeDates(respDict, responses)
+    if not respDict.get('message'):
+        getQueryCache().put(cacheKey, responseList)
+    return responseList
+
+
+def getStoredChangeDates(cacheKey):
+    """Returns the change log entries for a query from `getChangeDatesQuery` from the cache or, if it has every
+    loaded date and the section, from the local change index (see changeindex.py).
+
+    Args:
+        cacheKey (list): the cache key from `getChangeDatesQuery`
+
+    Returns:
+        list: the change log entries, or None if XCiteDB must be queried
+    """
+    cached = getQueryCache().get(cacheKey)
+    if cached is not None:
+        increment('query_cache', result='hit', query='getChangeDates')
+        return cached
+    increment('query_cache', result='miss', query='getChangeDates')
+    _, identifier, fromDateString, toDateString = cacheKey
+    indexed = getChangeIndexReader().getChanges(
+        identifier, fromDateString, toDateString, getQueryCache().getVersion()
+    )
+    increment('change_index', result='miss' if indexed is None else 'hit')
+    if indexed is not None:
+        getQueryCache().put(cacheKey, indexed)
+    return indexed
+
+
+def runQueries(queryLists):
+    """Runs XCiteDB queries concurrently.
+
+    Args:
+        queryLists (list): the XCiteDB arguments of each query
+
+    Returns:
+        list: (stdout, stderr) of each query
+    """
+    for queryList in queryLists:
+        logger.info(str(queryList))
+    if len(queryLists) < 2:
+        return [runQuery(queryList) for queryList in queryLists]
+    with ThreadPoolExecutor(max_workers=len(queryLists)) as executor:
+        return list(executor.map(runQuery, queryLists))
+
+
+def iterChangeDates(identifier='', fromDate=None, toDate=None):
+    """Yields the change log entries of `identifier` between `fromDate` and `toDate`, by date, without duplicates.
+
+    The two XCiteDB log queries run concurrently, and both answers are read and parsed in full before the first
+    entry is yielded: only the merge of the two is done as the entries are consumed. So stopping early saves
+    the merge, not the queries nor the memory of their answers, and the entries are only cached if all are read.
+
+    Args:
+        identifier (:obj:`str`): a string representation of the node to query
+        fromDate (:obj:`datetime.datetime`): A datetime object. Defaults to None.
+        toDate (:obj:`datetime.datetime`): A datetime object. Defaults to None.
+
+    Raises:
+        ValueError: if the identifier is not a US Code section
+
+    Yields:
+        dict: the change log entries, as in the list returned by `getChangeDates`
+    """
+    respDict, queryLists, cacheKey = getChangeDatesQuery(identifier, fromDate, toDate)
+    if queryLists is None:
+        raise ValueError(respDict.get('message'))
+    cached = getStoredChangeDates(cacheKey)
+    if cached is not None:
+        yield from cached
+        return
+    responseLists = parseChangeDatesResponses(respDict, runQueries(queryLists))
+    responseList = []
+    for entry in iterMergedChangeDates(responseLists):
+        responseList.append(entry)
+        yield entry
+    # Only cached if the caller read all the entries
+    if not respDict.get('message'):
+        getQueryCache().put(cacheKey, responseList)
+
+
 def getChangeDates(identifier='', fromDate=None, toDate=None):
     """Returns a list of the dates of change corresponding to `identifier` between `fromDate` and `toDate`.
 
@@ -156,8 +556,10 @@ def getChangeDates(identifier='', fromDate=None, toDate=None):
         toDate (:obj:`datetime.datetime`): A datetime object.
         This function converts it to  `mm/DD/YYYY` format to call XCiteDB. Defaults to None.
 
+    The two XCiteDB log queries, for the section and for its descendants, run concurrently.
+
     Returns:
-        list of Dicts (from XCiteDB log) of the form:
+        list of Dicts (from XCiteDB log), sorted by date and without duplicates, of the form:
             [
                 {
                     "identifier": "/us/usc/t26/s25C/nt",
@@ -171,101 +573,202 @@ def getChangeDates(identifier='', fromDate=None, toDate=None):
                 },
             ]
     """
-    respDict = {}
-    responseList = None
-    responseMatchList = None
-    try:
-        fromDateString = fromDate.strftime('%m/%d/%Y')
-        toDateString = toDate.strftime('%m/%d/%Y')
-    except Exception as exc:
-        logger.exception(exc)
-        fromDateString = None
-        toDateString = None
-    queryTerms = None
-    identifier = identifier.replace('-', '–')
-    identifier = re.sub(r'\/$', '', identifier)
-    identifier = re.sub(r'^\/uslm', '', identifier)
-
-    identifierSearch = re.search(IDENTIFIER_TYPE_REGEX, identifier)
-    if not identifierSearch:
-        respDict['success'] = False
-        respDict['message'] = 'Identifier not in the expected form'
-        return respDict
-    identifierType = identifierSearch.group(1)
-    if identifierType is None or (identifierType not in ['usc']):
-        respDict['success'] = False
-        respDict['message'] = 'Identifier must be of type pl or usc'
-        return respDict
+    with span('get_change_dates') as timing:
+        respDict, queryLists, cacheKey = getChangeDatesQuery(
+            identifier, fromDate, toDate
+        )
+        if queryLists is None:
+            timing.set(outcome='error')
+            return respDict
+        cached = getStoredChangeDates(cacheKey)
+        if cached is not None:
+            return cached
+        responseList = storeChangeDates(respDict, cacheKey, runQueries(queryLists))
+        if respDict.get('message'):
+            timing.set(outcome='error')
+        return responseList
+
+
+def getAsyncSemaphore():
+    """Returns the semaphore that limits the XCiteDB queries of the running event loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncSemaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, getSettings().XCITEDB_ASYNC_CONCURRENCY))
+        asyncSemaphores[loop] = semaphore
+    return semaphore
 
-    # Remove biglevels if there is a section specified in PL
-    if identifierType == 'pl':
-        identifier = identifier.replace(
-            r'(\/us\/pl\/[0-9]+\/[0-9]+)\/(?:.*)(\/s[0-9].*$)', r'\1\2'
+
+async def runBlocking(func, *args):
+    """Runs `func(*args)` in the default executor of the running event loop.
+
+    The effective dates, the query cache, the change index and the section reader read SQLite files and
+    release point files, which would hold up every other task if done on the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+
+async def runQueryAsync(queryArgs, timeout: float = None, settings=None):
+    """Runs an XCiteDB query in a new XCiteDB process, without blocking the event loop. At most
+    XCITEDB_ASYNC_CONCURRENCY queries run at once; the others wait, without holding up the event loop.
+
+    If the query times out or the calling task is cancelled, the XCiteDB process is killed.
+
+    Args:
+        queryArgs (list): the XCiteDB arguments after `-db XMLDBPATH`
+        timeout (float): seconds to wait for the query, not counting the wait for the semaphore.
+        Defaults to XCITEDB_QUERY_TIMEOUT.
+        settings (:obj:`settings.Settings`): settings for this query only, as for `runQuery`. Defaults to None.
+
+    Raises:
+        asyncio.TimeoutError: if the query takes longer than `timeout`
+
+    Returns:
+        tuple: (stdout, stderr) of the query, as strings
+    """
+    settings = settings or getSettings()
+    timeout = timeout or settings.XCITEDB_QUERY_TIMEOUT
+    async with getAsyncSemaphore():
+        process = await asyncio.create_subprocess_exec(
+            settings.XCITEDBPATH,
+            '-db',
+            settings.XMLDBPATH,
+            *queryArgs,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
         )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except BaseException:
+            # Timed out or cancelled: do not leave the query running
+            if process.returncode is None:
+                process.kill()
+                await asyncio.shield(process.wait())
+            raise
+        return stdout.decode('utf-8', 'replace'), stderr.decode('utf-8', 'replace')
+
+
+async def runIdentifierQueryAsync(respDict, queryList, timeout: float = None):
+    """The async version of `runIdentifierQuery`."""
+    cacheKey = ['getIdentifier'] + queryList
+    stored = await runBlocking(getStoredIdentifier, respDict, queryList, cacheKey)
+    if stored is not None:
+        return stored
+    response, responseErr = await runQueryAsync(queryList, timeout=timeout)
+    return await runBlocking(
+        parseIdentifierResponse, respDict, cacheKey, response, responseErr
+    )
 
-    # Return if there is no section specified in USC
-    if identifierType == 'usc':
-        if not re.search(r'\/s[0-9]', identifier):
-            respDict['success'] = False
-            respDict[
-                'message'
-            ] = 'US Code identifier must include a section for changeDates query'
-            return respDict
-        else:
-            identifier = re.sub(
-                r'(\/us\/usc\/t[0-9][^\/]*)\/(?:.*)(\/s[0-9].*$)', r'\1\2', identifier
+
+async def getIdentifierAsync(identifier='', date=None, timeout: float = None):
+    """The async version of `getIdentifier`.
+
+    Args:
+        identifier (:obj:`str`): a string representation of the node to query
+        date (:obj:`datetime.datetime`): A datetime object. Defaults to now.
+        timeout (float): seconds to wait for XCiteDB. Defaults to XCITEDB_QUERY_TIMEOUT.
+
+    Raises:
+        asyncio.TimeoutError: if the query takes longer than `timeout`
+
+    Returns:
+        dict: as from `getIdentifier`
+    """
+    with span('get_identifier', call='async') as timing:
+        respDict, queryList = await runBlocking(
+            getIdentifierQuery, identifier, date or datetime.now()
+        )
+        if queryList is not None:
+            respDict = await runIdentifierQueryAsync(
+                respDict, queryList, timeout=timeout
             )
-            identifier = identifier.rstrip('/') + '/'
+        timing.set(outcome='ok' if respDict.get('success') else 'error')
+    return respDict
 
-    queryTermsMatch = ['-match', identifier.rstrip('/')]
-    queryTerms = ['-match-start', identifier]
 
-    queryList = [XCITEDBPATH, '-db', XMLDBPATH]
-    if fromDateString and toDateString:
-        queryList.extend(['-from-date', fromDateString, '-to-date', toDateString])
+async def getIdentifiersAsync(requests, timeout: float = None):
+    """The async version of `getIdentifiers`: the distinct queries run concurrently, up to
+    XCITEDB_ASYNC_CONCURRENCY at a time.
 
-    queryTerms.insert(0, 'query')
-    queryTermsMatch.insert(0, 'query')
+    Args:
+        requests (list): (identifier, date) pairs
+        timeout (float): seconds to wait for each query. Defaults to XCITEDB_QUERY_TIMEOUT.
 
-    queryListMatch = queryList.copy()
-    queryList.extend(queryTerms)
-    queryList.append('-log')
-    logger.info(str(queryList))
-    dbquery = subprocess.run(queryList, timeout=60, capture_output=True)
-    response = dbquery.stdout
-    responseErr = dbquery.stderr
-    if responseErr and len(responseErr) > 0:
-        respDict['message'] = responseErr
-        logger.info(responseErr)
-    if response:
-        logger.debug(response)
-        responseList = json.loads(response)
-        logger.info(responseList)
-    queryListMatch.extend(queryTermsMatch)
-    queryListMatch.append('-log')
-    logger.info(str(queryListMatch))
-    dbqueryMatch = subprocess.run(queryListMatch, timeout=60, capture_output=True)
-    responseMatch = dbqueryMatch.stdout
-    responseMatchErr = dbqueryMatch.stderr
-    if responseMatchErr and len(responseMatchErr) > 0:
+    Raises:
+        asyncio.TimeoutError: if a query takes longer than `timeout`; the other queries are cancelled
+
+    Returns:
+        list: a response dict, as from `getIdentifier`, for each pair, in the order of `requests`
+    """
+    queries = await runBlocking(
+        lambda: [getIdentifierQuery(identifier, date) for identifier, date in requests]
+    )
+    tasks = {}
+    for respDict, queryList in queries:
+        if queryList is not None and tuple(queryList) not in tasks:
+            tasks[tuple(queryList)] = asyncio.ensure_future(
+                runIdentifierQueryAsync(respDict, queryList, timeout=timeout)
+            )
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    responses = []
+    used = set()
+    for respDict, queryList in queries:
+        if queryList is None:
+            responses.append(respDict)
+            continue
+        key = tuple(queryList)
+        result = tasks[key].result()
+        responses.append(copy.deepcopy(result) if key in used else result)
+        used.add(key)
+    return responses
+
+
+async def getChangeDatesAsync(
+    identifier='', fromDate=None, toDate=None, timeout: float = None
+):
+    """The async version of `getChangeDates`; its two XCiteDB queries run concurrently.
+
+    Args:
+        identifier (:obj:`str`): a string representation of the node to query
+        fromDate (:obj:`datetime.datetime`): A datetime object. Defaults to None.
+        toDate (:obj:`datetime.datetime`): A datetime object. Defaults to None.
+        timeout (float): seconds to wait for XCiteDB. Defaults to XCITEDB_QUERY_TIMEOUT.
+
+    Raises:
+        asyncio.TimeoutError: if a query takes longer than `timeout`
+
+    Returns:
+        list: as from `getChangeDates`
+    """
+    with span('get_change_dates', call='async') as timing:
+        respDict, queryLists, cacheKey = await runBlocking(
+            getChangeDatesQuery, identifier, fromDate, toDate
+        )
+        if queryLists is None:
+            timing.set(outcome='error')
+            return respDict
+        cached = await runBlocking(getStoredChangeDates, cacheKey)
+        if cached is not None:
+            return cached
+        tasks = [
+            asyncio.ensure_future(runQueryAsync(queryList, timeout=timeout))
+            for queryList in queryLists
+        ]
+        try:
+            responses = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        responseList = await runBlocking(
+            storeChangeDates, respDict, cacheKey, responses
+        )
         if respDict.get('message'):
-            respDict['message'] = respDict['message'] + '; ' + responseMatchErr
-        else:
-            respDict['message'] = responseMatchErr
-
-        logger.info(responseMatchErr)
-    if responseMatch:
-        logger.debug(responseMatch)
-        responseMatchList = json.loads(responseMatch)
-        if responseList:
-            responseList.extend(responseMatchList)
-            logger.debug(responseList)
-            return responseList
-        else:
-            return responseMatchList
-    else:
-        if responseList:
-            logger.debug(responseList)
-            return responseList
-        else:
-            return []
+            timing.set(outcome='error')
+        return responseList
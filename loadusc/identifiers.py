@@ -0,0 +1,165 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Parse USLM identifiers into the XCiteDB query terms used by getxcite.py'
+
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+try:
+    import re2 as re
+except ImportError:
+    import re
+
+try:
+    from constants import IDENTIFIER_TYPE_REGEX, USC_REGEX, NAMED_LAW_REGEX
+except ImportError:
+    from loadusc.constants import IDENTIFIER_TYPE_REGEX, USC_REGEX, NAMED_LAW_REGEX
+
+IDENTIFIER_TYPES = ('pl', 'usc', 'named')
+# Identifiers parsed and kept, for the hot identifiers requested over and over
+PARSE_CACHE_SIZE = 4096
+
+IDENTIFIER_TYPE_REGEX_COMPILED = re.compile(IDENTIFIER_TYPE_REGEX)
+USC_REGEX_COMPILED = re.compile(USC_REGEX)
+NAMED_LAW_REGEX_COMPILED = re.compile(NAMED_LAW_REGEX)
+TRAILING_SLASH_REGEX_COMPILED = re.compile(r'\/$')
+USLM_PREFIX_REGEX_COMPILED = re.compile(r'^\/uslm')
+# The first section level and the levels below it: /us/usc/t26/s25C/nt -> 's25C', '/nt'
+SECTION_REGEX_COMPILED = re.compile(r'\/(s[0-9][^\/]*)(\/.*)?$')
+PL_REGEX_COMPILED = re.compile(r'^\/us\/pl\/([0-9]+\/[0-9]+)')
+# Big levels (division, title, chapter...) between the law or title and the section, which XCiteDB does not have
+PL_BIGLEVELS_REGEX_COMPILED = re.compile(
+    r'(\/us\/pl\/[0-9]+\/[0-9]+)\/(?:.*)(\/s[0-9].*$)'
+)
+USC_BIGLEVELS_REGEX_COMPILED = re.compile(
+    r'(\/us\/usc\/t[0-9][^\/]*)\/(?:.*)(\/s[0-9].*$)'
+)
+
+
+class Identifier(NamedTuple):
+    """A parsed identifier. Hashable, so it can be used as a cache key."""
+
+    # The identifier as given
+    original: str
+    # The identifier normalized for XCiteDB: hyphens as en dashes, no trailing slash or /uslm prefix,
+    # and no big levels above a section
+    identifier: str
+    # 'pl', 'usc' or 'named'; None if the identifier is not in the expected form
+    type: Optional[str] = None
+    # e.g. 't26' for USC, '116/140' for a public law, the name of a named law
+    title: Optional[str] = None
+    # e.g. 's25C'
+    section: Optional[str] = None
+    # The levels below the section, e.g. '/nt' or '/a/1'
+    tail: Optional[str] = None
+    # The XCiteDB query terms, e.g. ('-match', '/us/usc/t26/s25C')
+    queryTerms: Tuple[str, ...] = ()
+    # Why the identifier is not valid, or None
+    error: Optional[str] = None
+
+    @property
+    def isValid(self):
+        return self.error is None
+
+
+def normalizeIdentifier(identifier: str):
+    """
+    Normalize an identifier as getxcite.py always has: hyphens to en dashes, no trailing slash, no /uslm prefix
+    """
+    identifier = identifier.replace('-', '–')
+    identifier = TRAILING_SLASH_REGEX_COMPILED.sub('', identifier)
+    return USLM_PREFIX_REGEX_COMPILED.sub('', identifier)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parseIdentifier(identifier: str):
+    """
+    Parse an identifier into its type, parts and XCiteDB query terms. The results are memoized.
+
+    Args:
+        identifier (str): e.g. '/us/usc/t26/s1', '/uslm/us/pl/116/140/dA/s101/', '/us/named/xyz/s2'
+
+    Returns:
+        Identifier: the parsed identifier; if it is not valid, `error` says why
+    """
+    original = identifier
+    identifier = normalizeIdentifier(identifier)
+    identifierSearch = IDENTIFIER_TYPE_REGEX_COMPILED.search(identifier)
+    if not identifierSearch:
+        return Identifier(
+            original, identifier, error='Identifier not in the expected form'
+        )
+    identifierType = identifierSearch.group(1)
+    if identifierType not in IDENTIFIER_TYPES:
+        return Identifier(
+            original,
+            identifier,
+            type=identifierType,
+            error='Identifier must be of type pl, usc, or named',
+        )
+
+    sectionSearch = SECTION_REGEX_COMPILED.search(identifier)
+    queryTerms = None
+    if identifierType == 'pl':
+        # Remove biglevels if there is a section specified in PL
+        if sectionSearch:
+            identifier = PL_BIGLEVELS_REGEX_COMPILED.sub(r'\1\2', identifier)
+    elif identifierType == 'named':
+        namedSearch = NAMED_LAW_REGEX_COMPILED.search(identifier)
+        if namedSearch and namedSearch.group(2):
+            queryTerms = (
+                '-match-start',
+                namedSearch.group(1),
+                '-match-end',
+                namedSearch.group(2),
+            )
+    elif identifierType == 'usc':
+        if not sectionSearch:
+            uscSearch = USC_REGEX_COMPILED.search(identifier)
+            if uscSearch and uscSearch.group(2):
+                queryTerms = (
+                    '-match-start',
+                    uscSearch.group(1),
+                    '-match-end',
+                    uscSearch.group(2),
+                )
+        else:
+            # Remove biglevels if there is a section specified in USC
+            identifier = USC_BIGLEVELS_REGEX_COMPILED.sub(r'\1\2', identifier)
+    if queryTerms is None:
+        queryTerms = ('-match', identifier)
+
+    title = None
+    if identifierType == 'usc':
+        titleSearch = USC_REGEX_COMPILED.search(identifier)
+    elif identifierType == 'pl':
+        titleSearch = PL_REGEX_COMPILED.search(identifier)
+    else:
+        titleSearch = NAMED_LAW_REGEX_COMPILED.search(identifier)
+    if titleSearch:
+        title = (
+            titleSearch.group(1).rsplit('/', 1)[-1]
+            if identifierType != 'pl'
+            else titleSearch.group(1)
+        )
+    section = tail = None
+    if sectionSearch:
+        sectionSearch = SECTION_REGEX_COMPILED.search(identifier)
+        section = sectionSearch.group(1)
+        tail = sectionSearch.group(2)
+    return Identifier(
+        original,
+        identifier,
+        type=identifierType,
+        title=title,
+        section=section,
+        tail=tail,
+        queryTerms=queryTerms,
+    )
+
+
+def getParseCacheInfo():
+    """
+    Get the hits, misses and size of the memo of parseIdentifier
+    """
+    return parseIdentifier.cache_info()
@@ -0,0 +1,287 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Ledger of the USC release points and titles loaded into XCiteDB'
+
+# The ledger is a SQLite file beside XMLDBPATH. Each row is one load-xml: a whole release point directory
+# (title '*') or one title file, with the date it was loaded for, a hash of its content, the exit code
+# and how long it took. loaduscxcite.py skips work whose content hash is recorded with exit code 0,
+# so that a run after a crash, or a nightly run with one new release point, only loads what is missing.
+
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+import subprocess
+from datetime import datetime
+
+try:
+    from settings import getSettings
+except ImportError:
+    from loadusc.settings import getSettings
+
+logger = logging.getLogger(__name__)
+
+# Title of a row for a whole release point directory, loaded with load-xml -r
+RELEASEPOINT_TITLE = '*'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS loads (
+    release_point TEXT NOT NULL,
+    title TEXT NOT NULL,
+    date TEXT NOT NULL,
+    date_ord INTEGER NOT NULL,
+    content_hash TEXT,
+    exit_code INTEGER,
+    seconds REAL,
+    loaded_at TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT 'load',
+    PRIMARY KEY (release_point, title)
+);
+CREATE INDEX IF NOT EXISTS loads_date_ord ON loads (date_ord);
+'''
+
+
+def getDateOrd(date: str):
+    """
+    Convert a mm/dd/yyyy date to an integer yyyymmdd, which sorts chronologically
+    """
+    month, day, year = date.split('/')
+    return int(year) * 10000 + int(month) * 100 + int(day)
+
+
+def getFileHash(relpath: str, path: str, manifest: dict = None):
+    """
+    Get a hash of the content of a release point file. The sha256 from the blob store manifest is used if the file
+    is there; otherwise, to avoid reading every file on every run, the hash is of its size and modification time.
+    """
+    item = (manifest or {}).get(relpath)
+    if item and item.get('sha256'):
+        return item['sha256']
+    stat = os.stat(path)
+    return 'stat:{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+
+def getReleasePointHashes(release_point: str, releasepointsPath: str = None):
+    """
+    Get the content hash of each XML file of a release point, and of the release point as a whole
+
+    Returns:
+        dict: {relpath: hash}, with the hash of the whole directory under RELEASEPOINT_TITLE
+    """
+    try:
+        from blobstore import loadReleasePointManifest
+    except ImportError:
+        from loadusc.blobstore import loadReleasePointManifest
+
+    releasepointsPath = releasepointsPath or getSettings().USC_RELEASEPOINT_DIRPATH
+    dir_name = os.path.join(releasepointsPath, release_point)
+    manifest = loadReleasePointManifest(release_point)
+    hashes = {}
+    for root, _, filenames in os.walk(dir_name):
+        for filename in filenames:
+            if filename.lower().endswith('.xml'):
+                path = os.path.join(root, filename)
+                relpath = os.path.relpath(path, dir_name)
+                hashes[relpath] = getFileHash(relpath, path, manifest)
+    total = hashlib.sha256()
+    for relpath in sorted(hashes):
+        total.update((relpath + ':' + hashes[relpath] + '\n').encode('utf-8'))
+    hashes[RELEASEPOINT_TITLE] = total.hexdigest()
+    return hashes
+
+
+class LoadLedger:
+    """Persistent record of load-xml runs, safe to use from several loader threads."""
+
+    def __init__(self, path: str = None):
+        path = path or getSettings().LOAD_LEDGER_PATH
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def isLoaded(self, release_point: str, title: str, content_hash: str = None):
+        """
+        Check that the release point (title RELEASEPOINT_TITLE) or title was loaded successfully,
+        from the same content if `content_hash` is given
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT exit_code, content_hash FROM loads WHERE release_point = ? AND title = ?',
+                (release_point, title),
+            ).fetchone()
+        if not row or row[0] != 0:
+            return False
+        return content_hash is None or row[1] == content_hash
+
+    def record(
+        self,
+        release_point: str,
+        title: str,
+        date: str,
+        content_hash: str,
+        exit_code: int,
+        seconds: float = None,
+        source: str = 'load',
+    ):
+        """
+        Record a load-xml run; a failed run (exit_code other than 0, or None if it did not finish)
+        replaces any earlier success, so that it is retried
+        """
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO loads (release_point, title, date, date_ord, content_hash, exit_code, '
+                'seconds, loaded_at, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    release_point,
+                    title,
+                    date,
+                    getDateOrd(date),
+                    content_hash,
+                    exit_code,
+                    seconds,
+                    datetime.utcnow().isoformat(),
+                    source,
+                ),
+            )
+            self.connection.commit()
+
+    def getLastLoadedDate(self):
+        """
+        Get the latest date (mm/dd/yyyy) with a successful load, or None
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT date FROM loads WHERE exit_code = 0 ORDER BY date_ord DESC LIMIT 1'
+            ).fetchone()
+        return row[0] if row else None
+
+    def getLoadedDates(self):
+        """
+        Get the dates (mm/dd/yyyy) with a successful load, in chronological order
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT date FROM loads WHERE exit_code = 0 GROUP BY date_ord ORDER BY date_ord'
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def getLoadedReleasePoints(self):
+        """
+        Get the names of the release points with a successful load, as a whole or of a title
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT DISTINCT release_point FROM loads WHERE exit_code = 0'
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def hasFailedLoads(self):
+        """
+        Check for loads that failed or did not finish, which are retried by the next run
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM loads WHERE exit_code IS NULL OR exit_code != 0 LIMIT 1'
+            ).fetchone()
+        return row is not None
+
+    def getDurations(self):
+        """
+        Get the mean duration, in seconds, of the successful loads of each title (RELEASEPOINT_TITLE for whole
+        release point directories)
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT title, AVG(seconds) FROM loads WHERE exit_code = 0 AND seconds IS NOT NULL GROUP BY title'
+            ).fetchall()
+        return dict(rows)
+
+
+def isTitleLoaded(ledger: LoadLedger, rpname: str, relpath: str, hashes: dict):
+    """
+    Check the ledger for a successful load of a title file, on its own or with its whole release point
+    """
+    return ledger.isLoaded(rpname, relpath, hashes.get(relpath)) or ledger.isLoaded(
+        rpname, RELEASEPOINT_TITLE, hashes.get(RELEASEPOINT_TITLE)
+    )
+
+
+def isReleasePointLoaded(ledger: LoadLedger, rpname: str, hashes: dict):
+    """
+    Check the ledger for a successful load of a release point, as a whole or title by title
+    """
+    if ledger.isLoaded(rpname, RELEASEPOINT_TITLE, hashes.get(RELEASEPOINT_TITLE)):
+        return True
+    relpaths = [relpath for relpath in hashes if relpath != RELEASEPOINT_TITLE]
+    return bool(relpaths) and all(
+        ledger.isLoaded(rpname, relpath, hashes[relpath]) for relpath in relpaths
+    )
+
+
+def isDateInDatabase(date: str, timeout: int = 20):
+    """
+    Check the XCiteDB log for changes on `date`, to find release points that were loaded before the ledger existed.
+    `XCiteDB inspect -t log -match-start yyyymmdd` gives the changes from that date, or an error if there are none.
+
+    Args:
+        date (str): the date, in mm/dd/yyyy form
+        timeout (int, optional): seconds to wait for XCiteDB. Defaults to 20.
+
+    Returns:
+        bool: True if the database has changes for the date
+    """
+    month, day, year = date.split('/')
+    settings = getSettings()
+    try:
+        dbquery = subprocess.run(
+            [
+                settings.XCITEDBPATH,
+                '-db',
+                settings.XMLDBPATH,
+                'inspect',
+                '-t',
+                'log',
+                '-match-start',
+                year + month + day,
+            ],
+            timeout=timeout,
+            capture_output=True,
+        )
+    except Exception as err:
+        logger.error('Could not inspect the XCiteDB log for ' + date)
+        logger.error(err)
+        return False
+    return (
+        dbquery.returncode == 0
+        and bool(dbquery.stdout.strip())
+        and not dbquery.stderr.strip()
+    )
+
+
+def reconcileDate(ledger: LoadLedger, date: str, rpnames, hashes: dict):
+    """
+    If the XCiteDB log has changes for `date`, record its release points in the ledger as loaded
+
+    Args:
+        ledger (LoadLedger): the ledger
+        date (str): the date, in mm/dd/yyyy form
+        rpnames (list): names of the release points loaded for the date
+        hashes (dict): {release point name: result of getReleasePointHashes}
+
+    Returns:
+        bool: True if the release points were recorded
+    """
+    if not isDateInDatabase(date):
+        return False
+    logger.info('Found ' + date + ' in the XCiteDB log: ' + ', '.join(rpnames))
+    for rpname in rpnames:
+        for title, content_hash in hashes.get(rpname, {}).items():
+            ledger.record(rpname, title, date, content_hash, 0, source='reconciled')
+    return True
@@ -0,0 +1,648 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Plan the loads of the USC release points into XCiteDB: what is loaded, in which order, for which date'
+
+# Release points are loaded in public law order, each public law release point for the date of its public law
+# (from the public law store, see publawstore.py). Release points named 'not...' or '...u1' are loaded with the
+# next public law release point after them, for its date.
+#
+# A plan is a JSON-serializable dict of the dates to load, in order, with for each date the release points, their
+# title files and sizes, whether the load ledger shows they are already loaded, and an estimate of how long the
+# loads take, from the mean duration of the titles in the ledger. It also lists what could not be planned, and
+# why: public laws with no entry or no date, release points that are not downloaded.
+#
+# loaduscxcite.py loads from a plan (loaduscxcite.loadPlan). `loaduscxcite.py --dry-run` and
+# `python loadplan.py` show the plan of the release points in uscreleasepoints.json without loading anything.
+#
+# Usage: python loadplan.py [-m releasepoint|title] [-w WORKERS] [--reload] [--strict] [-o plan.json]
+
+import os
+import sys
+import json
+import logging
+import argparse
+from datetime import datetime
+
+try:
+    import re2 as re
+except ImportError:
+    import re
+
+try:
+    from settings import getSettings
+    from loadledger import (
+        LoadLedger,
+        RELEASEPOINT_TITLE,
+        getReleasePointHashes,
+        isReleasePointLoaded,
+        isTitleLoaded,
+    )
+    from publawstore import PublawStore, getPublawStore
+except ImportError:
+    from loadusc.settings import getSettings
+    from loadusc.loadledger import (
+        LoadLedger,
+        RELEASEPOINT_TITLE,
+        getReleasePointHashes,
+        isReleasePointLoaded,
+        isTitleLoaded,
+    )
+    from loadusc.publawstore import PublawStore, getPublawStore
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+# Release points loaded with the next public law release point, rather than for a date of their own
+FOLLOWER_REGEX_COMPILED = re.compile(r'not|u1$')
+
+
+def sortPLS(pl):
+    pl.split('-')
+    lst = list(map(lambda x: int(x), pl.split('-')))
+    return lst[0] * 10000 + lst[1]
+
+
+def getPublaws(publawsDict: str = None, readonly: bool = False):
+    """
+    Get the public laws: the public law store, brought up to date, or the decoded `publawsDict` if it is given
+
+    Args:
+        publawsDict (str, optional): a publawsDict.json to decode and use instead of the store. Defaults to None.
+        readonly (bool, optional): open the store as it is, read-only, without bringing it up to date.
+            Defaults to False.
+
+    Returns:
+        PublawStore or dict: the public laws; a store should be closed after use
+    """
+    if publawsDict:
+        from bson import json_util
+
+        with open(publawsDict, 'r') as f:
+            return json_util.loads(f.read())
+    if readonly:
+        return PublawStore(readonly=True)
+    return getPublawStore()
+
+
+def getPublawEntry(publaws, publaw: str):
+    """
+    Look up a public law in the store or in a decoded publawsDict.json
+
+    Returns:
+        tuple: (whether there is an entry for the public law, its date as mm/dd/yyyy or None)
+    """
+    if isinstance(publaws, PublawStore):
+        if publaw not in publaws:
+            return False, None
+        return True, publaws.getDate(publaw)
+    item = publaws.get(publaw)
+    if not item:
+        return False, None
+    publawDate = item.get('publawDate')
+    return True, publawDate.strftime('%m/%d/%Y') if publawDate else None
+
+
+def getIssue(kind: str, message: str, **context):
+    return dict(context, kind=kind, message=message)
+
+
+def orderReleasePoints(releasepoints, publaws):
+    """
+    Group the release points by the public law release point they are loaded with, in load order
+
+    Args:
+        releasepoints (list): release points, newest first, as in uscreleasepoints.json
+        publaws (PublawStore or dict): the public laws, as from getPublaws
+
+    Returns:
+        list: a dict for each group, with the 'publaw' release point, the 'date' it is loaded for (None if there
+        is none), the 'releasePoints' names, in order, and the 'issues' found; a last group, with no 'publaw',
+        has the release points after the last public law release point, which are not loaded
+    """
+    releasepoints_rev = releasepoints[::-1]
+    pls = [
+        item.get('name')
+        for item in releasepoints_rev
+        if not FOLLOWER_REGEX_COMPILED.search(item.get('name'))
+    ]
+    plsDict = dict(
+        (item.get('name'), index) for index, item in enumerate(releasepoints_rev)
+    )
+    pls.sort(key=sortPLS)
+    groups = []
+    prior_index = 0
+    release_date = None
+    previous = None
+    pending = []
+    for pl in pls:
+        hasEntry, publaw_date = getPublawEntry(publaws, pl)
+        if not hasEntry:
+            # Its release points are loaded with the next public law release point
+            pending.append(
+                getIssue('noPublaw', 'No item for ' + str(pl), releasePoint=pl)
+            )
+            continue
+        issues = pending
+        pending = []
+        if publaw_date:
+            release_date = publaw_date
+        elif release_date:
+            issues.append(
+                getIssue(
+                    'inheritedDate',
+                    'No date for {}: loaded for the date of {}'.format(pl, previous),
+                    releasePoint=pl,
+                )
+            )
+        # Get the list of names from the last pl until and including the current one
+        plIndex = plsDict.get(pl)
+        rpnames = [
+            rp.get('name') for rp in releasepoints_rev[prior_index : plIndex + 1]
+        ]
+        prior_index = plIndex + 1
+        if not rpnames:
+            issues.append(
+                getIssue(
+                    'outOfOrder',
+                    'No release points for {}: it is listed before a later public law'.format(
+                        pl
+                    ),
+                    releasePoint=pl,
+                )
+            )
+        if not release_date:
+            issues.append(
+                getIssue('noDate', 'No date for ' + ', '.join(rpnames), releasePoint=pl)
+            )
+        groups.append(
+            {
+                'publaw': pl,
+                'date': release_date,
+                'releasePoints': rpnames,
+                'issues': issues,
+            }
+        )
+        if publaw_date:
+            previous = pl
+    rest = [rp.get('name') for rp in releasepoints_rev[prior_index:]]
+    if rest or pending:
+        pending.append(
+            getIssue(
+                'unscheduled',
+                'Not loaded, after the last public law release point: '
+                + ', '.join(rest),
+            )
+        )
+        groups.append(
+            {'publaw': None, 'date': None, 'releasePoints': rest, 'issues': pending}
+        )
+    return groups
+
+
+def getLoadSchedule(releasepoints, pljson):
+    """
+    Get the order in which release points are loaded, and the date each one is loaded for (see
+    orderReleasePoints). Public law release points with no entry or no date are logged and left out.
+
+    Args:
+        releasepoints (list): release points, newest first, as in uscreleasepoints.json
+        pljson (PublawStore or dict): the public law store, or public laws keyed by the public law number
+            (e.g. '116-140'), as in publawsDict.json
+
+    Returns:
+        list: a list of (release_date, [release point names]) tuples, in chronological order
+    """
+    schedule = []
+    for group in orderReleasePoints(releasepoints, pljson):
+        for issue in group['issues']:
+            if issue['kind'] in ('noPublaw', 'noDate'):
+                logger.error(issue['message'])
+            else:
+                logger.warning(issue['message'])
+        if group['publaw'] and group['date']:
+            schedule.append((group['date'], group['releasePoints']))
+    return schedule
+
+
+def getReleasePointSchedule(
+    releasepoints, publawsDict: str = None, readonly: bool = False
+):
+    """
+    Get the load schedule of `releasepoints` (see getLoadSchedule), with the public law dates from the public law
+    store (see publawstore.py), brought up to date with billmeta.json first unless `readonly`
+
+    Args:
+        releasepoints (list): release points, newest first, as in uscreleasepoints.json
+        publawsDict (str, optional): a publawsDict.json to decode and use instead of the store. Defaults to None.
+        readonly (bool, optional): read the store as it is, e.g. on the query path. Defaults to False.
+
+    Returns:
+        list: a list of (release_date, [release point names]) tuples, in chronological order
+    """
+    publaws = getPublaws(publawsDict, readonly=readonly)
+    try:
+        return getLoadSchedule(releasepoints, publaws)
+    finally:
+        if isinstance(publaws, PublawStore):
+            publaws.close()
+
+
+def getTitleFileSizes(release_point_path: str):
+    """
+    Get the size of each XML file of a release point directory, by path relative to the directory
+    """
+    sizes = {}
+    for root, _, filenames in os.walk(release_point_path):
+        for filename in filenames:
+            if filename.lower().endswith('.xml'):
+                path = os.path.join(root, filename)
+                sizes[os.path.relpath(path, release_point_path)] = os.path.getsize(path)
+    return sizes
+
+
+def getSecondsPerByte(files, durations: dict):
+    """
+    Get the load rate of the title files with a mean duration in the ledger, to estimate the others by size
+
+    Returns:
+        float: seconds per byte, or None if no title file has a duration
+    """
+    seconds = size = 0
+    for relpath, fileBytes in files:
+        if relpath in durations and fileBytes:
+            seconds += durations[relpath]
+            size += fileBytes
+    return seconds / size if size else None
+
+
+def estimateFile(relpath: str, fileBytes: int, durations: dict, secondsPerByte: float):
+    if relpath in durations:
+        return durations[relpath]
+    if secondsPerByte is not None:
+        return fileBytes * secondsPerByte
+    return None
+
+
+def planLoad(
+    releasepoints,
+    publaws,
+    ledger: LoadLedger = None,
+    mode: str = 'releasepoint',
+    workers: int = 1,
+    reload: bool = False,
+    strict: bool = False,
+    releasepointsPath: str = None,
+):
+    """
+    Plan the loads of `releasepoints`
+
+    Args:
+        releasepoints (list): release points, newest first, as in uscreleasepoints.json
+        publaws (PublawStore or dict): the public laws, as from getPublaws
+        ledger (LoadLedger, optional): the load ledger, for what is already loaded and how long titles take to load.
+            Defaults to None, to plan to load everything, without estimates.
+        mode (str, optional): 'releasepoint' or 'title', as in loaduscxcite.py. Defaults to 'releasepoint'.
+        workers (int, optional): titles loaded at the same time, in 'title' mode. Defaults to 1.
+        reload (bool, optional): plan to load what the ledger shows is already loaded. Defaults to False.
+        strict (bool, optional): do not plan the dates with issues: release points loaded for the date of an
+            earlier public law, or with those of a public law with no entry. Defaults to False.
+        releasepointsPath (str, optional): the release point directories. Defaults to USC_RELEASEPOINT_DIRPATH.
+
+    Returns:
+        dict: the plan, with the 'dates' to load, in order, the groups of release points that are 'unscheduled',
+        every 'issue', and the totals
+    """
+    releasepointsPath = releasepointsPath or getSettings().USC_RELEASEPOINT_DIRPATH
+    info = {item.get('name'): item for item in releasepoints}
+    durations = ledger.getDurations() if ledger else {}
+    dates = []
+    unscheduled = []
+    issues = []
+    for group in orderReleasePoints(releasepoints, publaws):
+        for issue in group['issues']:
+            issue.setdefault('date', group['date'])
+            issues.append(issue)
+        if not group['date'] or (strict and group['issues']):
+            unscheduled.append(group)
+            continue
+        entries = []
+        for name in group['releasePoints']:
+            release_point_path = os.path.join(releasepointsPath, name)
+            entry = {
+                'name': name,
+                'titlesAffected': info.get(name, {}).get('titlesAffected', []),
+                'files': [],
+                'bytes': 0,
+                'downloaded': os.path.isdir(release_point_path),
+                'loaded': False,
+            }
+            if not entry['downloaded']:
+                issue = getIssue(
+                    'notDownloaded',
+                    'No release point directory ' + release_point_path,
+                    releasePoint=name,
+                    date=group['date'],
+                )
+                group['issues'].append(issue)
+                issues.append(issue)
+            else:
+                hashes = (
+                    getReleasePointHashes(name, releasepointsPath) if ledger else {}
+                )
+                for relpath, fileBytes in sorted(
+                    getTitleFileSizes(release_point_path).items()
+                ):
+                    entry['files'].append(
+                        {
+                            'path': relpath,
+                            'bytes': fileBytes,
+                            'loaded': bool(ledger)
+                            and isTitleLoaded(ledger, name, relpath, hashes),
+                        }
+                    )
+                    entry['bytes'] += fileBytes
+                entry['loaded'] = bool(ledger) and isReleasePointLoaded(
+                    ledger, name, hashes
+                )
+            entries.append(entry)
+        dates.append(
+            {
+                'date': group['date'],
+                'publaw': group['publaw'],
+                'releasePoints': entries,
+                'issues': group['issues'],
+            }
+        )
+
+    secondsPerByte = getSecondsPerByte(
+        [
+            (item['path'], item['bytes'])
+            for date in dates
+            for entry in date['releasePoints']
+            for item in entry['files']
+        ],
+        durations,
+    )
+    for date in dates:
+        setLoadsAndEstimates(date, mode, workers, reload, durations, secondsPerByte)
+    return {
+        'version': PLAN_VERSION,
+        'createdAt': datetime.utcnow().isoformat(),
+        'mode': mode,
+        'workers': workers,
+        'reload': reload,
+        'dates': dates,
+        'unscheduled': unscheduled,
+        'issues': issues,
+        'bytes': sum(date['bytes'] for date in dates),
+        'seconds': sum(date['seconds'] or 0 for date in dates),
+        'unestimated': sum(
+            1 for date in dates if date['load'] and date['seconds'] is None
+        ),
+    }
+
+
+def setLoadsAndEstimates(
+    date: dict,
+    mode: str,
+    workers: int,
+    reload: bool,
+    durations: dict,
+    secondsPerByte: float,
+):
+    """
+    Mark what is loaded for a date of a plan, as loaduscxcite.loadDate would, and estimate how long it takes
+    """
+    entries = date['releasePoints']
+    date['load'] = reload or not all(entry['loaded'] for entry in entries)
+    date['bytes'] = 0
+    date['seconds'] = 0.0
+    if mode == 'title':
+        # The versions of a title are loaded in order, from the first that is not loaded
+        sequences = {}
+        for entry in entries:
+            entry['load'] = False
+            for item in entry['files']:
+                sequences.setdefault(item['path'], []).append((entry, item))
+        titleSeconds = []
+        for relpath, sequence in sequences.items():
+            pending = [
+                index
+                for index, (_, item) in enumerate(sequence)
+                if reload or not item['loaded']
+            ]
+            seconds = 0.0
+            for index, (entry, item) in enumerate(sequence):
+                item['load'] = date['load'] and bool(pending) and index >= pending[0]
+                item['seconds'] = estimateFile(
+                    relpath, item['bytes'], durations, secondsPerByte
+                )
+                if item['load']:
+                    entry['load'] = True
+                    date['bytes'] += item['bytes']
+                    if item['seconds'] is None or seconds is None:
+                        seconds = None
+                    else:
+                        seconds += item['seconds']
+            titleSeconds.append(seconds)
+        if None in titleSeconds:
+            date['seconds'] = None
+        elif titleSeconds:
+            # Titles run `workers` at a time, but a date takes at least as long as its slowest title
+            date['seconds'] = max(
+                max(titleSeconds), sum(titleSeconds) / max(1, int(workers))
+            )
+        for entry in entries:
+            entry['seconds'] = None
+    else:
+        # Release points loaded after one that is loaded again are loaded again, so that the last one still wins
+        first = 0
+        if not reload:
+            first = next(
+                (index for index, entry in enumerate(entries) if not entry['loaded']),
+                len(entries),
+            )
+        for index, entry in enumerate(entries):
+            entry['load'] = date['load'] and index >= first
+            fileSeconds = [
+                estimateFile(item['path'], item['bytes'], durations, secondsPerByte)
+                for item in entry['files']
+            ]
+            if not entry['files'] or None in fileSeconds:
+                entry['seconds'] = durations.get(RELEASEPOINT_TITLE)
+            else:
+                entry['seconds'] = sum(fileSeconds)
+            for item in entry['files']:
+                item['load'] = entry['load']
+            if entry['load']:
+                date['bytes'] += entry['bytes']
+                if entry['seconds'] is None or date['seconds'] is None:
+                    date['seconds'] = None
+                else:
+                    date['seconds'] += entry['seconds']
+    if not date['load']:
+        date['seconds'] = 0.0
+
+
+def getScheduleFromPlan(plan: dict):
+    """
+    Get the dates of a plan that have something to load, as getLoadSchedule gives them
+
+    Returns:
+        list: a list of (release_date, [release point names]) tuples, in the order of the plan
+    """
+    return [
+        (date['date'], [entry['name'] for entry in date['releasePoints']])
+        for date in plan['dates']
+        if date.get('load', True)
+    ]
+
+
+def savePlan(plan: dict, path: str):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(plan, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def readPlan(path: str):
+    """
+    Read a plan saved by savePlan; it can have been edited, e.g. to reorder or remove dates
+    """
+    with open(path, 'r') as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(
+            'Unsupported load plan version {} in {}'.format(plan.get('version'), path)
+        )
+    return plan
+
+
+def formatSeconds(seconds):
+    if seconds is None:
+        return '?'
+    if seconds < 120:
+        return '{:.0f}s'.format(seconds)
+    return '{:.0f}m{:02.0f}s'.format(*divmod(seconds, 60))
+
+
+def formatPlan(plan: dict):
+    """
+    Format a plan for people to read, one line per release point
+
+    Returns:
+        list: the lines
+    """
+    lines = []
+    for date in plan['dates']:
+        for entry in date['releasePoints']:
+            lines.append(
+                '{:<10}  {:<24} {:>4} files {:>9.1f} MB  {:>8}  {}'.format(
+                    date['date'],
+                    entry['name'],
+                    len(entry['files']),
+                    entry['bytes'] / 1e6,
+                    formatSeconds(entry.get('seconds')),
+                    ('load' if entry.get('load') else 'loaded')
+                    + ('' if entry.get('downloaded', True) else ' (not downloaded)'),
+                )
+            )
+    for group in plan['unscheduled']:
+        lines.append(
+            'not planned: {}'.format(
+                ', '.join(group['releasePoints']) or group['publaw']
+            )
+        )
+    for issue in plan['issues']:
+        lines.append('issue ({}): {}'.format(issue['kind'], issue['message']))
+    toLoad = [date for date in plan['dates'] if date['load']]
+    lines.append(
+        '{} dates to load of {}, {:.1f} MB, about {}{}'.format(
+            len(toLoad),
+            len(plan['dates']),
+            plan['bytes'] / 1e6,
+            formatSeconds(plan['seconds']),
+            ' (not counting {} dates with no estimate)'.format(plan['unestimated'])
+            if plan['unestimated']
+            else '',
+        )
+    )
+    return lines
+
+
+def planReleasePoints(
+    releasepointJSONPath: str = None,
+    publawsDict: str = None,
+    ledgerPath: str = None,
+    **kwargs
+):
+    """
+    Plan the loads of the release points in uscreleasepoints.json (see planLoad)
+
+    Args:
+        releasepointJSONPath (str, optional): path to uscreleasepoints.json. Defaults to USC_RELEASEPOINT_JSON_PATH.
+        publawsDict (str, optional): path to a publawsDict.json to use instead of the public law store.
+            Defaults to None.
+        ledgerPath (str, optional): the load ledger. Defaults to LOAD_LEDGER_PATH.
+        kwargs: passed on to planLoad
+
+    Returns:
+        dict: the plan
+    """
+    releasepointJSONPath = (
+        releasepointJSONPath or getSettings().USC_RELEASEPOINT_JSON_PATH
+    )
+    with open(releasepointJSONPath, 'r') as f:
+        releasepoints = json.load(f)
+    publaws = getPublaws(publawsDict)
+    ledger = LoadLedger(ledgerPath)
+    try:
+        return planLoad(releasepoints, publaws, ledger=ledger, **kwargs)
+    finally:
+        ledger.close()
+        if isinstance(publaws, PublawStore):
+            publaws.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='loadusc.log', filemode='a', level='INFO')
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    parser = argparse.ArgumentParser(
+        description='Plan the loads of the USC release points.', epilog=''
+    )
+    parser.add_argument(
+        '-m',
+        '--mode',
+        choices=['releasepoint', 'title'],
+        default='releasepoint',
+        help='Plan for loading each release point, or each title file (default: %(default)s)',
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of titles loaded at the same time, in title mode (default: LOAD_WORKERS)',
+    )
+    parser.add_argument(
+        '--reload',
+        action='store_true',
+        help='Plan to load every release point, even those the load ledger shows were already loaded',
+    )
+    parser.add_argument(
+        '--strict',
+        action='store_true',
+        help='Do not plan dates with missing public law metadata',
+    )
+    parser.add_argument('-o', '--output', help='Write the plan, as JSON, to this file')
+    args = parser.parse_args()
+    plan = planReleasePoints(
+        mode=args.mode,
+        workers=args.workers or getSettings().LOAD_WORKERS,
+        reload=args.reload,
+        strict=args.strict,
+    )
+    for line in formatPlan(plan):
+        logger.info(line)
+    if args.output:
+        savePlan(plan, args.output)
@@ -7,142 +7,548 @@ import os
 import argparse
 import logging
 import json
+import time
+import threading
 import subprocess
-from bson import json_util
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
 
 try:
-    import re2 as re
-except ImportError:
-    import re
-try:
-    from constants import (
-        XCITEDBPATH,
-        XMLDBPATH,
-        DOCCONFIGPATH,
-        USC_RELEASEPOINT_DIRPATH,
-        USC_RELEASEPOINT_JSON_PATH,
-        PUBLAWS_DICT_JSON_PATH,
+    from settings import getSettings
+    from loadledger import (
+        LoadLedger,
+        RELEASEPOINT_TITLE,
+        getReleasePointHashes,
+        isReleasePointLoaded,
+        isTitleLoaded,
+        reconcileDate,
+    )
+    from changeindex import ChangeIndex, indexDate, updateChangeIndex
+    from publawstore import PublawStore
+    from metrics import span, increment
+    from loadplan import (
+        getPublaws,
+        planLoad,
+        getScheduleFromPlan,
+        formatPlan,
+        savePlan,
+        readPlan,
     )
 except ImportError:
-    from loadusc.constants import (
-        XCITEDBPATH,
-        XMLDBPATH,
-        DOCCONFIGPATH,
-        USC_RELEASEPOINT_DIRPATH,
-        USC_RELEASEPOINT_JSON_PATH,
-        PUBLAWS_DICT_JSON_PATH,
+    from loadusc.settings import getSettings
+    from loadusc.loadledger import (
+        LoadLedger,
+        RELEASEPOINT_TITLE,
+        getReleasePointHashes,
+        isReleasePointLoaded,
+        isTitleLoaded,
+        reconcileDate,
+    )
+    from loadusc.changeindex import ChangeIndex, indexDate, updateChangeIndex
+    from loadusc.publawstore import PublawStore
+    from loadusc.metrics import span, increment
+    from loadusc.loadplan import (
+        getPublaws,
+        planLoad,
+        getScheduleFromPlan,
+        formatPlan,
+        savePlan,
+        readPlan,
     )
 
-logging.basicConfig(filename='loadusc.log', filemode='w', level='INFO')
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
-# ** To check if the version has been uploaded **
-# ** XCiteDB inspect -t log -match-start 20150501 **
-# ** Will give changes from that date or error if there are none **
-#    if release_date:
-#        release_date_parts = release_date.split('/')
-# version_date = release_date_parts[2] + release_date_parts[0] + release_date_parts[1]
-# dbquery = subprocess.run([XCITEDBPATH, 'inspect', '-t', 'log', '-match-start', version_date], timeout=20, capture_output=True) # noqa
-# response = dbquery.stdout
-# responseErr = dbquery.stderr
+# One lock per database, held by each load-xml unless LOAD_CONCURRENT_WRITES is set
+writeLocks = {}
+writeLocksLock = threading.Lock()
 
-# ** If no match, load to XCiteDB **
-# ** XCiteDB -dc document.conf -date <mm/dd/yyyy> load-xml -r <path to release point directory **
-# if responseErr is not None:
-#    dbload = subprocess.run([XCITEDBPATH, '-db', XMLDBPATH, '-dc', XE_DC_PATH, '-date', release_date, 'load-xml', -r, release_point_path] , timeout=20, capture_output=True) # noqa
 
+def getWriteLock(xmldbPath: str):
+    with writeLocksLock:
+        return writeLocks.setdefault(os.path.abspath(xmldbPath), threading.Lock())
 
-def sortPLS(pl):
-    pl.split('-')
-    lst = list(map(lambda x: int(x), pl.split('-')))
-    return lst[0] * 10000 + lst[1]
 
+def loadXML(path: str, release_date: str, recursive: bool = True):
+    """
+    Load a release point directory (recursive) or a single title file into XCiteDB, for `release_date`
 
-def loadUSCReleasePointsFromJSON(
-    releasepointJSONPath=USC_RELEASEPOINT_JSON_PATH, publawsDict=PUBLAWS_DICT_JSON_PATH
+    Args:
+        path (str): the release point directory, or the XML file of one title
+        release_date (str): the date of the version, in mm/dd/yyyy form
+        recursive (bool, optional): load all files under `path` (load-xml -r). Defaults to True.
+
+    Returns:
+        dict: the 'path', 'returncode', 'stdout', 'stderr' and wall time ('seconds') of the load
+    """
+    settings = getSettings()
+    command = [
+        settings.XCITEDBPATH,
+        '-db',
+        settings.XMLDBPATH,
+        '-dc',
+        settings.DOCCONFIGPATH,
+        '-date',
+        release_date,
+        'load-xml',
+    ]
+    if recursive:
+        command.append('-r')
+    command.append(path)
+    logger.info(str(command))
+    result = {'path': path, 'returncode': None, 'stdout': b'', 'stderr': b''}
+    if settings.LOAD_CONCURRENT_WRITES:
+        writeLock = nullcontext()
+    else:
+        writeLock = getWriteLock(settings.XMLDBPATH)
+    with writeLock:
+        # Timed once the database is free: the ledger estimates loads from these seconds
+        start = time.monotonic()
+        with span('load_xml', mode='releasepoint' if recursive else 'title') as timing:
+            try:
+                dbload = subprocess.run(
+                    command, timeout=settings.LOAD_TIMEOUT, capture_output=True
+                )
+                result['returncode'] = dbload.returncode
+                result['stdout'] = dbload.stdout
+                result['stderr'] = dbload.stderr
+            except Exception as err:
+                logger.error('Could not load ' + path)
+                logger.error(err)
+            timing.set(outcome='ok' if result['returncode'] == 0 else 'error')
+        result['seconds'] = time.monotonic() - start
+    return result
+
+
+def getTitleFiles(release_point_path: str):
+    """
+    Get the XML files of a release point directory, by path relative to the directory
+    """
+    files = {}
+    for root, _, filenames in os.walk(release_point_path):
+        for filename in filenames:
+            if filename.lower().endswith('.xml'):
+                path = os.path.join(root, filename)
+                files[os.path.relpath(path, release_point_path)] = path
+    return files
+
+
+def loadTitleSequence(
+    items: List, release_date: str, ledger: LoadLedger = None, hashes: dict = None
 ):
-    # releasepoints, from the releasepoint scraper is a list of releasepoints with the filename as 'name' and a list of 'titlesAffected' # noqa
-    with open(releasepointJSONPath, 'r') as f:
-        releasepoints = json.load(f)
-    releasepoints_rev = releasepoints[::-1]
+    """
+    Load the versions of one title, in order, stopping at the first failure
+
+    Args:
+        items (list): (release point name, relative path, path) of the title file in each release point
+        release_date (str): the date of the version, in mm/dd/yyyy form
+        ledger (LoadLedger, optional): ledger to record the loads in. Defaults to None.
+        hashes (dict, optional): {release point name: result of getReleasePointHashes}. Defaults to None.
 
-    # pljson is a list of public laws and their enactment dates
-    with open(publawsDict, 'r') as f:
-        pljson = json_util.loads(f.read())
+    Returns:
+        list: the results of loadXML
+    """
+    results = []
+    for rpname, relpath, path in items:
+        result = loadXML(path, release_date, recursive=False)
+        results.append(result)
+        if ledger:
+            ledger.record(
+                rpname,
+                relpath,
+                release_date,
+                (hashes or {}).get(rpname, {}).get(relpath),
+                result['returncode'],
+                result['seconds'],
+            )
+        if result['returncode'] != 0:
+            break
+    return results
 
-    pls = [
-        item.get('name')
-        for item in releasepoints_rev
-        if not (
-            re.search(r'not', item.get('name')) or re.search(r'u1$', item.get('name'))
+
+def loadDateByTitle(
+    release_date: str,
+    rpnames: List,
+    executor: ThreadPoolExecutor,
+    ledger: LoadLedger = None,
+    hashes: dict = None,
+    skipLoaded: bool = True,
+):
+    """
+    Load the release points for one date, one title file per load-xml job, running titles in parallel.
+
+    If several release points for the date have the same title, its files are loaded in release point order
+    in the same job, so that the last release point wins, as with one load-xml -r per release point.
+    With a ledger, title files already loaded are skipped, unless an earlier version of the title for the same
+    date has to be loaded. Returns when every title for the date has been loaded.
+
+    Args:
+        release_date (str): the date of the version, in mm/dd/yyyy form
+        rpnames (list): names of the release points to load for this date, in order
+        executor (ThreadPoolExecutor): the pool that runs the load-xml jobs
+        ledger (LoadLedger, optional): ledger of completed loads, where the loads are recorded. Defaults to None.
+        hashes (dict, optional): {release point name: result of getReleasePointHashes}. Defaults to None.
+        skipLoaded (bool, optional): skip the title files the ledger shows were loaded. Defaults to True.
+
+    Returns:
+        list: the results of loadXML for every file loaded, and a failed result (returncode None) for each
+        release point without a directory
+    """
+    titles = {}
+    results = []
+    for rpname in rpnames:
+        release_point_path = os.path.join(
+            getSettings().USC_RELEASEPOINT_DIRPATH, rpname
         )
-    ]
-    plsDict = dict(
-        (item.get('name'), index) for index, item in enumerate(releasepoints_rev)
-    )
-    print(plsDict)
-    pls.sort(key=sortPLS)
-    prior_index = 0
-    for pl in pls:
-        pljsonitem = pljson.get(pl)
-        if not pljsonitem:
-            logger.error('No item for ' + str(pl))
+        if not os.path.isdir(release_point_path):
+            # A failed load, as load-xml -r would give, so that the date is not taken as loaded
+            logger.error('No release point directory ' + release_point_path)
+            results.append(
+                {
+                    'path': release_point_path,
+                    'returncode': None,
+                    'stdout': b'',
+                    'stderr': b'No release point directory',
+                    'seconds': 0,
+                }
+            )
             continue
-        publaw_date = pljsonitem.get('publawDate')
-        if publaw_date:
-            release_date = publaw_date.strftime('%m/%d/%Y')
-        # Get the list of names from the last pl until and including the current one
-        plIndex = plsDict.get(pl)
-        for rp in releasepoints_rev[prior_index : plIndex + 1]:
-            rpname = rp.get('name')
-            release_point_path = os.path.join(USC_RELEASEPOINT_DIRPATH, rpname)
-            logger.info(release_point_path)
-            dbload = None
-            try:
-                logger.info(
-                    'Loading release point ' + rpname + ' for date: ' + release_date
+        for relpath, path in sorted(getTitleFiles(release_point_path).items()):
+            titles.setdefault(relpath, []).append((rpname, relpath, path))
+    futures = []
+    for items in titles.values():
+        if ledger and skipLoaded:
+            pending = [
+                index
+                for index, (rpname, relpath, _) in enumerate(items)
+                if not isTitleLoaded(ledger, rpname, relpath, hashes.get(rpname, {}))
+            ]
+            increment('load_skipped', len(items) - len(pending), kind='title')
+            if not pending:
+                continue
+            items = items[pending[0] :]
+        futures.append(
+            executor.submit(loadTitleSequence, items, release_date, ledger, hashes)
+        )
+    for future in as_completed(futures):
+        for result in future.result():
+            logger.info(
+                'Loaded {path} for {date} in {seconds:.1f}s (exit {returncode})'.format(
+                    date=release_date, **result
                 )
-                logger.info(
-                    str(
-                        [
-                            XCITEDBPATH,
-                            '-db',
-                            XMLDBPATH,
-                            '-date',
-                            release_date,
-                            'load-xml',
-                            '-r',
-                            release_point_path,
-                        ]
+            )
+            if result['returncode'] != 0:
+                logger.error(result['stderr'])
+            results.append(result)
+    return results
+
+
+def loadDate(
+    release_date: str,
+    rpnames: List,
+    ledger: LoadLedger = None,
+    executor: ThreadPoolExecutor = None,
+    reload: bool = False,
+    reconcile: bool = False,
+    changeIndex: ChangeIndex = None,
+):
+    """
+    Load the release points for one date, skipping them if the ledger shows they were already loaded
+
+    Args:
+        release_date (str): the date of the version, in mm/dd/yyyy form
+        rpnames (list): names of the release points to load for this date, in order
+        ledger (LoadLedger, optional): ledger of completed loads, where the loads are recorded. Defaults to None.
+        executor (ThreadPoolExecutor, optional): if given, load one title file per load-xml job on this pool;
+            otherwise load each release point with one load-xml -r. Defaults to None.
+        reload (bool, optional): load the release points even if they were already loaded. Defaults to False.
+        reconcile (bool, optional): if none of the release points is in the ledger, check the XCiteDB log,
+            and record them as loaded if it has changes for the date. Defaults to False.
+        changeIndex (ChangeIndex, optional): if given, copy the XCiteDB change log of the date into it once the
+            date is loaded. Defaults to None.
+
+    Returns:
+        list: the results of loadXML, or None if the date was skipped
+    """
+    hashes = {}
+    if ledger:
+        hashes = {rpname: getReleasePointHashes(rpname) for rpname in rpnames}
+        loaded = [
+            isReleasePointLoaded(ledger, rpname, hashes[rpname]) for rpname in rpnames
+        ]
+        if all(loaded) and not reload:
+            increment('load_skipped', kind='date')
+            return None
+        if (
+            reconcile
+            and not reload
+            and not any(loaded)
+            and reconcileDate(ledger, release_date, rpnames, hashes)
+        ):
+            increment('load_skipped', kind='reconciled')
+            return None
+    with span('load_date', mode='title' if executor else 'releasepoint') as timing:
+        if executor:
+            logger.info(
+                'Loading release points '
+                + ', '.join(rpnames)
+                + ' for date: '
+                + release_date
+            )
+            results = loadDateByTitle(
+                release_date,
+                rpnames,
+                executor,
+                ledger=ledger,
+                hashes=hashes,
+                skipLoaded=not reload,
+            )
+        else:
+            # Release points loaded after one that is reloaded are loaded again, so that the last one still wins
+            first = 0
+            if ledger and not reload:
+                first = loaded.index(False)
+            results = loadDateByReleasePoint(
+                release_date, rpnames[first:], ledger=ledger, hashes=hashes
+            )
+        if any(result['returncode'] != 0 for result in results):
+            timing.set(outcome='error')
+    if changeIndex and all(result['returncode'] == 0 for result in results):
+        indexDate(changeIndex, release_date)
+    return results
+
+
+def loadDateByReleasePoint(
+    release_date: str, rpnames: List, ledger: LoadLedger = None, hashes: dict = None
+):
+    """
+    Load each release point for a date with one load-xml -r, in order
+
+    Returns:
+        list: the results of loadXML
+    """
+    results = []
+    dbload = None
+    for rpname in rpnames:
+        release_point_path = os.path.join(
+            getSettings().USC_RELEASEPOINT_DIRPATH, rpname
+        )
+        logger.info(release_point_path)
+        logger.info('Loading release point ' + rpname + ' for date: ' + release_date)
+        dbload = loadXML(release_point_path, release_date)
+        results.append(dbload)
+        if ledger:
+            ledger.record(
+                rpname,
+                RELEASEPOINT_TITLE,
+                release_date,
+                hashes[rpname].get(RELEASEPOINT_TITLE),
+                dbload['returncode'],
+                dbload['seconds'],
+            )
+    if dbload:
+        logger.info(dbload['stdout'])
+        logger.info(dbload['stderr'])
+    return results
+
+
+def logSlowestTitles(results: List, count: int = 10):
+    slowest = sorted(results, key=lambda result: result['seconds'], reverse=True)
+    logger.info('Slowest titles:')
+    for result in slowest[:count]:
+        logger.info('{seconds:.1f}s {path}'.format(**result))
+
+
+def loadPlan(
+    plan: dict,
+    workers: int = None,
+    ledgerPath: str = None,
+    reload: bool = None,
+    reconcile: bool = False,
+    changeIndexPath: str = None,
+):
+    """
+    Load the dates of a plan (see loadplan.py) into XCiteDB, in the order of the plan
+
+    With a ledger, what it shows is loaded is skipped, so that loading a plan again resumes it. Loading stops at
+    the first date with a failed load: later dates would be loaded over an incomplete version.
+
+    Args:
+        plan (dict): the plan, from loadplan.planLoad or loadplan.readPlan; its 'mode' is the load mode
+        workers (int, optional): number of title jobs run at the same time, in 'title' mode; their load-xml still
+            write the database one at a time, unless LOAD_CONCURRENT_WRITES. Defaults to None, for LOAD_WORKERS.
+        ledgerPath (str, optional): the load ledger. '' to load everything without a ledger.
+            Defaults to None, for LOAD_LEDGER_PATH.
+        reload (bool, optional): load everything, but still record the loads in the ledger. Defaults to None, for
+            the 'reload' of the plan.
+        reconcile (bool, optional): for dates not in the ledger, check the XCiteDB log, and record the date
+            as loaded if it has changes for it. Defaults to False.
+        changeIndexPath (str, optional): the index of the XCiteDB change log, updated as dates are loaded.
+            '' not to index. Defaults to None, for CHANGE_INDEX_PATH.
+
+    Returns:
+        dict: the number of dates 'loaded' and 'skipped', the date that 'failed' (None if none did), and the run
+        time in 'seconds'
+    """
+    settings = getSettings()
+    if workers is None:
+        workers = settings.LOAD_WORKERS
+    if ledgerPath is None:
+        ledgerPath = settings.LOAD_LEDGER_PATH
+    if changeIndexPath is None:
+        changeIndexPath = settings.CHANGE_INDEX_PATH
+    mode = plan.get('mode', 'releasepoint')
+    if reload is None:
+        reload = plan.get('reload', False)
+    schedule = getScheduleFromPlan(plan)
+    skipped = len(plan['dates']) - len(schedule)
+    loaded = 0
+    failed = None
+    ledger = LoadLedger(ledgerPath) if ledgerPath else None
+    changeIndex = ChangeIndex(changeIndexPath) if changeIndexPath else None
+    start = time.monotonic()
+    results = []
+    executor = (
+        ThreadPoolExecutor(max_workers=max(1, int(workers)))
+        if mode == 'title'
+        else None
+    )
+    try:
+        for release_date, rpnames in schedule:
+            dateResults = loadDate(
+                release_date,
+                rpnames,
+                ledger=ledger,
+                executor=executor,
+                reload=reload,
+                reconcile=reconcile,
+                changeIndex=changeIndex,
+            )
+            if dateResults is None:
+                skipped += 1
+                continue
+            results.extend(dateResults)
+            if any(result['returncode'] != 0 for result in dateResults):
+                failed = release_date
+                logger.error(
+                    'Not loading the dates after {}: some of its loads failed'.format(
+                        release_date
                     )
                 )
-                dbload = subprocess.run(
-                    [
-                        XCITEDBPATH,
-                        '-db',
-                        XMLDBPATH,
-                        '-dc',
-                        DOCCONFIGPATH,
-                        '-date',
-                        release_date,
-                        'load-xml',
-                        '-r',
-                        release_point_path,
-                    ],
-                    timeout=600,
-                    capture_output=True,
-                )
-            except Exception as err:
-                logger.error('Could not load release point for ' + rpname)
-                logger.error(err)
-        prior_index = plIndex + 1
-        if dbload:
-            logger.info(dbload.stdout)
-            logger.info(dbload.stderr)
+                break
+            loaded += 1
+        if changeIndex and ledger:
+            # Dates loaded before the index existed, or reconciled
+            updateChangeIndex(changeIndex, ledger)
+    finally:
+        if executor:
+            executor.shutdown()
+        if ledger:
+            ledger.close()
+        if changeIndex:
+            changeIndex.close()
+    if mode == 'title':
+        logSlowestTitles(results)
+    seconds = time.monotonic() - start
+    logger.info(
+        'Loaded {} dates in {:.1f}s ({} already loaded)'.format(
+            loaded, seconds, skipped
+        )
+    )
+    return {'loaded': loaded, 'skipped': skipped, 'failed': failed, 'seconds': seconds}
+
+
+def loadUSCReleasePointsFromJSON(
+    releasepointJSONPath: str = None,
+    publawsDict: str = None,
+    mode: str = 'releasepoint',
+    workers: int = None,
+    ledgerPath: str = None,
+    reload: bool = False,
+    reconcile: bool = False,
+    changeIndexPath: str = None,
+    dryRun: bool = False,
+    strict: bool = False,
+    planPath: str = None,
+):
+    """
+    Load the release points into XCiteDB, in chronological order
+
+    Args:
+        releasepointJSONPath (str, optional): path to uscreleasepoints.json. Defaults to None, for
+            USC_RELEASEPOINT_JSON_PATH.
+        publawsDict (str, optional): path to a publawsDict.json to use instead of the public law store.
+            Defaults to None.
+        mode (str, optional): 'releasepoint' runs one load-xml -r per release point; 'title' runs one load-xml
+            per title file, `workers` at a time. A date is always fully loaded before the next one starts.
+            Defaults to 'releasepoint'.
+        workers (int, optional): number of titles loaded at the same time, in 'title' mode. Defaults to None, for
+            LOAD_WORKERS.
+        ledgerPath (str, optional): the load ledger; release points and titles it shows were loaded from the same
+            content are skipped. '' to load everything without a ledger. Defaults to None, for LOAD_LEDGER_PATH.
+        reload (bool, optional): load everything, but still record the loads in the ledger. Defaults to False.
+        reconcile (bool, optional): for dates not in the ledger, check the XCiteDB log, and record the date
+            as loaded if it has changes for it. Defaults to False.
+        changeIndexPath (str, optional): the index of the XCiteDB change log, updated as dates are loaded.
+            '' not to index. Defaults to None, for CHANGE_INDEX_PATH.
+        dryRun (bool, optional): only plan the loads, and log the plan. Defaults to False.
+        strict (bool, optional): do not load dates with missing public law metadata (see loadplan.planLoad).
+            Defaults to False.
+        planPath (str, optional): write the plan, as JSON, to this file. Defaults to None.
+
+    Returns:
+        dict: the plan, with the 'result' of loadPlan unless `dryRun`
+    """
+    settings = getSettings()
+    if workers is None:
+        workers = settings.LOAD_WORKERS
+    if ledgerPath is None:
+        ledgerPath = settings.LOAD_LEDGER_PATH
+    releasepointJSONPath = releasepointJSONPath or settings.USC_RELEASEPOINT_JSON_PATH
+    # releasepoints, from the releasepoint scraper is a list of releasepoints with the filename as 'name' and a list of 'titlesAffected' # noqa
+    with open(releasepointJSONPath, 'r') as f:
+        releasepoints = json.load(f)
+
+    # The public laws and their enactment dates are in the public law store
+    publaws = getPublaws(publawsDict)
+    ledger = LoadLedger(ledgerPath) if ledgerPath else None
+    try:
+        plan = planLoad(
+            releasepoints,
+            publaws,
+            ledger=ledger,
+            mode=mode,
+            workers=workers,
+            reload=reload,
+            strict=strict,
+        )
+    finally:
+        if ledger:
+            ledger.close()
+        if isinstance(publaws, PublawStore):
+            publaws.close()
+    for issue in plan['issues']:
+        logger.warning(issue['message'])
+    if planPath:
+        savePlan(plan, planPath)
+    if dryRun:
+        for line in formatPlan(plan):
+            logger.info(line)
+        return plan
+    plan['result'] = loadPlan(
+        plan,
+        workers=workers,
+        ledgerPath=ledgerPath,
+        reload=reload,
+        reconcile=reconcile,
+        changeIndexPath=changeIndexPath,
+    )
+    return plan
 
 
 if __name__ == '__main__':
+    logging.basicConfig(filename='loadusc.log', filemode='a', level='INFO')
     parser = argparse.ArgumentParser(description='Load USC releasepoints.', epilog='')
     # parser.add_argument(
     #     '-d',
@@ -152,9 +558,76 @@ if __name__ == '__main__':
     #     default='ERROR',
     #     help='Set the debug level (default: %(default)s)')
 
+    parser.add_argument(
+        '-m',
+        '--mode',
+        action='store',
+        dest='mode',
+        choices=['releasepoint', 'title'],
+        default='releasepoint',
+        help='Load each release point with one load-xml -r, or each title file with its own load-xml '
+        '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        action='store',
+        dest='workers',
+        type=int,
+        help='Number of titles loaded at the same time, in title mode (default: LOAD_WORKERS)',
+    )
+
+    parser.add_argument(
+        '--reload',
+        action='store_true',
+        dest='reload',
+        help='Load every release point, even those the load ledger shows were already loaded',
+    )
+    parser.add_argument(
+        '--reconcile',
+        action='store_true',
+        dest='reconcile',
+        help='For dates not in the load ledger, check the XCiteDB log before loading them',
+    )
+
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        dest='dryRun',
+        help='Show the load plan (dates, release points, sizes, estimated times, issues) without loading',
+    )
+    parser.add_argument(
+        '--strict',
+        action='store_true',
+        dest='strict',
+        help='Do not load dates with missing public law metadata',
+    )
+    parser.add_argument(
+        '--plan',
+        action='store',
+        dest='planPath',
+        help='Write the load plan, as JSON, to this file',
+    )
+    parser.add_argument(
+        '--from-plan',
+        action='store',
+        dest='fromPlan',
+        help='Load the dates of a plan written with --plan (and possibly edited), in its order',
+    )
+
     args = parser.parse_args()
+    getSettings().validate()
 
     logger.info(json.dumps(args.__dict__))
     logger.info('===============================')
 
-    loadUSCReleasePointsFromJSON(**args.__dict__)
+    fromPlan = args.__dict__.pop('fromPlan')
+    if fromPlan:
+        loadPlan(
+            readPlan(fromPlan),
+            workers=args.workers,
+            reload=args.reload or None,
+            reconcile=args.reconcile,
+        )
+    else:
+        loadUSCReleasePointsFromJSON(**args.__dict__)
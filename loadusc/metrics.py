@@ -0,0 +1,414 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Timings and counters of the download, load and query paths, exported for Prometheus or as JSON lines'
+
+# The hot paths record what they do with two calls:
+#
+#   with span('load_xml', mode='title') as timing:     # times the block, into a histogram of its labels
+#       ...
+#       timing.set(outcome='error')                    # labels known only at the end (default: ok, or error
+#                                                      # if the block raises)
+#   increment('download_bytes', nbytes)                # adds to a counter
+#
+# METRICS_EXPORT chooses the exports. With none (the default), span() returns one shared object that does
+# nothing and increment() returns at once, so the calls can stay in the hot paths. Otherwise, the metrics of the
+# process are written to METRICS_DIRPATH every METRICS_FLUSH_INTERVAL seconds, by a daemon thread so that no
+# recording call waits on the disk, and when the process exits:
+#
+#   prometheus  <process>.prom, rewritten whole: a histogram loadusc_<span>_seconds for each span and a counter
+#               loadusc_<counter>_total for each counter, labelled with the process (e.g. loaduscxcite), for the
+#               textfile collector of node_exporter
+#   jsonl       <process>.jsonl, appended: one line per span, as it ended, and one line per counter at each export
+#
+# The process name is that of the script run (downloadusc, loaduscxcite, sync...), or the one given to
+# resetMetrics(process=...). Settings read after configure() need resetMetrics() to take effect.
+
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+
+try:
+    from settings import getSettings, SettingsError
+except ImportError:
+    from loadusc.settings import getSettings, SettingsError
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'loadusc_'
+# Upper bounds, in seconds, of the histogram buckets: from a cached query to a full title load
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+)
+
+
+def getProcessName():
+    name = os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ''))[0]
+    # Not a script: python -c, python - or an interactive session
+    return name if name and not name.startswith('-') else 'python'
+
+
+def getLabelsKey(labels: dict):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def escapeLabel(value: str):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatLabels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return (
+        '{'
+        + ','.join('{}="{}"'.format(name, escapeLabel(value)) for name, value in pairs)
+        + '}'
+    )
+
+
+class NoopSpan:
+    """Stands in for a Span when nothing is recorded."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **labels):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    """Times a block into the histogram of its name and labels."""
+
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        if 'outcome' not in self.labels:
+            self.labels['outcome'] = 'ok' if exc_type is None else 'error'
+        self.metrics.observe(self.name, seconds, self.labels)
+        return False
+
+    def set(self, **labels):
+        """
+        Set labels known only at the end of the span, e.g. outcome='error' or status=304
+        """
+        self.labels.update(labels)
+
+
+class Metrics:
+    """Histograms of span durations and counters of one process, and their exports. Thread-safe."""
+
+    def __init__(
+        self,
+        exports,
+        dirPath: str,
+        flushInterval: float = 60,
+        process: str = None,
+    ):
+        self.exports = list(exports)
+        self.dirPath = dirPath
+        self.flushInterval = flushInterval
+        self.process = process or getProcessName()
+        self.lock = threading.Lock()
+        self.flushLock = threading.Lock()
+        # {(name, labels key): [count per bucket..., count, sum]}
+        self.histograms = {}
+        # {(name, labels key): value}
+        self.counters = {}
+        self.events = []
+        self.stopped = threading.Event()
+        self.flusher = None
+        if flushInterval > 0:
+            self.flusher = threading.Thread(target=self.flushEvery, daemon=True)
+            self.flusher.start()
+
+    def observe(self, name: str, seconds: float, labels: dict = None):
+        key = (name, getLabelsKey(labels or {}))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[index] += 1
+                    break
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            if 'jsonl' in self.exports:
+                self.events.append(
+                    {
+                        'time': time.time(),
+                        'process': self.process,
+                        'span': name,
+                        'seconds': seconds,
+                        'labels': dict(key[1]),
+                    }
+                )
+
+    def increment(self, name: str, value: float = 1, labels: dict = None):
+        key = (name, getLabelsKey(labels or {}))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def getSnapshot(self):
+        """
+        Get the metrics recorded so far
+
+        Returns:
+            dict: {'spans': [{'name', 'labels', 'count', 'seconds', 'buckets'}], 'counters': [{'name', 'labels',
+            'value'}]}, sorted by name
+        """
+        with self.lock:
+            histograms = {key: list(value) for key, value in self.histograms.items()}
+            counters = dict(self.counters)
+        return {
+            'spans': [
+                {
+                    'name': name,
+                    'labels': dict(labelsKey),
+                    'count': histogram[-2],
+                    'seconds': histogram[-1],
+                    'buckets': histogram[: len(BUCKETS)],
+                }
+                for (name, labelsKey), histogram in sorted(histograms.items())
+            ],
+            'counters': [
+                {'name': name, 'labels': dict(labelsKey), 'value': value}
+                for (name, labelsKey), value in sorted(counters.items())
+            ],
+        }
+
+    def formatPrometheus(self):
+        """
+        Get the metrics in the Prometheus text exposition format
+        """
+        snapshot = self.getSnapshot()
+        process = (('process', self.process),)
+        lines = []
+        typed = set()
+        for span in snapshot['spans']:
+            metric = PREFIX + span['name'] + '_seconds'
+            if metric not in typed:
+                typed.add(metric)
+                lines.append('# TYPE {} histogram'.format(metric))
+            key = getLabelsKey(span['labels']) + process
+            cumulative = 0
+            for bound, count in zip(BUCKETS, span['buckets']):
+                cumulative += count
+                lines.append(
+                    '{}_bucket{} {}'.format(
+                        metric,
+                        formatLabels(key, (('le', repr(float(bound))),)),
+                        cumulative,
+                    )
+                )
+            lines.append(
+                '{}_bucket{} {}'.format(
+                    metric, formatLabels(key, (('le', '+Inf'),)), span['count']
+                )
+            )
+            lines.append(
+                '{}_sum{} {!r}'.format(metric, formatLabels(key), span['seconds'])
+            )
+            lines.append(
+                '{}_count{} {}'.format(metric, formatLabels(key), span['count'])
+            )
+        for counter in snapshot['counters']:
+            metric = PREFIX + counter['name'] + '_total'
+            if metric not in typed:
+                typed.add(metric)
+                lines.append('# TYPE {} counter'.format(metric))
+            lines.append(
+                '{}{} {!r}'.format(
+                    metric,
+                    formatLabels(getLabelsKey(counter['labels']) + process),
+                    float(counter['value']),
+                )
+            )
+        lines.append('# TYPE {}last_export_seconds gauge'.format(PREFIX))
+        lines.append(
+            '{}last_export_seconds{} {!r}'.format(
+                PREFIX, formatLabels(process), time.time()
+            )
+        )
+        return '\n'.join(lines) + '\n'
+
+    def flushEvery(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+
+    def close(self):
+        """
+        Stop the exports every METRICS_FLUSH_INTERVAL, and export what was recorded
+        """
+        self.stopped.set()
+        self.flush()
+
+    def flush(self):
+        """
+        Write the exports: rewrite the Prometheus file, and append the ended spans and the counters to the JSON lines
+        """
+        with self.flushLock:
+            self.writeExports()
+
+    def writeExports(self):
+        try:
+            os.makedirs(self.dirPath, exist_ok=True)
+            if 'prometheus' in self.exports:
+                path = os.path.join(self.dirPath, self.process + '.prom')
+                # The collector may read the file at any time: replace it whole
+                with open(path + '.tmp', 'w') as f:
+                    f.write(self.formatPrometheus())
+                os.replace(path + '.tmp', path)
+            if 'jsonl' in self.exports:
+                with self.lock:
+                    events, self.events = self.events, []
+                now = time.time()
+                with open(
+                    os.path.join(self.dirPath, self.process + '.jsonl'), 'a'
+                ) as f:
+                    for event in events:
+                        f.write(json.dumps(event) + '\n')
+                    for counter in self.getSnapshot()['counters']:
+                        f.write(
+                            json.dumps(
+                                {
+                                    'time': now,
+                                    'process': self.process,
+                                    'counter': counter['name'],
+                                    'value': counter['value'],
+                                    'labels': counter['labels'],
+                                }
+                            )
+                            + '\n'
+                        )
+        except OSError as err:
+            logger.error(
+                'Could not export metrics to ' + self.dirPath + ': ' + str(err)
+            )
+
+
+# The metrics of the process: None when nothing is recorded, UNRESOLVED until the settings are read
+UNRESOLVED = object()
+processMetrics = UNRESOLVED
+processMetricsLock = threading.Lock()
+
+
+def getMetrics():
+    """
+    Get the Metrics of the process, or None if METRICS_EXPORT is empty (or the settings cannot be read)
+    """
+    global processMetrics
+    metrics = processMetrics
+    if metrics is not UNRESOLVED:
+        return metrics
+    with processMetricsLock:
+        if processMetrics is UNRESOLVED:
+            processMetrics = createMetrics()
+        return processMetrics
+
+
+def createMetrics(process: str = None):
+    try:
+        settings = getSettings()
+    except SettingsError as err:
+        logger.debug('Not recording metrics: ' + str(err))
+        return None
+    if not settings.METRICS_EXPORT:
+        return None
+    metrics = Metrics(
+        settings.METRICS_EXPORT,
+        settings.METRICS_DIRPATH,
+        settings.METRICS_FLUSH_INTERVAL,
+        process=process,
+    )
+    atexit.register(metrics.close)
+    return metrics
+
+
+def resetMetrics(process: str = None):
+    """
+    Export the metrics recorded so far, and start recording again with the current settings
+
+    Args:
+        process (str, optional): name of the process in the exports. Defaults to the name of the script.
+
+    Returns:
+        Metrics: the new Metrics, or None if nothing is recorded
+    """
+    global processMetrics
+    with processMetricsLock:
+        if processMetrics not in (None, UNRESOLVED):
+            processMetrics.close()
+            atexit.unregister(processMetrics.close)
+        processMetrics = createMetrics(process)
+        return processMetrics
+
+
+def span(name: str, **labels):
+    """
+    Time a `with` block into the histogram `name`, e.g. with span('http_fetch', kind='zip') as timing: ...
+
+    Returns:
+        Span: a context manager, whose set(**labels) adds labels before the block ends
+    """
+    metrics = processMetrics if processMetrics is not UNRESOLVED else getMetrics()
+    if metrics is None:
+        return NOOP_SPAN
+    return Span(metrics, name, labels)
+
+
+def increment(name: str, value: float = 1, **labels):
+    """
+    Add `value` to the counter `name`
+    """
+    metrics = processMetrics if processMetrics is not UNRESOLVED else getMetrics()
+    if metrics is None:
+        return
+    metrics.increment(name, value, labels)
+
+
+def flushMetrics():
+    """
+    Export the metrics recorded so far, if any are
+    """
+    metrics = processMetrics if processMetrics is not UNRESOLVED else getMetrics()
+    if metrics is not None:
+        metrics.flush()
@@ -0,0 +1,406 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Indexed store of public law dates and bills, built from billmeta.json'
+
+# loadplan.getLoadSchedule needs the enactment date of each public law with a release point. It used to get it
+# from publawsDict.json, decoded in full with bson.json_util on every run, and utils.savePublawDict rebuilt that
+# from the whole of billmeta.json, with its bill and amendment lists.
+#
+# The store keeps only what is used, one row per public law (congress, number, date, bill), in a SQLite file at
+# PUBLAW_STORE_PATH. Rows are clustered by (congress, number), and indexed by date, for range queries. Looking up
+# a date is a primary key lookup, with nothing to decode at startup.
+#
+# The store is brought up to date from META_JSON_PATH (billmeta.json), or PUBLAWS_DICT_JSON_PATH if there is no
+# billmeta.json. A source is only read if its size or modification time changed since it was last read, and then
+# only the rows that differ are written.
+#
+# Usage: python publawstore.py update
+#        python publawstore.py stats
+#        python publawstore.py get 116-140 [116-136 ...]
+
+import os
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+try:
+    from settings import getSettings
+    from loadledger import getDateOrd
+except ImportError:
+    from loadusc.settings import getSettings
+    from loadusc.loadledger import getDateOrd
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS publaws (
+    congress INTEGER NOT NULL,
+    number INTEGER NOT NULL,
+    date_ord INTEGER,
+    date TEXT,
+    bill TEXT,
+    PRIMARY KEY (congress, number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS publaws_date ON publaws (date_ord);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    publaws INTEGER NOT NULL,
+    read_at TEXT NOT NULL
+);
+'''
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def splitPublaw(publaw: str):
+    """
+    Split a public law number, e.g. '116-140', into (congress, number); None if it is not of that form
+    """
+    congress, _, number = (publaw or '').partition('-')
+    if not (congress.isdigit() and number.isdigit()):
+        return None
+    return int(congress), int(number)
+
+
+def getPublawDateString(value):
+    """
+    Get a public law date, as mm/dd/yyyy, from a datetime or the MongoDB extended JSON of one
+
+    Args:
+        value: a datetime, {'$date': milliseconds}, {'$date': {'$numberLong': '...'}}, {'$date': 'yyyy-mm-ddT...'}
+            or 'yyyy-mm-dd...'
+
+    Returns:
+        str: the date, or None if there is none
+    """
+    if isinstance(value, dict):
+        value = value.get('$date')
+        if isinstance(value, dict):
+            value = value.get('$numberLong')
+            value = int(value) if value is not None else None
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        value = EPOCH + timedelta(milliseconds=value)
+    elif isinstance(value, str):
+        value = datetime.strptime(value[:10], '%Y-%m-%d')
+    return value.strftime('%m/%d/%Y')
+
+
+def readPublaws(path: str):
+    """
+    Read the public laws of billmeta.json (its `publaws` array) or of publawsDict.json (a dict of them)
+
+    The file is decoded as plain JSON, without the bson object hook, and its dates are left in extended JSON.
+
+    Returns:
+        list: the public laws, as dicts with 'publaw', 'publawDate' and 'billCongressTypeNumber'
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, dict) and isinstance(data.get('publaws'), list):
+        return data['publaws']
+    if isinstance(data, dict):
+        # publawsDict.json
+        return [
+            dict(value, publaw=value.get('publaw') or key)
+            for key, value in data.items()
+            if isinstance(value, dict)
+        ]
+    raise ValueError('No public laws in ' + path)
+
+
+class PublawStore:
+    """Public law dates and bills, by public law number. Safe to use from several threads."""
+
+    def __init__(self, path: str = None, readonly: bool = False):
+        path = path or getSettings().PUBLAW_STORE_PATH
+        self.path = path
+        self.lock = threading.Lock()
+        if readonly:
+            self.connection = sqlite3.connect(
+                'file:' + path + '?mode=ro', uri=True, check_same_thread=False
+            )
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __contains__(self, publaw: str):
+        key = splitPublaw(publaw)
+        if key is None:
+            return False
+        with self.lock:
+            return (
+                self.connection.execute(
+                    'SELECT 1 FROM publaws WHERE congress = ? AND number = ?', key
+                ).fetchone()
+                is not None
+            )
+
+    def getDate(self, publaw: str):
+        """
+        Get the date of a public law, as mm/dd/yyyy
+
+        Args:
+            publaw (str): e.g. '116-140'
+
+        Returns:
+            str: the date, or None if the public law is not in the store or has no date
+        """
+        key = splitPublaw(publaw)
+        if key is None:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT date FROM publaws WHERE congress = ? AND number = ?', key
+            ).fetchone()
+        return row[0] if row else None
+
+    def getBill(self, publaw: str):
+        """
+        Get the bill that became a public law, e.g. '116hr748'; None if it is not in the store
+        """
+        key = splitPublaw(publaw)
+        if key is None:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT bill FROM publaws WHERE congress = ? AND number = ?', key
+            ).fetchone()
+        return row[0] if row else None
+
+    def getRange(self, fromDate: str = None, toDate: str = None):
+        """
+        Get the public laws enacted in a date range
+
+        Args:
+            fromDate (str, optional): the first date, mm/dd/yyyy. Defaults to None, for no limit.
+            toDate (str, optional): the last date, mm/dd/yyyy. Defaults to None, for no limit.
+
+        Returns:
+            list: (publaw, date) tuples, in chronological order, then by public law
+        """
+        fromOrd = getDateOrd(fromDate) if fromDate else 0
+        toOrd = getDateOrd(toDate) if toDate else 99999999
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT congress, number, date FROM publaws WHERE date_ord BETWEEN ? AND ? '
+                'ORDER BY date_ord, congress, number',
+                (fromOrd, toOrd),
+            ).fetchall()
+        return [
+            ('{}-{}'.format(congress, number), date) for congress, number, date in rows
+        ]
+
+    def getCongress(self, congress: int):
+        """
+        Get the public laws of a congress, in order, as (publaw, date) tuples
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT number, date FROM publaws WHERE congress = ? ORDER BY number',
+                (int(congress),),
+            ).fetchall()
+        return [('{}-{}'.format(congress, number), date) for number, date in rows]
+
+    def isCurrent(self, path: str):
+        """
+        Whether `path` is the file the store was last brought up to date with, and has not changed since
+        """
+        stat = os.stat(path)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT size, mtime_ns FROM sources WHERE path = ?',
+                (os.path.abspath(path),),
+            ).fetchone()
+        return row is not None and tuple(row) == (stat.st_size, stat.st_mtime_ns)
+
+    def update(self, path: str, force: bool = False):
+        """
+        Bring the store up to date with a billmeta.json or publawsDict.json, if it changed since it was last read
+
+        Public laws that are not in `path` any more are removed from the store.
+
+        Args:
+            path (str): the file
+            force (bool, optional): read the file even if it has not changed. Defaults to False.
+
+        Returns:
+            dict: the number of public laws 'added', 'updated' and 'removed'; None if the file had not changed
+        """
+        if not force and self.isCurrent(path):
+            return None
+        stat = os.stat(path)
+        rows = {}
+        for publaw in readPublaws(path):
+            key = splitPublaw(publaw.get('publaw'))
+            if key is None:
+                logger.warning(
+                    'Not storing public law: {}'.format(publaw.get('publaw'))
+                )
+                continue
+            try:
+                date = getPublawDateString(publaw.get('publawDate'))
+            except (TypeError, ValueError, OverflowError):
+                logger.warning(
+                    'No date for public law: {}'.format(publaw.get('publaw'))
+                )
+                date = None
+            rows[key] = (
+                getDateOrd(date) if date else None,
+                date,
+                publaw.get('billCongressTypeNumber'),
+            )
+        counts = {'added': 0, 'updated': 0, 'removed': 0}
+        with self.lock:
+            existing = {
+                (congress, number): (dateOrd, date, bill)
+                for congress, number, dateOrd, date, bill in self.connection.execute(
+                    'SELECT congress, number, date_ord, date, bill FROM publaws'
+                )
+            }
+            changed = []
+            for key, row in rows.items():
+                if key not in existing:
+                    counts['added'] += 1
+                elif existing[key] != row:
+                    counts['updated'] += 1
+                else:
+                    continue
+                changed.append(key + row)
+            removed = [key for key in existing if key not in rows]
+            counts['removed'] = len(removed)
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO publaws (congress, number, date_ord, date, bill) VALUES (?, ?, ?, ?, ?)',
+                    changed,
+                )
+                self.connection.executemany(
+                    'DELETE FROM publaws WHERE congress = ? AND number = ?', removed
+                )
+                # The rows are those of this source only
+                self.connection.execute('DELETE FROM sources')
+                self.connection.execute(
+                    'INSERT INTO sources (path, size, mtime_ns, publaws, read_at) VALUES (?, ?, ?, ?, ?)',
+                    (
+                        os.path.abspath(path),
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        len(rows),
+                        datetime.utcnow().isoformat(),
+                    ),
+                )
+        logger.info(
+            'Public law store updated from {}: {}'.format(path, json.dumps(counts))
+        )
+        return counts
+
+    def getStats(self):
+        with self.lock:
+            publaws, dated, first, last = self.connection.execute(
+                'SELECT COUNT(*), COUNT(date_ord), MIN(date_ord), MAX(date_ord) FROM publaws'
+            ).fetchone()
+            sources = self.connection.execute(
+                'SELECT path, publaws, read_at FROM sources ORDER BY read_at'
+            ).fetchall()
+        return {
+            'publaws': publaws,
+            'dated': dated,
+            'first': first,
+            'last': last,
+            'sources': [
+                {'path': path, 'publaws': count, 'readAt': readAt}
+                for path, count, readAt in sources
+            ],
+        }
+
+
+def getSourcePath(metaPath: str = None, publawsDict: str = None):
+    """
+    Get the file the store is built from: billmeta.json if there is one, otherwise publawsDict.json
+
+    Returns:
+        str: the path, or None if there is neither
+    """
+    metaPath = metaPath or getSettings().META_JSON_PATH
+    if os.path.isfile(metaPath):
+        return metaPath
+    publawsDict = publawsDict or getSettings().PUBLAWS_DICT_JSON_PATH
+    if os.path.isfile(publawsDict):
+        return publawsDict
+    return None
+
+
+def getPublawStore(path: str = None, metaPath: str = None, publawsDict: str = None):
+    """
+    Open the public law store, brought up to date with billmeta.json (or publawsDict.json)
+
+    Args:
+        path (str, optional): the store. Defaults to PUBLAW_STORE_PATH.
+        metaPath (str, optional): billmeta.json. Defaults to META_JSON_PATH.
+        publawsDict (str, optional): publawsDict.json, used if there is no billmeta.json. Defaults to
+            PUBLAWS_DICT_JSON_PATH.
+
+    Returns:
+        PublawStore: the store
+    """
+    store = PublawStore(path)
+    sourcePath = getSourcePath(metaPath, publawsDict)
+    if sourcePath:
+        store.update(sourcePath)
+    elif not store.getStats()['publaws']:
+        logger.warning('No public laws: there is no billmeta.json or publawsDict.json')
+    return store
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='loadusc.log', filemode='a', level='INFO')
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    parser = argparse.ArgumentParser(
+        description='Build and query the public law store.', epilog=''
+    )
+    parser.add_argument(
+        'command',
+        choices=['update', 'stats', 'get'],
+        help='update: read billmeta.json if it changed; stats: count the public laws; get: the date and bill of each '
+        'public law given',
+    )
+    parser.add_argument('publaws', nargs='*', help='public laws, e.g. 116-140, for get')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='read billmeta.json even if it has not changed, for update',
+    )
+    args = parser.parse_args()
+    store = PublawStore()
+    if args.command == 'update':
+        sourcePath = getSourcePath()
+        if not sourcePath:
+            logger.error('There is no billmeta.json or publawsDict.json')
+        else:
+            store.update(sourcePath, force=args.force)
+    if args.command == 'get':
+        for publaw in args.publaws:
+            print(
+                json.dumps(
+                    {
+                        'publaw': publaw,
+                        'date': store.getDate(publaw),
+                        'bill': store.getBill(publaw),
+                    }
+                )
+            )
+    else:
+        logger.info(json.dumps(store.getStats()))
+    store.close()
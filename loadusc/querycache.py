@@ -0,0 +1,273 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Cache of XCiteDB query results, dropped when new release points are loaded'
+
+# getxcite.py caches the results of getIdentifier and getChangeDates by normalized identifier and date.
+# Entries are stored with the version of the database: a stamp of the successful loads in the load ledger
+# (loadledger.py). When loaduscxcite.py records a load, the version changes and every older entry is dropped.
+# The ledger is only read again when its file has changed, and at most every VERSION_CHECK_INTERVAL seconds.
+#
+# Entries are kept in memory, least recently used first out, up to XCITEDB_QUERY_CACHE_SIZE entries and for
+# XCITEDB_QUERY_CACHE_TTL seconds. If XCITEDB_QUERY_CACHE_PATH is set, they are also written to a SQLite file
+# there, which outlives the process and can be shared by several API processes. Every DISK_PRUNE_WRITES writes,
+# the rows past the TTL, and the oldest beyond XCITEDB_QUERY_CACHE_SIZE, are deleted from it. An error of the file,
+# e.g. "database is locked" while another process writes, is logged and taken as a miss.
+
+import os
+import copy
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    from settings import getSettings
+except ImportError:
+    from loadusc.settings import getSettings
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the load ledger for new loads
+VERSION_CHECK_INTERVAL = 5
+# Writes to the SQLite file between deletions of its expired and oldest rows
+DISK_PRUNE_WRITES = 100
+
+DISK_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    version TEXT,
+    stored_at REAL NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_stored_at ON results (stored_at);
+'''
+
+
+def getLedgerVersion(ledgerPath: str = None):
+    """
+    Get a stamp of the successful loads recorded in the load ledger, which changes whenever a load is recorded
+
+    Returns:
+        str: the stamp, or None if there is no ledger
+    """
+    ledgerPath = ledgerPath or getSettings().LOAD_LEDGER_PATH
+    if not os.path.isfile(ledgerPath):
+        return None
+    try:
+        connection = sqlite3.connect('file:' + ledgerPath + '?mode=ro', uri=True)
+        try:
+            row = connection.execute(
+                'SELECT COUNT(*), MAX(date_ord), MAX(loaded_at) FROM loads WHERE exit_code = 0'
+            ).fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error as err:
+        logger.warning('Could not read the load ledger: {}'.format(err))
+        return None
+    return '{}:{}:{}'.format(*row)
+
+
+class QueryCache:
+    """LRU cache of query results with a time to live, invalidated by the load ledger. Thread-safe."""
+
+    def __init__(
+        self,
+        maxEntries: int = None,
+        ttl: float = None,
+        diskPath: str = None,
+        ledgerPath: str = None,
+    ):
+        settings = getSettings()
+        if maxEntries is None:
+            maxEntries = settings.XCITEDB_QUERY_CACHE_SIZE
+        if ttl is None:
+            ttl = settings.XCITEDB_QUERY_CACHE_TTL
+        if diskPath is None:
+            diskPath = settings.XCITEDB_QUERY_CACHE_PATH
+        ledgerPath = ledgerPath or settings.LOAD_LEDGER_PATH
+        self.maxEntries = max(0, int(maxEntries))
+        self.ttl = ttl
+        self.ledgerPath = ledgerPath
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.version = None
+        self.ledgerStamp = None
+        self.checkedAt = None
+        self.stats = {
+            'hits': 0,
+            'diskHits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+        self.disk = None
+        self.diskWrites = 0
+        if diskPath:
+            os.makedirs(os.path.dirname(os.path.abspath(diskPath)), exist_ok=True)
+            try:
+                self.disk = sqlite3.connect(diskPath, check_same_thread=False)
+                self.disk.executescript(DISK_SCHEMA)
+            except sqlite3.Error as err:
+                logger.warning('Not caching queries in {}: {}'.format(diskPath, err))
+                self.disk = None
+
+    def getVersion(self):
+        """
+        Get the current database version, dropping the cached entries if it has changed since the last check
+        """
+        now = time.monotonic()
+        with self.lock:
+            if (
+                self.checkedAt is not None
+                and now - self.checkedAt < VERSION_CHECK_INTERVAL
+            ):
+                return self.version
+            self.checkedAt = now
+            try:
+                stat = os.stat(self.ledgerPath)
+                ledgerStamp = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                ledgerStamp = None
+            if ledgerStamp == self.ledgerStamp and self.ledgerStamp is not None:
+                return self.version
+            self.ledgerStamp = ledgerStamp
+            version = getLedgerVersion(self.ledgerPath)
+            if version != self.version:
+                if self.entries or self.version is not None:
+                    self.stats['invalidations'] += 1
+                    logger.info(
+                        'Database version changed to {}: clearing the query cache'.format(
+                            version
+                        )
+                    )
+                self.entries.clear()
+                if self.disk is not None:
+                    try:
+                        self.disk.execute(
+                            'DELETE FROM results WHERE version IS NOT ?', (version,)
+                        )
+                        self.disk.commit()
+                    except sqlite3.Error as err:
+                        self._onDiskError(err)
+                self.version = version
+            return self.version
+
+    def _isExpired(self, storedAt: float):
+        return bool(self.ttl) and time.time() - storedAt > self.ttl
+
+    def get(self, key):
+        """
+        Get a cached result
+
+        Args:
+            key (tuple): the query, e.g. ('identifier', '/us/usc/t1/s1', '01/02/2020')
+
+        Returns:
+            a copy of the cached result, or None
+        """
+        if not self.maxEntries:
+            return None
+        version = self.getVersion()
+        keyString = json.dumps(key)
+        with self.lock:
+            entry = self.entries.get(keyString)
+            if entry is not None:
+                storedAt, value = entry
+                if not self._isExpired(storedAt):
+                    self.entries.move_to_end(keyString)
+                    self.stats['hits'] += 1
+                    return copy.deepcopy(value)
+                del self.entries[keyString]
+                self.stats['expirations'] += 1
+            row = None
+            if self.disk is not None:
+                try:
+                    row = self.disk.execute(
+                        'SELECT stored_at, value FROM results WHERE key = ? AND version IS ?',
+                        (keyString, version),
+                    ).fetchone()
+                except sqlite3.Error as err:
+                    self._onDiskError(err)
+                if row and not self._isExpired(row[0]):
+                    value = json.loads(row[1])
+                    self._store(keyString, row[0], value)
+                    self.stats['diskHits'] += 1
+                    return copy.deepcopy(value)
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Cache a result. It must be serializable to JSON.
+        """
+        if not self.maxEntries:
+            return
+        version = self.getVersion()
+        keyString = json.dumps(key)
+        storedAt = time.time()
+        value = copy.deepcopy(value)
+        with self.lock:
+            if version != self.version:
+                return
+            self._store(keyString, storedAt, value)
+            if self.disk is not None:
+                try:
+                    self.disk.execute(
+                        'INSERT OR REPLACE INTO results (key, version, stored_at, value) VALUES (?, ?, ?, ?)',
+                        (keyString, version, storedAt, json.dumps(value)),
+                    )
+                    if self.diskWrites % DISK_PRUNE_WRITES == 0:
+                        self._pruneDisk(storedAt)
+                    self.disk.commit()
+                except sqlite3.Error as err:
+                    self._onDiskError(err)
+                self.diskWrites += 1
+
+    def _pruneDisk(self, now: float):
+        if self.ttl:
+            self.disk.execute(
+                'DELETE FROM results WHERE stored_at < ?', (now - self.ttl,)
+            )
+        self.disk.execute(
+            'DELETE FROM results WHERE key IN '
+            '(SELECT key FROM results ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+            (self.maxEntries,),
+        )
+
+    def _onDiskError(self, err):
+        logger.warning('Query cache file error, taken as a miss: {}'.format(err))
+        try:
+            self.disk.rollback()
+        except sqlite3.Error:
+            pass
+
+    def _store(self, keyString: str, storedAt: float, value):
+        self.entries[keyString] = (storedAt, value)
+        self.entries.move_to_end(keyString)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.disk is not None:
+                try:
+                    self.disk.execute('DELETE FROM results')
+                    self.disk.commit()
+                except sqlite3.Error as err:
+                    self._onDiskError(err)
+
+    def getStats(self):
+        """
+        Get the hit, miss, eviction, expiration and invalidation counts, with the size and database version
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.entries)
+            stats['maxEntries'] = self.maxEntries
+            stats['version'] = self.version
+        return stats
@@ -0,0 +1,417 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Refresh uscreleasepoints.json from cached copies of the release point index pages'
+
+# downloadusc.getUSCReleasePoints gets the release points from two pages of uscode.house.gov: download.shtml,
+# for the current release point, and priorreleasepoints.htm, for the others. The pages are kept under
+# USC_PAGE_CACHE_DIRPATH with their validators (ETag, Last-Modified) and sha256, and requested again with a
+# conditional GET. A page that has not changed is not parsed again: the release points parsed from it are
+# kept with it, in pages.json.
+#
+# A changed page is parsed with lxml, only for what is used: on download.shtml, the release point information;
+# on priorreleasepoints.htm, the `a.releasepoint` anchors, streamed with iterparse so that the rest of the
+# page is never built into a tree.
+#
+# The release points are merged into the existing uscreleasepoints.json, which is only written if it changes.
+#
+# Usage: python releasepointindex.py refresh
+
+import io
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+
+from lxml import etree, html
+
+try:
+    import re2 as re
+except ImportError:
+    import re
+
+try:
+    from constants import (
+        USC_HTML_PAGE_BASE,
+        USC_HTML_PAGE,
+        CURRENT_USC_HTML_PAGE,
+        USC_RP_TEXT,
+        USC_XML_TEXT,
+    )
+    from settings import getSettings
+    from metrics import span, increment
+except ImportError:
+    from loadusc.constants import (
+        USC_HTML_PAGE_BASE,
+        USC_HTML_PAGE,
+        CURRENT_USC_HTML_PAGE,
+        USC_RP_TEXT,
+        USC_XML_TEXT,
+    )
+    from loadusc.settings import getSettings
+    from loadusc.metrics import span, increment
+
+logger = logging.getLogger(__name__)
+
+PAGES_FILENAME = 'pages.json'
+# (connect, read) timeouts of the page requests
+PAGE_TIMEOUT = (30, 120)
+
+RELEASE_DATE_REGEX_COMPILED = re.compile(r'([0-9]{2}\/[0-9]{2}\/[0-9]{4})')
+# Anchors without a date like this are not release points
+RELEASEPOINT_DATE_REGEX_COMPILED = re.compile(r'([0-9]{2}\/[0-9]{2}\/[0-9]{2})')
+TITLES_AFFECTED_REGEX_COMPILED = re.compile(r'affecting\stitles?(.*)\.?$')
+HTML_EXTENSION_REGEX_COMPILED = re.compile(r'\.html?$')
+
+
+def hasClassXPath(className: str):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(
+        className
+    )
+
+
+def getElementText(element):
+    return ''.join(element.itertext())
+
+
+def getReleaseDate(text: str):
+    dateSearch = RELEASE_DATE_REGEX_COMPILED.search(text)
+    return dateSearch.group(0) if dateSearch else None
+
+
+def getTitlesAffected(text: str):
+    titlesSearch = TITLES_AFFECTED_REGEX_COMPILED.search(text)
+    if not titlesSearch:
+        logger.warning('No titles affected in: ' + text.strip())
+        return []
+    titlesAffected = (
+        titlesSearch.group(1)
+        .strip()
+        .replace('.', '')
+        .replace('and', ',')
+        .replace(' ', '')
+        .split(',')
+    )
+    return [item for item in titlesAffected if item]
+
+
+def parseCurrentReleasePoint(content: bytes):
+    """
+    Parse the current release point from download.shtml
+
+    Returns:
+        dict: the name, date, titlesAffected and url of the release point
+    """
+    root = html.fromstring(content)
+    release_date = None
+    for h3 in root.xpath('//h3[' + hasClassXPath('releasepointinformation') + ']'):
+        release_date = getReleaseDate(getElementText(h3))
+        break
+    current_name = ''
+    items = root.xpath('//div[' + hasClassXPath('uscitem') + ']')
+    if len(items) > 1:
+        for div in items[1].xpath('.//div[' + hasClassXPath('itemcurrency') + ']'):
+            current_name = getElementText(div).strip()
+            break
+    titlesAffected = [
+        (div.get('id') or '').replace('us/usc/t', '')
+        for div in root.xpath('//div[' + hasClassXPath('usctitlechanged') + ']')
+    ]
+    downloadlink = ''
+    for div in root.xpath('//div[' + hasClassXPath('itemdownloadlinks') + ']'):
+        for a in div.iter('a'):
+            downloadlink = a.get('href') or ''
+            break
+        break
+    return {
+        'name': current_name,
+        'date': release_date,
+        'titlesAffected': titlesAffected,
+        'url': USC_HTML_PAGE_BASE + downloadlink,
+    }
+
+
+def parsePriorReleasePoints(content: bytes):
+    """
+    Parse the release points linked from priorreleasepoints.htm, streaming the page for its anchors
+
+    Returns:
+        list: a dict with the name, date, titlesAffected and url of each release point, in page order
+    """
+    releasepoints = []
+    for _, a in etree.iterparse(
+        io.BytesIO(content), events=('end',), tag='a', html=True, recover=True
+    ):
+        if 'releasepoint' in (a.get('class') or '').split():
+            href = a.get('href') or ''
+            text = getElementText(a)
+            if '@' in href and RELEASEPOINT_DATE_REGEX_COMPILED.search(text):
+                releasepoints.append(
+                    {
+                        'name': href.split('@')[1].split('.')[0],
+                        'date': getReleaseDate(text),
+                        'titlesAffected': getTitlesAffected(text),
+                        'url': USC_HTML_PAGE_BASE
+                        + HTML_EXTENSION_REGEX_COMPILED.sub('.zip', href).replace(
+                            USC_RP_TEXT, USC_XML_TEXT
+                        ),
+                    }
+                )
+        # Drop what has been read, so that memory does not grow with the page
+        a.clear()
+        while a.getprevious() is not None:
+            del a.getparent()[0]
+    return releasepoints
+
+
+class PageCache:
+    """Copies of web pages with their validators, and what was parsed from them."""
+
+    def __init__(self, path: str = None):
+        self.path = path or getSettings().USC_PAGE_CACHE_DIRPATH
+        self.pagesPath = os.path.join(self.path, PAGES_FILENAME)
+        self.pages = {}
+        self.contents = {}
+        self.changed = False
+        if os.path.isfile(self.pagesPath):
+            try:
+                with open(self.pagesPath, 'r') as f:
+                    self.pages = json.load(f)
+            except (OSError, ValueError) as err:
+                logger.warning('Could not read {}: {}'.format(self.pagesPath, err))
+
+    def getContent(self, url: str):
+        if url in self.contents:
+            return self.contents[url]
+        entry = self.pages.get(url)
+        if not entry:
+            return None
+        try:
+            with open(os.path.join(self.path, entry['file']), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def hasCopy(self, url: str):
+        entry = self.pages.get(url)
+        return bool(entry) and os.path.isfile(os.path.join(self.path, entry['file']))
+
+    def fetch(self, url: str, getter):
+        """
+        Get a page, with a conditional GET if there is a copy of it, and keep the new content
+
+        Args:
+            url (str): the page
+            getter (callable): called as getter(url, headers=..., verify=DOWNLOAD_TLS_VERIFY, timeout=...),
+                e.g. requests.get
+
+        Returns:
+            bool: True if the page has changed since the copy, False if not (or if it could not be had, but
+            there is a copy), None if it could not be had and there is no copy
+        """
+        entry = self.pages.get(url) or {}
+        hasCopy = self.hasCopy(url)
+        headers = {}
+        if hasCopy:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('lastModified'):
+                headers['If-Modified-Since'] = entry['lastModified']
+        try:
+            with span('http_fetch', kind='page') as timing:
+                response = getter(
+                    url,
+                    headers=headers,
+                    verify=getSettings().DOWNLOAD_TLS_VERIFY,
+                    timeout=PAGE_TIMEOUT,
+                )
+                timing.set(status=response.status_code)
+        except Exception as err:
+            logger.error('Could not get page from: {}: {}'.format(url, err))
+            return False if hasCopy else None
+        if response.status_code == 304 and hasCopy:
+            increment('page_cache', result='notmodified')
+            return False
+        if response.status_code != 200:
+            logger.error(
+                'Could not get page from: {} ({})'.format(url, response.status_code)
+            )
+            return False if hasCopy else None
+        content = response.content
+        self.contents[url] = content
+        sha = hashlib.sha256(content).hexdigest()
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'lastModified': response.headers.get('Last-Modified'),
+        }
+        increment('download_bytes', len(content))
+        if hasCopy and sha == entry.get('sha256'):
+            increment('page_cache', result='unchanged')
+            if any(entry.get(key) != value for key, value in validators.items()):
+                entry.update(validators)
+                self.changed = True
+            return False
+        filename = entry.get('file') or (
+            hashlib.sha256(url.encode('utf-8')).hexdigest()[:16] + '.html'
+        )
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = os.path.join(self.path, filename + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, os.path.join(self.path, filename))
+        self.pages[url] = dict(
+            validators,
+            file=filename,
+            sha256=sha,
+            fetchedAt=datetime.utcnow().isoformat(),
+            # What was parsed from the old copy no longer applies
+            parsed=None,
+        )
+        self.changed = True
+        increment('page_cache', result='changed')
+        return True
+
+    def getParsed(self, url: str):
+        return (self.pages.get(url) or {}).get('parsed')
+
+    def setParsed(self, url: str, parsed):
+        if url in self.pages:
+            self.pages[url]['parsed'] = parsed
+            self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self.pagesPath + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.pages, f)
+        os.replace(tmp_path, self.pagesPath)
+        self.changed = False
+
+
+def getPageReleasePoints(pageCache: PageCache, url: str, getter, parser):
+    """
+    Get what `parser` finds in the page at `url`, parsing it only if it has changed since it was last parsed
+
+    Returns:
+        the result of `parser`, or None if the page could not be had
+    """
+    changed = pageCache.fetch(url, getter)
+    if changed is None:
+        return None
+    parsed = None if changed else pageCache.getParsed(url)
+    if parsed is None:
+        content = pageCache.getContent(url)
+        if content is None:
+            return None
+        with span('page_parse'):
+            parsed = parser(content)
+        pageCache.setParsed(url, parsed)
+    return parsed
+
+
+def mergeReleasePoints(existing, scraped):
+    """
+    Merge the release points scraped from the index pages into those of uscreleasepoints.json.
+    The scraped release points come first, in page order, updated with anything else recorded for them;
+    release points no longer listed are kept after them.
+
+    Returns:
+        list: the merged release points
+    """
+    byName = dict((item.get('name'), item) for item in existing or [])
+    merged = []
+    names = set()
+    for releasepoint in scraped:
+        name = releasepoint.get('name')
+        if name in names:
+            continue
+        names.add(name)
+        item = dict(byName.get(name) or {})
+        item.update(releasepoint)
+        merged.append(item)
+    for item in existing or []:
+        if item.get('name') not in names:
+            logger.warning(
+                'Release point no longer listed: {}'.format(item.get('name'))
+            )
+            names.add(item.get('name'))
+            merged.append(item)
+    return merged
+
+
+def refreshReleasePoints(
+    getter, writeToFile: bool = True, jsonPath: str = None, pageCachePath: str = None
+):
+    """
+    Get the release points from the index pages, parsing only the pages that have changed, and merge them
+    into uscreleasepoints.json
+
+    Args:
+        getter (callable): called as getter(url, headers=..., verify=DOWNLOAD_TLS_VERIFY, timeout=...),
+            e.g. requests.get
+        writeToFile (bool, optional): write the merged release points, if they changed. Defaults to True.
+        jsonPath (str, optional): defaults to USC_RELEASEPOINT_JSON_PATH.
+        pageCachePath (str, optional): defaults to USC_PAGE_CACHE_DIRPATH.
+
+    Returns:
+        list: the release points, the current one first, or None if a page could not be had
+    """
+    jsonPath = jsonPath or getSettings().USC_RELEASEPOINT_JSON_PATH
+    pageCache = PageCache(pageCachePath)
+    current = getPageReleasePoints(
+        pageCache,
+        USC_HTML_PAGE_BASE + CURRENT_USC_HTML_PAGE,
+        getter,
+        parseCurrentReleasePoint,
+    )
+    prior = getPageReleasePoints(
+        pageCache, USC_HTML_PAGE_BASE + USC_HTML_PAGE, getter, parsePriorReleasePoints
+    )
+    pageCache.save()
+    if current is None or prior is None:
+        return None
+
+    existing = []
+    if os.path.isfile(jsonPath):
+        try:
+            with open(jsonPath, 'r') as f:
+                existing = json.load(f)
+        except (OSError, ValueError) as err:
+            logger.warning('Could not read {}: {}'.format(jsonPath, err))
+    releasepoints = mergeReleasePoints(existing, [current] + prior)
+    if writeToFile and releasepoints != existing:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(jsonPath)), exist_ok=True)
+            tmp_path = jsonPath + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(releasepoints, f)
+            os.replace(tmp_path, jsonPath)
+        except Exception as err:
+            logger.error(str(err))
+    return releasepoints
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='loadusc.log', filemode='a', level='INFO')
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    parser = argparse.ArgumentParser(
+        description='Refresh the USC release point index.', epilog=''
+    )
+    parser.add_argument(
+        'command',
+        choices=['refresh'],
+        help='refresh: merge the release points of the index pages into uscreleasepoints.json',
+    )
+    args = parser.parse_args()
+    try:
+        from downloadusc import suppressor
+    except ImportError:
+        from loadusc.downloadusc import suppressor
+    releasepoints = refreshReleasePoints(suppressor.get)
+    if releasepoints is None:
+        sys.exit(1)
+    logger.info('{} release points'.format(len(releasepoints)))
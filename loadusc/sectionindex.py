@@ -0,0 +1,502 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Index of the sections and notes in the XML files of USC release points'
+
+# For each release point directory, every title file is parsed as a stream, and each section and notes element
+# with an identifier is recorded in a SQLite file at USC_SECTION_INDEX_PATH:
+#
+#   identifier -> (release point, file, byte offset, length in bytes, sha256 of those bytes)
+#
+# ElementTree.iterparse does not give byte offsets, so the files are parsed with expat, which does
+# (CurrentByteIndex). Files with the same content hash as a file already indexed (in the blob store, most titles
+# are the same from one release point to the next) are not parsed again: their rows are copied.
+#
+# Usage: python sectionindex.py build [release point ...]   (all the release points in uscreleasepoints.json)
+#        python sectionindex.py exists /us/usc/t1/s1 [-r release point]
+#        python sectionindex.py list /us/usc/t1/ [-r release point]
+#        python sectionindex.py history /us/usc/t1/s1
+
+import os
+import sys
+import json
+import mmap
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime
+from xml.parsers import expat
+
+try:
+    from settings import getSettings
+    from loadledger import getReleasePointHashes, RELEASEPOINT_TITLE
+except ImportError:
+    from loadusc.settings import getSettings
+    from loadusc.loadledger import getReleasePointHashes, RELEASEPOINT_TITLE
+
+logger = logging.getLogger(__name__)
+
+# Local names of the elements indexed, if they have an identifier attribute
+INDEXED_ELEMENTS = ('section', 'notes')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS releasepoints (
+    name TEXT PRIMARY KEY,
+    position INTEGER,
+    indexed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    release_point TEXT NOT NULL,
+    file TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (release_point, file)
+);
+CREATE INDEX IF NOT EXISTS files_content_hash ON files (content_hash);
+CREATE TABLE IF NOT EXISTS sections (
+    identifier TEXT NOT NULL,
+    release_point TEXT NOT NULL,
+    file TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (identifier, release_point)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sections_file ON sections (release_point, file);
+'''
+
+
+def getLocalName(name: str):
+    return name.rsplit(':', 1)[-1]
+
+
+def getTagEnd(data, index: int):
+    """
+    Get the offset just after the '>' of the tag that starts at `index`, skipping quoted attribute values,
+    which may contain '>'
+    """
+    quote = None
+    for position in range(index, len(data)):
+        char = data[position : position + 1]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in (b'"', b"'"):
+            quote = char
+        elif char == b'>':
+            return position + 1
+    raise ValueError('Unclosed tag at byte {}'.format(index))
+
+
+def getElementEnd(data, offset: int, endIndex: int):
+    """
+    Get the offset just after an element that starts at `offset`, from the CurrentByteIndex of its end event
+    """
+    startTagEnd = getTagEnd(data, offset)
+    if data[startTagEnd - 2 : startTagEnd] == b'/>':
+        return startTagEnd
+    return getTagEnd(data, endIndex)
+
+
+def scanSections(path: str):
+    """
+    Find the sections and notes of an XML file, without loading the file
+
+    Args:
+        path (str): the XML file
+
+    Returns:
+        list: (identifier, byte offset, length) of each section or notes element with an identifier,
+        in document order
+    """
+    found = []
+    open_elements = []
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+
+    def start(name, attrs):
+        identifier = attrs.get('identifier')
+        if identifier and getLocalName(name) in INDEXED_ELEMENTS:
+            open_elements.append((name, identifier, parser.CurrentByteIndex))
+        else:
+            open_elements.append(None)
+
+    def end(name):
+        element = open_elements.pop()
+        if element is None:
+            return
+        _, identifier, offset = element
+        # The start of the end tag, or the end of the element if it is empty (<section .../>)
+        found.append((identifier, offset, parser.CurrentByteIndex))
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    with open(path, 'rb') as f:
+        parser.ParseFile(f)
+    if not found:
+        return found
+    # Find where each element closes in the file, since its end tag may have whitespace before
+    # the '>' (</section >)
+    with open(path, 'rb') as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        found = [
+            (identifier, offset, getElementEnd(data, offset, endIndex) - offset)
+            for identifier, offset, endIndex in found
+        ]
+    return found
+
+
+def hashSections(path: str, sections):
+    """
+    Add the sha256 of its bytes to each (identifier, offset, length) of `sections`
+    """
+    if not sections:
+        return []
+    with open(path, 'rb') as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        return [
+            (
+                identifier,
+                offset,
+                length,
+                hashlib.sha256(data[offset : offset + length]).hexdigest(),
+            )
+            for identifier, offset, length in sections
+        ]
+
+
+class SectionIndex:
+    """Sections and notes of the release points by identifier, safe to use from several threads."""
+
+    def __init__(self, path: str = None, readonly: bool = False):
+        path = path or getSettings().USC_SECTION_INDEX_PATH
+        self.path = path
+        self.lock = threading.Lock()
+        if readonly:
+            self.connection = sqlite3.connect(
+                'file:' + path + '?mode=ro', uri=True, check_same_thread=False
+            )
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def indexReleasePoint(
+        self,
+        release_point: str,
+        position: int = None,
+        releasepointsPath: str = None,
+    ):
+        """
+        Index the title files of a release point directory that are new or have changed
+
+        Args:
+            release_point (str): the release point name, e.g. '116-140'
+            position (int, optional): its place in the load order, for getHistory. Defaults to None.
+            releasepointsPath (str, optional): the directory of the release points.
+                Defaults to USC_RELEASEPOINT_DIRPATH.
+
+        Returns:
+            dict: the number of files 'parsed', 'copied' from another release point and 'unchanged'
+        """
+        releasepointsPath = releasepointsPath or getSettings().USC_RELEASEPOINT_DIRPATH
+        dir_name = os.path.join(releasepointsPath, release_point)
+        hashes = getReleasePointHashes(release_point, releasepointsPath)
+        hashes.pop(RELEASEPOINT_TITLE, None)
+        counts = {'parsed': 0, 'copied': 0, 'unchanged': 0}
+        with self.lock:
+            indexed = dict(
+                self.connection.execute(
+                    'SELECT file, content_hash FROM files WHERE release_point = ?',
+                    (release_point,),
+                ).fetchall()
+            )
+        for relpath in sorted(set(indexed) - set(hashes)):
+            self._removeFile(release_point, relpath)
+        for relpath, content_hash in sorted(hashes.items()):
+            if indexed.get(relpath) == content_hash:
+                counts['unchanged'] += 1
+                continue
+            if self._copyFile(release_point, relpath, content_hash):
+                counts['copied'] += 1
+                continue
+            path = os.path.join(dir_name, relpath)
+            try:
+                sections = hashSections(path, scanSections(path))
+            except (expat.ExpatError, OSError, ValueError) as err:
+                logger.error('Could not index {}: {}'.format(path, err))
+                continue
+            self._storeFile(release_point, relpath, content_hash, sections)
+            counts['parsed'] += 1
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO releasepoints (name, position, indexed_at) VALUES (?, ?, ?)',
+                    (release_point, position, datetime.utcnow().isoformat()),
+                )
+        logger.info('Indexed {}: {}'.format(release_point, json.dumps(counts)))
+        return counts
+
+    def _removeFile(self, release_point: str, relpath: str):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'DELETE FROM sections WHERE release_point = ? AND file = ?',
+                    (release_point, relpath),
+                )
+                self.connection.execute(
+                    'DELETE FROM files WHERE release_point = ? AND file = ?',
+                    (release_point, relpath),
+                )
+
+    def _storeFile(self, release_point: str, relpath: str, content_hash: str, sections):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'DELETE FROM sections WHERE release_point = ? AND file = ?',
+                    (release_point, relpath),
+                )
+                # An identifier that appears twice keeps its first element
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO sections (identifier, release_point, file, offset, length, sha256) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [
+                        (identifier, release_point, relpath, offset, length, sha)
+                        for identifier, offset, length, sha in sections
+                    ],
+                )
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO files (release_point, file, content_hash) VALUES (?, ?, ?)',
+                    (release_point, relpath, content_hash),
+                )
+
+    def _copyFile(self, release_point: str, relpath: str, content_hash: str):
+        """
+        Copy the rows of a file with the same content (and name) indexed for another release point
+
+        Returns:
+            bool: True if there was one
+        """
+        if content_hash.startswith('stat:'):
+            return False
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT release_point FROM files WHERE content_hash = ? AND file = ? AND release_point != ? '
+                'LIMIT 1',
+                (content_hash, relpath, release_point),
+            ).fetchone()
+            if not row:
+                return False
+            with self.connection:
+                self.connection.execute(
+                    'DELETE FROM sections WHERE release_point = ? AND file = ?',
+                    (release_point, relpath),
+                )
+                self.connection.execute(
+                    'INSERT OR IGNORE INTO sections (identifier, release_point, file, offset, length, sha256) '
+                    'SELECT identifier, ?, file, offset, length, sha256 FROM sections '
+                    'WHERE release_point = ? AND file = ?',
+                    (release_point, row[0], relpath),
+                )
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO files (release_point, file, content_hash) VALUES (?, ?, ?)',
+                    (release_point, relpath, content_hash),
+                )
+        return True
+
+    def getLatestReleasePoint(self):
+        """
+        Get the last indexed release point in the load order, or None
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT name FROM releasepoints ORDER BY position IS NULL, position DESC, indexed_at DESC LIMIT 1'
+            ).fetchone()
+        return row[0] if row else None
+
+    def getSection(self, identifier: str, release_point: str = None):
+        """
+        Get where a section or notes element is
+
+        Args:
+            identifier (str): e.g. '/us/usc/t1/s1'
+            release_point (str, optional): the release point. Defaults to the latest indexed.
+
+        Returns:
+            dict: the 'release_point', 'file' (relative to the release point directory), 'offset', 'length'
+            and 'sha256', or None if it is not in the release point
+        """
+        release_point = release_point or self.getLatestReleasePoint()
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT release_point, file, offset, length, sha256 FROM sections '
+                'WHERE identifier = ? AND release_point = ?',
+                (identifier, release_point),
+            ).fetchone()
+        if not row:
+            return None
+        return dict(zip(('release_point', 'file', 'offset', 'length', 'sha256'), row))
+
+    def exists(self, identifier: str, release_point: str = None):
+        return self.getSection(identifier, release_point) is not None
+
+    def listPrefix(self, prefix: str, release_point: str = None):
+        """
+        List the identifiers that start with `prefix` (e.g. '/us/usc/t26/') in a release point, in order
+
+        Args:
+            prefix (str): the start of the identifiers
+            release_point (str, optional): the release point. Defaults to the latest indexed.
+
+        Returns:
+            list: the identifiers
+        """
+        release_point = release_point or self.getLatestReleasePoint()
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT identifier FROM sections WHERE identifier >= ? AND identifier < ? AND release_point = ? '
+                'ORDER BY identifier',
+                (prefix, prefix + '\U0010ffff', release_point),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def getHistory(self, identifier: str):
+        """
+        Get the release points that added, changed or removed a section or notes element, in load order
+
+        Returns:
+            list: {'release_point', 'change'} dicts, with 'change' 'added', 'modified' or 'removed'
+        """
+        with self.lock:
+            releasepoints = [
+                row[0]
+                for row in self.connection.execute(
+                    'SELECT name FROM releasepoints ORDER BY position IS NULL, position, name'
+                ).fetchall()
+            ]
+            shas = dict(
+                self.connection.execute(
+                    'SELECT release_point, sha256 FROM sections WHERE identifier = ?',
+                    (identifier,),
+                ).fetchall()
+            )
+        history = []
+        previous = None
+        for release_point in releasepoints:
+            sha = shas.get(release_point)
+            if sha != previous:
+                if previous is None:
+                    change = 'added'
+                elif sha is None:
+                    change = 'removed'
+                else:
+                    change = 'modified'
+                history.append({'release_point': release_point, 'change': change})
+            previous = sha
+        return history
+
+
+def getReleasePointOrder(releasepointJSONPath: str = None, publawsDict: str = None):
+    """
+    Get the release points in load order (see loadplan.getLoadSchedule)
+
+    Returns:
+        list: the release point names
+    """
+    try:
+        from loadplan import getReleasePointSchedule
+    except ImportError:
+        from loadusc.loadplan import getReleasePointSchedule
+
+    releasepointJSONPath = (
+        releasepointJSONPath or getSettings().USC_RELEASEPOINT_JSON_PATH
+    )
+    with open(releasepointJSONPath, 'r') as f:
+        releasepoints = json.load(f)
+    return [
+        rpname
+        for _, rpnames in getReleasePointSchedule(releasepoints, publawsDict)
+        for rpname in rpnames
+    ]
+
+
+def buildSectionIndex(
+    sectionIndex: SectionIndex,
+    releasepoints=None,
+    releasepointsPath: str = None,
+):
+    """
+    Index release points, by default all those in uscreleasepoints.json that have been downloaded
+
+    Args:
+        sectionIndex (SectionIndex): the index
+        releasepoints (list, optional): names of the release points to index. Defaults to None, for all.
+        releasepointsPath (str, optional): the directory of the release points. Defaults to USC_RELEASEPOINT_DIRPATH.
+    """
+    try:
+        order = getReleasePointOrder()
+    except (OSError, ValueError) as err:
+        if not releasepoints:
+            raise
+        logger.warning('Could not get the release point order: {}'.format(err))
+        order = []
+    releasepointsPath = releasepointsPath or getSettings().USC_RELEASEPOINT_DIRPATH
+    positions = dict((rpname, position) for position, rpname in enumerate(order))
+    for rpname in releasepoints or order:
+        if not os.path.isdir(os.path.join(releasepointsPath, rpname)):
+            logger.warning('Release point not downloaded: ' + rpname)
+            continue
+        sectionIndex.indexReleasePoint(
+            rpname, positions.get(rpname), releasepointsPath=releasepointsPath
+        )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='loadusc.log', filemode='a', level='INFO')
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    parser = argparse.ArgumentParser(
+        description='Index the sections of USC release points.', epilog=''
+    )
+    parser.add_argument(
+        'command',
+        choices=['build', 'exists', 'list', 'history'],
+        help='build: index release points; exists, list, history: look up an identifier or prefix',
+    )
+    parser.add_argument(
+        'args',
+        nargs='*',
+        help='build: release point names (default: all); otherwise the identifier or prefix',
+    )
+    parser.add_argument(
+        '-r',
+        '--releasepoint',
+        action='store',
+        dest='releasepoint',
+        default=None,
+        help='Release point to look in (default: the latest indexed)',
+    )
+    args = parser.parse_args()
+    sectionIndex = SectionIndex()
+    if args.command == 'build':
+        buildSectionIndex(sectionIndex, args.args)
+    elif args.command == 'exists':
+        for identifier in args.args:
+            print(
+                json.dumps(
+                    {identifier: sectionIndex.getSection(identifier, args.releasepoint)}
+                )
+            )
+    elif args.command == 'list':
+        for prefix in args.args:
+            for identifier in sectionIndex.listPrefix(prefix, args.releasepoint):
+                print(identifier)
+    elif args.command == 'history':
+        for identifier in args.args:
+            print(json.dumps({identifier: sectionIndex.getHistory(identifier)}))
+    sectionIndex.close()
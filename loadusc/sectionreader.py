@@ -0,0 +1,401 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Read the XML of current sections straight from the release point files'
+
+# The section index (sectionindex.py) has the byte offset and length of each section in the title files of each
+# release point. For the current version of a section, getxcite.py can then skip XCiteDB: the title file is
+# memory-mapped once and the section is a slice of it.
+#
+# This is only used for the release point loaded for the latest date in the load ledger, which must also be the
+# latest release point in the section index; for other dates, or identifiers not in the index, XCiteDB is queried.
+#
+# A slice of the file lacks the namespace declarations of the root element, which are added to it, and XCiteDB may
+# not serialize the element exactly as the file has it. So the slices are only used once `sectionreader.py verify`
+# has compared a sample of them with what XCiteDB answers, for the current release point and section index, and
+# found them the same (as canonical XML, or byte for byte on Python 3.7, which cannot canonicalize); until then,
+# and after any change, XCiteDB is queried.
+#
+# Usage: python sectionreader.py verify [-n 50]
+
+import os
+import re
+import sys
+import json
+import random
+import sqlite3
+import logging
+import argparse
+import threading
+import mmap
+from collections import OrderedDict
+from datetime import datetime
+from xml.etree.ElementTree import ParseError
+
+try:
+    from settings import getSettings
+    from sectionindex import SectionIndex, getTagEnd
+except ImportError:
+    from loadusc.settings import getSettings
+    from loadusc.sectionindex import SectionIndex, getTagEnd
+
+logger = logging.getLogger(__name__)
+
+# Title files kept memory-mapped
+MAX_OPEN_FILES = 128
+# Sections compared with XCiteDB by verify
+VERIFY_SAMPLE = 50
+
+NAMESPACE_REGEX_COMPILED = re.compile(
+    rb'''\sxmlns(?::[\w.-]+)?\s*=\s*(?:"[^"]*"|'[^']*')'''
+)
+
+
+def getRootNamespaces(data):
+    """
+    Get the namespace declarations of the root element of an XML file, e.g. [' xmlns="http://..."']
+    """
+    position = 0
+    while True:
+        position = data.find(b'<', position)
+        if position < 0:
+            return []
+        if data[position + 1 : position + 4] == b'!--':
+            position = data.find(b'-->', position) + 3
+        elif data[position + 1 : position + 2] in (b'?', b'!'):
+            position = getTagEnd(data, position)
+        else:
+            tag = data[position : getTagEnd(data, position)]
+            return [
+                ' ' + match.group(0).decode('utf-8').strip()
+                for match in NAMESPACE_REGEX_COMPILED.finditer(tag)
+            ]
+
+
+def addNamespaces(xml: str, declarations):
+    """
+    Add to the start tag of `xml` the namespace `declarations` it does not have
+    """
+    if not declarations:
+        return xml
+    nameEnd = re.search(r'[\s/>]', xml).start()
+    startTag = xml[: xml.index('>')]
+    missing = [
+        declaration
+        for declaration in declarations
+        if declaration.split('=', 1)[0].strip() + '=' not in startTag.replace(' =', '=')
+    ]
+    return xml[:nameEnd] + ''.join(missing) + xml[nameEnd:]
+
+
+def getVerificationPath(indexPath: str):
+    return indexPath + '.verified.json'
+
+
+def readVerification(indexPath: str):
+    try:
+        with open(getVerificationPath(indexPath), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def getLoadedDate(release_point: str, ledgerPath: str = None):
+    """
+    Get the date (mm/dd/yyyy) a release point was loaded for, if it loaded successfully, and the latest loaded date
+
+    Returns:
+        tuple: (date or None, latest date or None)
+    """
+    ledgerPath = ledgerPath or getSettings().LOAD_LEDGER_PATH
+    if not os.path.isfile(ledgerPath):
+        return None, None
+    connection = sqlite3.connect('file:' + ledgerPath + '?mode=ro', uri=True)
+    try:
+        row = connection.execute(
+            'SELECT date FROM loads WHERE release_point = ? AND exit_code = 0 LIMIT 1',
+            (release_point,),
+        ).fetchone()
+        latest = connection.execute(
+            'SELECT date FROM loads WHERE exit_code = 0 ORDER BY date_ord DESC LIMIT 1'
+        ).fetchone()
+    finally:
+        connection.close()
+    return (row[0] if row else None), (latest[0] if latest else None)
+
+
+class SectionReader:
+    """Slices of memory-mapped title files, by section identifier. Thread-safe."""
+
+    def __init__(
+        self,
+        indexPath: str = None,
+        ledgerPath: str = None,
+        releasepointsPath: str = None,
+    ):
+        settings = getSettings()
+        self.indexPath = indexPath or settings.USC_SECTION_INDEX_PATH
+        self.ledgerPath = ledgerPath or settings.LOAD_LEDGER_PATH
+        self.releasepointsPath = releasepointsPath or settings.USC_RELEASEPOINT_DIRPATH
+        self.lock = threading.Lock()
+        self.index = None
+        self.version = None
+        self.current = None
+        self.maps = OrderedDict()
+        self.namespaces = {}
+
+    def getCurrent(self, version=None):
+        """
+        Get the current release point and the date it was loaded for, checking again when `version` changes
+
+        Returns:
+            tuple: (release point, date mm/dd/yyyy), or None if the section index does not have the release point
+            loaded for the latest date
+        """
+        try:
+            # Rebuilding the section index also changes the current release point
+            version = (version, os.stat(self.indexPath).st_mtime_ns)
+        except OSError:
+            return None
+        with self.lock:
+            if self.index is not None and version == self.version:
+                return self.current
+            self.version = version
+            self.current = None
+            try:
+                if self.index is None:
+                    self.index = SectionIndex(self.indexPath, readonly=True)
+                release_point = self.index.getLatestReleasePoint()
+                if release_point:
+                    date, latest = getLoadedDate(release_point, self.ledgerPath)
+                    if date and date == latest:
+                        self.current = (release_point, date)
+                if self.current and not self.isVerified(release_point, version[1]):
+                    logger.warning(
+                        'Not reading sections from the files of {}: run sectionreader.py verify'.format(
+                            release_point
+                        )
+                    )
+                    self.current = None
+            except sqlite3.Error as err:
+                logger.warning('Could not read the section index: {}'.format(err))
+                self.index = None
+            return self.current
+
+    def isVerified(self, release_point: str, indexMtime: int):
+        """
+        Whether verify found the sections of `release_point` the same as XCiteDB has them, with this section index
+        """
+        verification = readVerification(self.indexPath)
+        return bool(
+            verification
+            and verification.get('releasePoint') == release_point
+            and verification.get('indexMtimeNs') == indexMtime
+            and verification.get('checked')
+            and not verification.get('mismatched')
+        )
+
+    def _getMap(self, path: str):
+        stat = os.stat(path)
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            item = self.maps.get(path)
+            if item is not None and item[0] == key:
+                self.maps.move_to_end(path)
+                return item[1]
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[path] = (key, data)
+            self.namespaces[path] = getRootNamespaces(data)
+            while len(self.maps) > MAX_OPEN_FILES:
+                oldPath, (_, old) = self.maps.popitem(last=False)
+                self.namespaces.pop(oldPath, None)
+                try:
+                    old.close()
+                except BufferError:
+                    # A slice of it is still in use; it is unmapped when that is released
+                    pass
+            return data
+
+    def getSectionView(self, identifier: str, release_point: str):
+        """
+        Get the XML of a section or notes element in a release point, without copying it
+
+        Args:
+            identifier (str): e.g. '/us/usc/t1/s1'
+            release_point (str): the release point
+
+        Returns:
+            memoryview: the bytes of the element in the title file, or None if it is not in the section index
+        """
+        if self.index is None:
+            return None
+        try:
+            section = self.index.getSection(identifier, release_point)
+        except sqlite3.Error as err:
+            logger.warning('Could not read the section index: {}'.format(err))
+            return None
+        if section is None:
+            return None
+        path = os.path.join(self.releasepointsPath, release_point, section['file'])
+        try:
+            data = self._getMap(path)
+        except (OSError, ValueError) as err:
+            logger.warning('Could not map {}: {}'.format(path, err))
+            return None
+        start = section['offset']
+        end = start + section['length']
+        # The file may have been replaced since it was indexed: check that the element is still there
+        head = data[start : min(end, start + 512)]
+        if (
+            not head.startswith(b'<')
+            or (b'identifier="' + identifier.encode('utf-8') + b'"') not in head
+        ):
+            logger.warning('Section index out of date for ' + path)
+            return None
+        return memoryview(data)[start:end]
+
+    def getSectionXML(self, identifier: str, release_point: str):
+        """
+        Get the XML of a section or notes element in a release point, with the namespace declarations of the root
+        element of its file. Decoding the slice copies it once.
+
+        Returns:
+            str: the XML, or None if it is not in the section index
+        """
+        view = self.getSectionView(identifier, release_point)
+        if view is None:
+            return None
+        section = self.index.getSection(identifier, release_point)
+        path = os.path.join(self.releasepointsPath, release_point, section['file'])
+        return addNamespaces(str(view, 'utf-8'), self.namespaces.get(path))
+
+    def getCurrentSection(self, identifier: str, date: str, version=None):
+        """
+        Get the XML of a section at `date`, if that is the date of the current release point and its sections
+        were verified against XCiteDB
+
+        Args:
+            identifier (str): e.g. '/us/usc/t1/s1'
+            date (str): the effective date queried, mm/dd/yyyy
+            version (str, optional): the database version (querycache.getLedgerVersion). Defaults to None.
+
+        Returns:
+            str: the XML (see getSectionXML), or None if XCiteDB must be queried
+        """
+        current = self.getCurrent(version)
+        if current is None or current[1] != date:
+            return None
+        return self.getSectionXML(identifier, current[0])
+
+
+def getCanonical(xml: str):
+    """
+    Get the canonical XML (C14N 2.0) of `xml`, or None if it cannot be parsed, or on Python 3.7, which has no
+    canonicalize: there, only sections identical to XCiteDB's answers count as verified
+    """
+    try:
+        from xml.etree.ElementTree import canonicalize
+    except ImportError:
+        return None
+    try:
+        return canonicalize(xml_data=xml)
+    except ParseError:
+        return None
+
+
+def verifySections(reader: SectionReader, count: int = VERIFY_SAMPLE, runQuery=None):
+    """
+    Compare a sample of the sections of the release point loaded for the latest date with what XCiteDB answers
+    for them, and record the result, which getCurrentSection requires
+
+    Args:
+        reader (SectionReader): the reader, with its section index and ledger
+        count (int, optional): sections compared. Defaults to VERIFY_SAMPLE.
+        runQuery (callable, optional): getxcite.runQuery, or a stand-in. Defaults to None.
+
+    Returns:
+        dict: the 'releasePoint', 'date', sections 'checked', 'identical' and 'equivalent' (the same as canonical
+        XML), and the identifiers 'mismatched'; None if there is no current release point in the section index
+    """
+    if runQuery is None:
+        try:
+            from getxcite import runQuery
+        except ImportError:
+            from loadusc.getxcite import runQuery
+
+    if reader.index is None:
+        reader.index = SectionIndex(reader.indexPath, readonly=True)
+    release_point = reader.index.getLatestReleasePoint()
+    date, latest = (
+        getLoadedDate(release_point, reader.ledgerPath)
+        if release_point
+        else (None, None)
+    )
+    if not date or date != latest:
+        return None
+    indexMtime = os.stat(reader.indexPath).st_mtime_ns
+    identifiers = reader.index.listPrefix('/us/usc/', release_point)
+    result = {
+        'releasePoint': release_point,
+        'date': date,
+        'indexMtimeNs': indexMtime,
+        'checked': 0,
+        'identical': 0,
+        'equivalent': 0,
+        'mismatched': [],
+    }
+    for identifier in random.sample(identifiers, min(count, len(identifiers))):
+        xml = reader.getSectionXML(identifier, release_point)
+        stdout, stderr = runQuery(['-date', date, 'query', '-match', identifier])
+        try:
+            answers = json.loads(stdout) if stdout else []
+        except ValueError:
+            answers = []
+        result['checked'] += 1
+        if xml is not None and answers[:1] == [xml]:
+            result['identical'] += 1
+        elif (
+            xml is not None
+            and len(answers) == 1
+            and getCanonical(xml) is not None
+            and (getCanonical(xml) == getCanonical(answers[0]))
+        ):
+            result['equivalent'] += 1
+        else:
+            result['mismatched'].append(identifier)
+    result['verifiedAt'] = datetime.utcnow().isoformat()
+    path = getVerificationPath(reader.indexPath)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(result, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return result
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='loadusc.log', filemode='a', level='INFO')
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    parser = argparse.ArgumentParser(
+        description='Check the sections read from the release point files against XCiteDB.',
+        epilog='',
+    )
+    parser.add_argument(
+        'command',
+        choices=['verify'],
+        help='verify: compare a sample of sections with XCiteDB',
+    )
+    parser.add_argument(
+        '-n',
+        '--count',
+        type=int,
+        default=VERIFY_SAMPLE,
+        help='sections to compare (default: %(default)s)',
+    )
+    args = parser.parse_args()
+    result = verifySections(SectionReader(), args.count)
+    if result is None:
+        print(
+            'The section index does not have the release point loaded for the latest date'
+        )
+        sys.exit(1)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if result['mismatched'] or not result['checked'] else 0)
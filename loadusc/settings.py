@@ -0,0 +1,561 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Settings of loadusc, resolved lazily from the environment and loadusc-xcitedb.toml'
+
+# Nothing is read when this module, or constants.py, is imported. Each setting is resolved and checked the first
+# time it is read, from getSettings() (or constants.py), and then kept: a process that only queries XCiteDB does not
+# need the data directory, nor MAIN_ROOT_PATH if XCITEDBPATH is set. validate() checks them all, for the command
+# line tools that download and load. Each setting is taken from, in order:
+#
+#   1. overrides: configure(XMLDBPATH='/other/xmldb') for the process, or getSettings().replace(...) for one
+#      query (see getxcite.runQuery)
+#   2. its environment variable, as before (e.g. LOADUSC_LOAD_WORKERS for LOAD_WORKERS)
+#   3. the [loadusc] table of loadusc-xcitedb.toml, by setting name (e.g. XCITEDB_BATCH_WORKERS = 4); the file is
+#      LOADUSC_CONFIG_PATH, or loadusc-xcitedb.toml in the working directory or beside the package
+#   4. the default, derived from MAIN_ROOT_PATH or DATA_PATH for paths
+#
+# Reading a TOML file needs Python 3.11 (tomllib), or tomli or toml installed; without them, the file is ignored.
+
+import os
+import logging
+import threading
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        try:
+            import toml as tomllib
+        except ImportError:
+            tomllib = None
+
+try:
+    from constants import LOADUSC_XCiteDBConstants
+except ImportError:
+    from loadusc.constants import LOADUSC_XCiteDBConstants
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILENAME = 'loadusc-xcitedb.toml'
+CONFIG_TABLE = 'loadusc'
+TRUE_VALUES = ('1', 'true', 'True')
+FALSE_VALUES = ('', '0', 'false', 'False')
+
+SETTING_NAMES = (
+    'MAIN_ROOT_PATH',
+    'LOADUSC_XCiteDB_ENV_NAME',
+    'XCITEDBPATH',
+    'XMLDBPATH',
+    'XCITEDB_QUERY_TIMEOUT',
+    'XCITEDB_BATCH_WORKERS',
+    'XCITEDB_ASYNC_CONCURRENCY',
+    'XCITEDB_SECTION_FAST_PATH',
+    'XCITEDB_QUERY_CACHE_SIZE',
+    'XCITEDB_QUERY_CACHE_TTL',
+    'XCITEDB_QUERY_CACHE_PATH',
+    'LOAD_WORKERS',
+    'LOAD_TIMEOUT',
+    'LOAD_CONCURRENT_WRITES',
+    'LOAD_LEDGER_PATH',
+    'CHANGE_INDEX_PATH',
+    'DATA_PATH',
+    'DOCCONFIGPATH',
+    'META_JSON_PATH',
+    'PUBLAWS_DICT_JSON_PATH',
+    'PUBLAW_STORE_PATH',
+    'USC_RELEASEPOINT_DIRPATH',
+    'USC_RELEASEPOINT_JSON_PATH',
+    'USC_SYNC_MANIFEST_PATH',
+    'USC_BLOBSTORE_DIRPATH',
+    'USC_EXTRACT_INDEX_PATH',
+    'USC_SECTION_INDEX_PATH',
+    'USC_PAGE_CACHE_DIRPATH',
+    'DOWNLOAD_WORKERS',
+    'DOWNLOAD_PER_HOST_MAX',
+    'DOWNLOAD_TLS_VERIFY',
+    'EXTRACT_MODE',
+    'BLOBSTORE_COMPRESS',
+    'METRICS_EXPORT',
+    'METRICS_DIRPATH',
+    'METRICS_FLUSH_INTERVAL',
+)
+
+
+class SettingsError(Exception):
+    """A setting is missing or not valid."""
+
+
+def toBool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value) in TRUE_VALUES
+
+
+def toVerify(value):
+    if isinstance(value, bool):
+        return value
+    if str(value) in TRUE_VALUES:
+        return True
+    if str(value) in FALSE_VALUES:
+        return False
+    return str(value)
+
+
+def toNames(value):
+    if isinstance(value, str):
+        return [name.strip() for name in value.split(',') if name.strip()]
+    return [str(name) for name in value]
+
+
+def checkPositive(name: str, value):
+    if value <= 0:
+        raise SettingsError(name + ' must be positive')
+
+
+def checkNotNegative(name: str, value):
+    if value < 0:
+        raise SettingsError(name + ' must not be negative')
+
+
+def checkVerify(name: str, value):
+    if isinstance(value, str) and not os.path.exists(value):
+        raise SettingsError(
+            name + ' must be true, false or a CA bundle file or directory, not ' + value
+        )
+
+
+def checkExtractMode(name: str, value):
+    if value not in ('link', 'all'):
+        raise SettingsError("EXTRACT_MODE must be 'link' or 'all', not " + value)
+
+
+def checkMetricsExport(name: str, value):
+    for export in value:
+        if export not in ('prometheus', 'jsonl'):
+            raise SettingsError(
+                "METRICS_EXPORT must name 'prometheus' or 'jsonl', not " + export
+            )
+
+
+def getConfigPath():
+    """
+    Get the path of the TOML settings file: LOADUSC_CONFIG_PATH, or loadusc-xcitedb.toml in the working directory
+    or beside the package. None if there is none.
+    """
+    path = os.getenv('LOADUSC_CONFIG_PATH')
+    if path:
+        return path
+    for dirpath in (
+        os.getcwd(),
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ):
+        path = os.path.join(dirpath, CONFIG_FILENAME)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def readConfigFile(path: str):
+    """
+    Read the [loadusc] table of a TOML settings file
+
+    Returns:
+        dict: the settings in the table, by name; empty if there is no file or table
+    """
+    if not path or not os.path.isfile(path):
+        return {}
+    if tomllib is None:
+        logger.warning(
+            'Not reading {}: install tomli or toml to read TOML settings'.format(path)
+        )
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = tomllib.loads(f.read())
+    except (OSError, ValueError) as err:
+        raise SettingsError('Could not read {}: {}'.format(path, err))
+    table = config.get(CONFIG_TABLE) or {}
+    unknown = [name for name in table if name not in SETTING_NAMES]
+    if unknown:
+        raise SettingsError(
+            'Unknown settings in {}: {}'.format(path, ', '.join(sorted(unknown)))
+        )
+    return table
+
+
+class Settings:
+    """
+    The settings, as attributes named like the constants (e.g. settings.XMLDBPATH), each resolved when first read.
+    The overrides are resolved at once, so that an invalid one raises here. Do not modify: use replace() for
+    different settings.
+    """
+
+    def __init__(self, overrides: dict = None, configPath: str = None):
+        self.overrides = dict(overrides or {})
+        unknown = [name for name in self.overrides if name not in SETTING_NAMES]
+        if unknown:
+            raise SettingsError('Unknown settings: ' + ', '.join(sorted(unknown)))
+        self.configPath = configPath if configPath is not None else getConfigPath()
+        self.fileSettings = readConfigFile(self.configPath)
+        # {name: (envName, default, convert, check)}
+        self.definitions = {}
+        self._define()
+        for name in self.overrides:
+            getattr(self, name)
+
+    def __getattr__(self, name: str):
+        # Only called for the attributes not set yet: the settings not resolved yet
+        definition = self.__dict__.get('definitions', {}).get(name)
+        if definition is None:
+            raise AttributeError(
+                '{!r} object has no attribute {!r}'.format(type(self).__name__, name)
+            )
+        return self._resolveSetting(name, *definition)
+
+    def _get(
+        self, name: str, envName: str = None, default=None, convert=None, check=None
+    ):
+        self.definitions[name] = (envName, default, convert, check)
+
+    def _resolveSetting(self, name: str, envName, default, convert, check):
+        if name in self.overrides:
+            value = self.overrides[name]
+        elif envName and envName in os.environ:
+            value = os.environ[envName]
+        elif name in self.fileSettings:
+            value = self.fileSettings[name]
+        else:
+            value = default() if callable(default) else default
+        if convert is not None and value is not None:
+            try:
+                value = convert(value)
+            except (TypeError, ValueError):
+                raise SettingsError('{} is not valid: {!r}'.format(name, value))
+        if check is not None and value is not None:
+            check(name, value)
+        setattr(self, name, value)
+        return value
+
+    def _getMainRootPath(self):
+        if not self.MAIN_ROOT_PATH:
+            raise SettingsError(
+                'MAIN_ROOT_PATH must be set, unless LOADUSC_XCiteDB_ENV_NAME is '
+                + LOADUSC_XCiteDBConstants.ENV_NAME.value
+            )
+        return self.MAIN_ROOT_PATH
+
+    def getXMLDBDirPath(self):
+        return os.path.dirname(os.path.abspath(self.XMLDBPATH))
+
+    def _define(self):
+        # Root path for XCiteDB
+        self._get('MAIN_ROOT_PATH', 'MAIN_ROOT_PATH')
+        self._get('LOADUSC_XCiteDB_ENV_NAME', 'LOADUSC_XCiteDB_ENV_NAME', 'dev_local')
+        isDocker = (
+            self.LOADUSC_XCiteDB_ENV_NAME == LOADUSC_XCiteDBConstants.ENV_NAME.value
+        )
+        self._get(
+            'XCITEDBPATH',
+            'XCITEDB_TOOL_PATH' if isDocker else None,
+            (lambda: '/var/XCiteDB/XCiteDB/bin/Release/XCiteDB')
+            if isDocker
+            else (
+                lambda: os.path.abspath(
+                    os.path.join(
+                        self._getMainRootPath(),
+                        'XCiteDB',
+                        'XCiteDB',
+                        'bin',
+                        'Release',
+                        'XCiteDB',
+                    )
+                )
+            ),
+        )
+        self._get('XMLDBPATH', 'XMLDBPATH', '/xml_dbs/xmldb')
+        # Timeout, in seconds, of one XCiteDB query (getxcite.py)
+        self._get('XCITEDB_QUERY_TIMEOUT', None, 60, float, checkPositive)
+        # Queries run at the same time by getxcite.getIdentifiers
+        self._get(
+            'XCITEDB_BATCH_WORKERS', 'XCITEDB_BATCH_WORKERS', 4, int, checkPositive
+        )
+        # Queries run at the same time by the async functions of getxcite.py, across all callers in an event loop
+        self._get(
+            'XCITEDB_ASYNC_CONCURRENCY',
+            'XCITEDB_ASYNC_CONCURRENCY',
+            8,
+            int,
+            checkPositive,
+        )
+        # Read current sections from the release point files, with the section index (see sectionreader.py),
+        # instead of querying XCiteDB
+        self._get(
+            'XCITEDB_SECTION_FAST_PATH', 'XCITEDB_SECTION_FAST_PATH', False, toBool
+        )
+        # Query results cached in memory by getxcite.py (see querycache.py); 0 disables the cache
+        self._get(
+            'XCITEDB_QUERY_CACHE_SIZE',
+            'XCITEDB_QUERY_CACHE_SIZE',
+            1024,
+            int,
+            checkNotNegative,
+        )
+        # Seconds a cached query result is kept; 0 keeps it until a new load is recorded in the load ledger
+        self._get(
+            'XCITEDB_QUERY_CACHE_TTL',
+            'XCITEDB_QUERY_CACHE_TTL',
+            3600,
+            float,
+            checkNotNegative,
+        )
+        # SQLite file for a second, on-disk tier of the query cache; empty for none
+        self._get('XCITEDB_QUERY_CACHE_PATH', 'XCITEDB_QUERY_CACHE_PATH', '')
+        # Number of title files loaded into XCiteDB at the same time (loaduscxcite.py --mode title)
+        self._get('LOAD_WORKERS', 'LOADUSC_LOAD_WORKERS', 1, int, checkPositive)
+        # Timeout, in seconds, of one XCiteDB load-xml
+        self._get('LOAD_TIMEOUT', None, 600, int, checkPositive)
+        # Let the load-xml of title mode write to XMLDBPATH at the same time. XCiteDB does not document that a
+        # database can have several writers, so by default they run one at a time
+        self._get(
+            'LOAD_CONCURRENT_WRITES', 'LOADUSC_LOAD_CONCURRENT_WRITES', False, toBool
+        )
+        # Record of the release points and titles loaded into XMLDBPATH (see loadledger.py)
+        self._get(
+            'LOAD_LEDGER_PATH',
+            'LOAD_LEDGER_PATH',
+            lambda: os.path.join(self.getXMLDBDirPath(), 'loadusc_ledger.sqlite'),
+        )
+        # Index of the XCiteDB change log, filled as release points are loaded (see changeindex.py); empty for none
+        self._get(
+            'CHANGE_INDEX_PATH',
+            'CHANGE_INDEX_PATH',
+            lambda: os.path.join(self.getXMLDBDirPath(), 'loadusc_changes.sqlite'),
+        )
+
+        self._get(
+            'DATA_PATH',
+            'DATA_PATH' if isDocker else None,
+            (lambda: '/public/loadusc/data')
+            if isDocker
+            else (lambda: os.path.join(self._getMainRootPath(), 'loadusc', 'data')),
+        )
+        self._get(
+            'DOCCONFIGPATH',
+            None,
+            (
+                lambda: os.path.abspath(
+                    os.path.join(
+                        self._getMainRootPath(),
+                        'House-Amendment-Parse',
+                        'natparser',
+                        'src',
+                        'document.conf',
+                    )
+                )
+            )
+            if isDocker
+            else (
+                lambda: os.path.abspath(os.path.join(self.DATA_PATH, 'document.conf'))
+            ),
+        )
+        self._get(
+            'META_JSON_PATH',
+            None,
+            lambda: os.path.join(self.DATA_PATH, 'billmeta.json'),
+        )
+        self._get(
+            'PUBLAWS_DICT_JSON_PATH',
+            None,
+            lambda: os.path.join(self.DATA_PATH, 'publawsDict.json'),
+        )
+        # Public law dates and bills, built from billmeta.json (see publawstore.py)
+        self._get(
+            'PUBLAW_STORE_PATH',
+            None,
+            lambda: os.path.join(self.DATA_PATH, 'publaws.sqlite'),
+        )
+
+        self._get(
+            'USC_RELEASEPOINT_DIRPATH',
+            None,
+            (lambda: os.path.abspath(os.path.join(self.DATA_PATH, 'USC_RELEASEPOINTS')))
+            if isDocker
+            else (
+                lambda: os.path.abspath(
+                    os.path.join(self._getMainRootPath(), 'USC_RELEASEPOINTS')
+                )
+            ),
+        )
+        self._get(
+            'USC_RELEASEPOINT_JSON_PATH',
+            None,
+            lambda: os.path.join(
+                self.USC_RELEASEPOINT_DIRPATH, 'uscreleasepoints.json'
+            ),
+        )
+        # Record of the validators, checksums and extraction status of each downloaded releasepoint title
+        self._get(
+            'USC_SYNC_MANIFEST_PATH',
+            None,
+            lambda: os.path.join(self.USC_RELEASEPOINT_DIRPATH, 'uscsyncmanifest.json'),
+        )
+        # Content-addressed store of release point files (see blobstore.py)
+        self._get(
+            'USC_BLOBSTORE_DIRPATH',
+            None,
+            lambda: os.path.join(self.USC_RELEASEPOINT_DIRPATH, '.blobs'),
+        )
+        # Index of blobs by the CRC32 and size of their zip member, to link unchanged files without decompressing them
+        self._get(
+            'USC_EXTRACT_INDEX_PATH',
+            None,
+            lambda: os.path.join(self.USC_RELEASEPOINT_DIRPATH, 'uscextractindex.json'),
+        )
+        # Index of the sections and notes in the release point files, by identifier (see sectionindex.py)
+        self._get(
+            'USC_SECTION_INDEX_PATH',
+            None,
+            lambda: os.path.join(
+                self.USC_RELEASEPOINT_DIRPATH, 'uscsectionindex.sqlite'
+            ),
+        )
+        # Copies of the release point index pages, with their validators (see releasepointindex.py)
+        self._get(
+            'USC_PAGE_CACHE_DIRPATH',
+            None,
+            lambda: os.path.join(self.USC_RELEASEPOINT_DIRPATH, '.pages'),
+        )
+
+        # Concurrency for release point downloads; 1 keeps the original sequential behavior
+        self._get('DOWNLOAD_WORKERS', 'LOADUSC_DOWNLOAD_WORKERS', 1, int, checkPositive)
+        # Maximum simultaneous connections to a single host (e.g. uscode.house.gov)
+        self._get(
+            'DOWNLOAD_PER_HOST_MAX',
+            'LOADUSC_DOWNLOAD_PER_HOST_MAX',
+            4,
+            int,
+            checkPositive,
+        )
+        # Check the TLS certificate of the download hosts: true, false, or the path of a CA bundle (file or
+        # directory) to check it against, e.g. for a host with a self-signed certificate
+        self._get(
+            'DOWNLOAD_TLS_VERIFY',
+            'LOADUSC_DOWNLOAD_TLS_VERIFY',
+            True,
+            toVerify,
+            checkVerify,
+        )
+        # 'link' stores extracted files in the blob store and hard-links them into release point directories;
+        # 'all' writes every file
+        self._get(
+            'EXTRACT_MODE', 'LOADUSC_EXTRACT_MODE', 'link', None, checkExtractMode
+        )
+        # Gzip blobs in the store. Compressed blobs cannot be hard-linked: release point directories get
+        # decompressed copies, which can be removed after loading (blobstore.py prune) and recreated
+        # (blobstore.py materialize)
+        self._get('BLOBSTORE_COMPRESS', 'LOADUSC_BLOBSTORE_COMPRESS', False, toBool)
+        # Exports of the timings and counters of metrics.py: 'prometheus', 'jsonl' or both ('prometheus,jsonl');
+        # empty to record nothing
+        self._get(
+            'METRICS_EXPORT', 'LOADUSC_METRICS_EXPORT', '', toNames, checkMetricsExport
+        )
+        # Directory of the exported metrics files, one per process (e.g. the textfile directory of node_exporter)
+        self._get(
+            'METRICS_DIRPATH',
+            'LOADUSC_METRICS_DIRPATH',
+            lambda: os.path.join(self.DATA_PATH, 'metrics'),
+        )
+        # Seconds between exports of a running process, by a background thread; 0 exports only when it exits
+        self._get(
+            'METRICS_FLUSH_INTERVAL',
+            'LOADUSC_METRICS_FLUSH_INTERVAL',
+            60,
+            float,
+            checkNotNegative,
+        )
+
+    def validate(self):
+        """
+        Resolve and check every setting, and check that the data directory exists, as the command line tools that
+        download and load need
+
+        Raises:
+            SettingsError: if a setting is missing or not valid, or the data directory does not exist
+        """
+        for name in SETTING_NAMES:
+            getattr(self, name)
+        if not os.path.isdir(self.DATA_PATH):
+            raise SettingsError(
+                'The data directory not found at:' + self.DATA_PATH + '.'
+            )
+        return self
+
+    def replace(self, **overrides):
+        """
+        Get settings with `overrides` on top of these, e.g. for one query
+
+        Returns:
+            Settings: the new settings
+        """
+        merged = dict(self.overrides)
+        merged.update(overrides)
+        return Settings(merged, self.configPath)
+
+    def asDict(self):
+        return {name: getattr(self, name) for name in SETTING_NAMES}
+
+
+settingsLock = threading.Lock()
+# Overrides of the process-wide settings, set by configure()
+settingsOverrides = {}
+processSettings = None
+
+
+def getSettings():
+    """
+    Get the process-wide settings. Each one is resolved and checked when first read, and raises SettingsError
+    then if it is missing or not valid.
+
+    Raises:
+        SettingsError: if the settings file or an override is not valid
+    """
+    global processSettings
+    settings = processSettings
+    if settings is not None:
+        return settings
+    with settingsLock:
+        if processSettings is None:
+            processSettings = Settings(settingsOverrides)
+        return processSettings
+
+
+def configure(**overrides):
+    """
+    Override process-wide settings, e.g. configure(XMLDBPATH='/other/xmldb', XCITEDB_BATCH_WORKERS=8).
+    Call it before the first query: objects already created with the previous settings (the caches of
+    getxcite.py) keep them.
+
+    Returns:
+        Settings: the new process-wide settings
+    """
+    global processSettings
+    with settingsLock:
+        merged = dict(settingsOverrides)
+        merged.update(overrides)
+        settings = Settings(merged)
+        settingsOverrides.clear()
+        settingsOverrides.update(merged)
+        processSettings = settings
+    return settings
+
+
+def resetSettings():
+    """
+    Drop the overrides and resolved settings, so that they are resolved again (e.g. after the environment changed)
+    """
+    global processSettings
+    with settingsLock:
+        settingsOverrides.clear()
+        processSettings = None
@@ -0,0 +1,354 @@
+#!python3
+# -*- coding: utf-8 -*-
+'Download and load only the USC release points that are new or changed, in one pipelined pass'
+
+# Usage: loadusc sync (or python sync.py sync)
+#
+# 1. Scrape the release point index pages (downloadusc.getUSCReleasePoints).
+# 2. Work out the title zips to download from the sync manifest: new or incomplete titles,
+#    and conditional GETs for the current release point.
+#    If there are only conditional GETs and they find nothing new, and the load ledger and the manifest show every
+#    release point loaded and no failed load, the run stops there, without reading the public law store or the
+#    release point files.
+# 3. Download them on a thread pool, oldest release point first.
+# 4. Meanwhile, load the dates in chronological order: each date is loaded as soon as the downloads
+#    of its release points have finished, and skipped if the load ledger shows it was already loaded
+#    from the same content. Loading stops at the first date whose downloads or loads failed.
+
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    from settings import getSettings
+    from downloadusc import (
+        DownloadStats,
+        ExtractIndex,
+        ReleasepointSaver,
+        SyncManifest,
+        configureDownloads,
+        getAndUnzipTitle,
+        getDownloadJobs,
+        getUSCReleasePoints,
+    )
+    from loaduscxcite import loadDate, logSlowestTitles
+    from loadplan import getReleasePointSchedule
+    from loadledger import LoadLedger
+    from changeindex import ChangeIndex, updateChangeIndex
+except ImportError:
+    from loadusc.settings import getSettings
+    from loadusc.downloadusc import (
+        DownloadStats,
+        ExtractIndex,
+        ReleasepointSaver,
+        SyncManifest,
+        configureDownloads,
+        getAndUnzipTitle,
+        getDownloadJobs,
+        getUSCReleasePoints,
+    )
+    from loadusc.loaduscxcite import loadDate, logSlowestTitles
+    from loadusc.loadplan import getReleasePointSchedule
+    from loadusc.loadledger import LoadLedger
+    from loadusc.changeindex import ChangeIndex, updateChangeIndex
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+
+def hasPendingLoads(releasepoints, manifest: SyncManifest, ledger: LoadLedger):
+    """
+    Check whether a run may have something to load without downloading anything: a load that failed or did not
+    finish, or a release point of the index that a sync has neither loaded nor left out of its schedule.
+    Only the ledger and the sync manifest are read, not the release point files.
+    """
+    if ledger.hasFailedLoads():
+        return True
+    ledgerLoaded = ledger.getLoadedReleasePoints()
+    for releasepoint in releasepoints:
+        name = releasepoint.get('name')
+        if not releasepoint.get('url'):
+            continue
+        status = manifest.getLoadStatus(name)
+        if status == 'unscheduled':
+            continue
+        if status != 'loaded' or name not in ledgerLoaded:
+            return True
+    return False
+
+
+def syncUSC(
+    workers: int = None,
+    perHostMax: int = None,
+    extractMode: str = None,
+    loadMode: str = 'releasepoint',
+    loadWorkers: int = None,
+    ledgerPath: str = None,
+    publawsDict: str = None,
+    reconcile: bool = False,
+    changeIndexPath: str = None,
+):
+    """
+    Download the new or changed release point titles and load them into XCiteDB as each release point is ready
+
+    Args:
+        workers (int, optional): number of zips to download at the same time. Defaults to None, for DOWNLOAD_WORKERS.
+        perHostMax (int, optional): maximum simultaneous downloads from one host. Defaults to None, for
+            DOWNLOAD_PER_HOST_MAX.
+        extractMode (str, optional): 'link' (blob store) or 'all'. Defaults to None, for EXTRACT_MODE.
+        loadMode (str, optional): 'releasepoint' or 'title', as in loaduscxcite.py. Defaults to 'releasepoint'.
+        loadWorkers (int, optional): titles loaded at the same time, in 'title' mode. Defaults to None, for
+            LOAD_WORKERS.
+        ledgerPath (str, optional): the load ledger. Defaults to None, for LOAD_LEDGER_PATH.
+        publawsDict (str, optional): path to a publawsDict.json to use instead of the public law store.
+            Defaults to None.
+        reconcile (bool, optional): check the XCiteDB log for dates not in the ledger. Defaults to False.
+        changeIndexPath (str, optional): the index of the XCiteDB change log, updated as dates are loaded.
+            '' not to index. Defaults to None, for CHANGE_INDEX_PATH.
+
+    Returns:
+        dict: the number of title zips 'downloaded' and 'failedDownloads', of dates 'loaded' and 'skipped', of
+        loads that failed ('failedLoads'), and the run time in 'seconds'
+    """
+    settings = getSettings()
+    workers = workers or settings.DOWNLOAD_WORKERS
+    perHostMax = perHostMax or settings.DOWNLOAD_PER_HOST_MAX
+    extractMode = extractMode or settings.EXTRACT_MODE
+    loadWorkers = loadWorkers or settings.LOAD_WORKERS
+    ledgerPath = ledgerPath or settings.LOAD_LEDGER_PATH
+    if changeIndexPath is None:
+        changeIndexPath = settings.CHANGE_INDEX_PATH
+    start = time.monotonic()
+    releasepoints = getUSCReleasePoints()
+    if not releasepoints:
+        logger.error('Could not get the release point index')
+        return None
+
+    manifest = SyncManifest()
+    jobs = getDownloadJobs(releasepoints, manifest=manifest)
+    manifest.save()
+    extractIndex = ExtractIndex() if extractMode == 'link' else None
+    saver = ReleasepointSaver(manifest, extractIndex)
+    stats = DownloadStats()
+    workers = configureDownloads(workers, perHostMax)
+    logger.info(
+        '{} title zips to download ({} conditional)'.format(
+            len(jobs), sum(1 for job in jobs if job['conditional'])
+        )
+    )
+
+    ledger = LoadLedger(ledgerPath)
+    changeIndex = None
+    downloader = ThreadPoolExecutor(max_workers=workers)
+    loader = None
+    results = []
+    loaded = 0
+    skipped = 0
+    downloads = {}
+
+    def submitDownloads(jobs):
+        saver.expect(jobs)
+        for job in jobs:
+            future = downloader.submit(
+                getAndUnzipTitle,
+                stats=stats,
+                manifest=manifest,
+                extractIndex=extractIndex,
+                **job
+            )
+            future.add_done_callback(lambda future, name=job['name']: saver.done(name))
+            downloads.setdefault(job['name'], []).append(future)
+
+    try:
+        if all(job['conditional'] for job in jobs):
+            # At most conditional GETs of the current release point: run them first, since if they bring nothing
+            # new and every release point was loaded, there is no schedule to build and nothing to load
+            submitDownloads(jobs)
+            wait([future for futures in downloads.values() for future in futures])
+            jobs = []
+        if jobs or stats.zips or hasPendingLoads(releasepoints, manifest, ledger):
+            schedule = getReleasePointSchedule(releasepoints, publawsDict)
+            scheduled = {rpname for _, rpnames in schedule for rpname in rpnames}
+            manifest.setLoadStatus(
+                [
+                    releasepoint.get('name')
+                    for releasepoint in releasepoints
+                    if releasepoint.get('url')
+                    and releasepoint.get('name') not in scheduled
+                ],
+                'unscheduled',
+            )
+
+            # Oldest release points first, so that the first dates can be loaded while the rest download
+            order = {}
+            for release_date, rpnames in schedule:
+                for rpname in rpnames:
+                    order.setdefault(rpname, len(order))
+            jobs.sort(key=lambda job: order.get(job['name'], len(order)))
+            submitDownloads(jobs)
+
+            changeIndex = ChangeIndex(changeIndexPath) if changeIndexPath else None
+            loader = (
+                ThreadPoolExecutor(max_workers=max(1, int(loadWorkers)))
+                if loadMode == 'title'
+                else None
+            )
+            for release_date, rpnames in schedule:
+                pending = [
+                    future for rpname in rpnames for future in downloads.get(rpname, [])
+                ]
+                if pending:
+                    wait(pending)
+                if any(future.exception() or not future.result() for future in pending):
+                    # Do not load a date with a missing title; a later run will download and load it
+                    logger.error(
+                        'Not loading '
+                        + release_date
+                        + ': download failed for '
+                        + ', '.join(rpnames)
+                    )
+                    break
+                dateResults = loadDate(
+                    release_date,
+                    rpnames,
+                    ledger=ledger,
+                    executor=loader,
+                    reconcile=reconcile,
+                    changeIndex=changeIndex,
+                )
+                if dateResults is None:
+                    skipped += 1
+                else:
+                    results.extend(dateResults)
+                    if any(result['returncode'] != 0 for result in dateResults):
+                        # Later dates would be loaded over an incomplete version; a later run retries this one
+                        logger.error(
+                            'Not loading the dates after {}: some of its loads failed'.format(
+                                release_date
+                            )
+                        )
+                        break
+                    loaded += 1
+                manifest.setLoadStatus(rpnames, 'loaded')
+            if changeIndex:
+                updateChangeIndex(changeIndex, ledger)
+    finally:
+        for futures in downloads.values():
+            for future in futures:
+                future.cancel()
+        downloader.shutdown()
+        if loader:
+            loader.shutdown()
+        saver.save()
+        ledger.close()
+        if changeIndex:
+            changeIndex.close()
+    logger.info(stats.summary())
+    if loadMode == 'title' and results:
+        logSlowestTitles(results)
+    summary = {
+        'downloaded': stats.zips,
+        'failedDownloads': stats.failed
+        + sum(
+            1
+            for futures in downloads.values()
+            for future in futures
+            if future.done() and not future.cancelled() and future.exception()
+        ),
+        'loaded': loaded,
+        'skipped': skipped,
+        'failedLoads': sum(1 for result in results if result['returncode'] != 0),
+        'seconds': time.monotonic() - start,
+    }
+    if not stats.zips and not results:
+        logger.info('Nothing changed')
+    logger.info(json.dumps(summary))
+    return summary
+
+
+def main(argv=None):
+    """
+    Run the command line
+
+    Returns:
+        int: the exit status: 1 if the release point index could not be had, or a download or a load failed
+    """
+    logging.basicConfig(filename='loadusc.log', filemode='a', level='INFO')
+    settings = getSettings()
+    parser = argparse.ArgumentParser(
+        prog='loadusc', description='Download and load USC release points.', epilog=''
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    sync_parser = subparsers.add_parser(
+        'sync',
+        help='Download the new or changed release points and load them into XCiteDB',
+    )
+    sync_parser.add_argument(
+        '-w',
+        '--workers',
+        action='store',
+        dest='workers',
+        type=int,
+        default=settings.DOWNLOAD_WORKERS,
+        help='Number of zips to download at the same time (default: %(default)s)',
+    )
+    sync_parser.add_argument(
+        '--per-host',
+        action='store',
+        dest='perHostMax',
+        type=int,
+        default=settings.DOWNLOAD_PER_HOST_MAX,
+        help='Maximum simultaneous downloads from one host (default: %(default)s)',
+    )
+    sync_parser.add_argument(
+        '-x',
+        '--extract',
+        action='store',
+        dest='extractMode',
+        choices=['link', 'all'],
+        default=settings.EXTRACT_MODE,
+        help='Extract to the blob store and hard-link, or write all files (default: %(default)s)',
+    )
+    sync_parser.add_argument(
+        '-m',
+        '--load-mode',
+        action='store',
+        dest='loadMode',
+        choices=['releasepoint', 'title'],
+        default='releasepoint',
+        help='Load each release point with one load-xml -r, or each title file with its own load-xml '
+        '(default: %(default)s)',
+    )
+    sync_parser.add_argument(
+        '--load-workers',
+        action='store',
+        dest='loadWorkers',
+        type=int,
+        default=settings.LOAD_WORKERS,
+        help='Number of titles loaded at the same time, in title load mode (default: %(default)s)',
+    )
+    sync_parser.add_argument(
+        '--reconcile',
+        action='store_true',
+        dest='reconcile',
+        help='For dates not in the load ledger, check the XCiteDB log before loading them',
+    )
+    args = parser.parse_args(argv)
+    settings.validate()
+
+    command = vars(args).pop('command')
+    logger.info(json.dumps(vars(args)))
+    logger.info('===============================')
+    if command == 'sync':
+        summary = syncUSC(**vars(args))
+        if summary is None or summary['failedDownloads'] or summary['failedLoads']:
+            return 1
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
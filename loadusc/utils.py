@@ -4,7 +4,7 @@
 
 import datetime
 from bson import json_util
-from loadusc.constants import META_JSON_PATH, PUBLAWS_DICT_JSON_PATH
+from loadusc.settings import getSettings
 
 
 def convertDTToDate(datetimeItem):
@@ -21,8 +21,9 @@ def plArrayToDict(publaws):
 
 
 def savePublawDict():
-    with open(META_JSON_PATH, 'r') as f:
+    settings = getSettings()
+    with open(settings.META_JSON_PATH, 'r') as f:
         metaDict = json_util.loads(f.read())
     plDict = plArrayToDict(metaDict.get('publaws'))
-    with open(PUBLAWS_DICT_JSON_PATH, 'w') as f_pl:
+    with open(settings.PUBLAWS_DICT_JSON_PATH, 'w') as f_pl:
         f_pl.write(json_util.dumps(plDict))
@@ -23,6 +23,7 @@ setuptools.setup(
     url="https://github.com/aih/versions/loadusc",
     packages=setuptools.find_packages(),
     package_data={'loadusc': ['data/*.json']},
+    entry_points={'console_scripts': ['loadusc=loadusc.sync:main']},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: None",
@@ -2,5 +2,4 @@ eval "$(pyenv init -)"
 eval "$(pyenv virtualenv-init -)"
 pyenv activate v37
 pyenv version
-~/.pyenv/shims/python /main/loadusc/loadusc/downloadusc.py 
-~/.pyenv/shims/python /main/loadusc/loadusc/loaduscxcite.py
\ No newline at end of file
+~/.pyenv/shims/python /main/loadusc/loadusc/sync.py sync
\ No newline at end of file